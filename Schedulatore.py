@@ -26,6 +26,7 @@ if not st.session_state.logged_in:
         if success:
             st.session_state.logged_in = True
             st.session_state.role = role
+            st.session_state.username = username
             # Naviga direttamente alla pagina di caricamento dati
             st.switch_page("pages/1_Caricamento_Dati.py")
 
@@ -36,6 +37,7 @@ else:
         if st.button("🔓 Logout"):
             st.session_state.logged_in = False
             st.session_state.role = None
+            st.session_state.username = None
             # Torna alla schermata di Login
             st.switch_page("Schedulatore.py")  # oppure semplicemente st.rerun() se vuoi restare qui
 
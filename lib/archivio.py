@@ -0,0 +1,258 @@
+"""
+lib/archivio.py
+Archivio locale delle esecuzioni (run) per le interrogazioni tra run diverse.
+
+Ogni scenario completato da un job (simulazione, ripianificazione, what-if) diventa una run
+in un database SQLite: configurazione e KPI (tabella `runs`), fasi pianificate dei lotti
+(`fasi`, con le durate medie per fase e macchina già aggregate in `durate`) e log eventi
+(`eventi`). Gli indici su run, lotto, fase e macchina tengono sotto il secondo le
+interrogazioni tipiche anche con mesi di run: storia di un lotto nelle ultime
+ripianificazioni, andamento dei KPI, deriva delle durate per fase o macchina.
+I tempi sono salvati come testo ISO ('YYYY-MM-DD HH:MM:SS'), ordinabile e confrontabile in SQL.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+from lib.kpi import calcola_kpi, COLONNE_KPI
+
+ARCHIVIO_DIR = os.environ.get(
+    'SCHEDULATORE_ARCHIVIO_DIR', os.path.join(tempfile.gettempdir(), 'schedulatore_archivio')
+)
+# Colonne archiviate di df_risultati e del log eventi (le mancanti restano NULL)
+COLONNE_FASI = ['ID_Lotto', 'Fase', 'Macchina', 'Start', 'End', 'TimestampStart', 'TimestampEnd', 'Scadenza']
+COLONNE_EVENTI = ['ID_Lotto', 'Formato', 'Fase', 'Macchina', 'Evento', 'SimTime', 'Timestamp',
+                  'DurataChunkEffettiva', 'TipoAttesa', 'DurataAttesa']
+RAGGRUPPAMENTI_DERIVA = ('Fase', 'Macchina')
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    job_id      TEXT,
+    scenario    TEXT,
+    owner       TEXT,
+    tipo        TEXT,
+    creato      REAL NOT NULL,
+    n_lotti     INTEGER,
+    config      TEXT,
+    {', '.join(f'{k} REAL' for k in COLONNE_KPI)}
+);
+CREATE INDEX IF NOT EXISTS idx_runs_owner ON runs (owner, creato);
+CREATE TABLE IF NOT EXISTS fasi (
+    run_id TEXT NOT NULL, ID_Lotto TEXT, Fase TEXT, Macchina TEXT, Start REAL, End REAL,
+    TimestampStart TEXT, TimestampEnd TEXT, Scadenza TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_fasi_run ON fasi (run_id);
+CREATE INDEX IF NOT EXISTS idx_fasi_lotto ON fasi (ID_Lotto, run_id);
+CREATE INDEX IF NOT EXISTS idx_fasi_fase ON fasi (Fase, run_id);
+CREATE INDEX IF NOT EXISTS idx_fasi_macchina ON fasi (Macchina, run_id);
+-- Durate medie per run e Fase/Macchina, aggregate all'archiviazione per le viste di deriva
+CREATE TABLE IF NOT EXISTS durate (
+    run_id TEXT NOT NULL, Raggruppamento TEXT, Valore TEXT, Durata_media_min REAL, N_fasi INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_durate_run ON durate (run_id, Raggruppamento);
+CREATE TABLE IF NOT EXISTS eventi (
+    run_id TEXT NOT NULL, ID_Lotto TEXT, Formato TEXT, Fase TEXT, Macchina TEXT, Evento TEXT,
+    SimTime REAL, Timestamp TEXT, DurataChunkEffettiva REAL, TipoAttesa TEXT, DurataAttesa REAL
+);
+CREATE INDEX IF NOT EXISTS idx_eventi_run ON eventi (run_id);
+CREATE INDEX IF NOT EXISTS idx_eventi_lotto ON eventi (ID_Lotto, run_id);
+CREATE INDEX IF NOT EXISTS idx_eventi_fase ON eventi (Fase, run_id);
+CREATE INDEX IF NOT EXISTS idx_eventi_macchina ON eventi (Macchina, run_id);
+"""
+
+
+def _testo_istanti(df):
+    """Colonne datetime -> testo ISO, per confronti e ordinamenti in SQL."""
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return df
+
+
+def _colonne(df, colonne):
+    return _testo_istanti(df.reindex(columns=colonne))
+
+
+class ArchivioRun:
+    """Run archiviate su SQLite. Usare `get_archivio()`."""
+
+    def __init__(self, base_dir=ARCHIVIO_DIR):
+        os.makedirs(base_dir, exist_ok=True)
+        self.db_path = os.path.join(base_dir, 'archivio.sqlite')
+        self._lock = threading.Lock()
+        with self._connessione() as con:
+            con.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connessione(self):
+        """Connessione SQLite con commit all'uscita e chiusura garantita."""
+        con = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _query(self, sql, parametri=()):
+        with self._connessione() as con:
+            return pd.read_sql_query(sql, con, params=parametri)
+
+    # -- Scrittura ----------------------------------------------------------
+    def archivia(self, frames, config, job_id=None, scenario=None, owner=None, tipo=None):
+        """
+        Archivia una run: `frames` è il dict dei risultati di uno scenario (df_risultati,
+        df_persone, df_energia, df_carrelli e, se presente, df_eventi). Restituisce il run_id.
+        """
+        df_risultati = frames['df_risultati']
+        kpi = calcola_kpi(df_risultati, frames['df_persone'], frames['df_energia'], frames['df_carrelli'], config)
+        run_id = uuid.uuid4().hex[:12]
+        riga = {
+            'run_id': run_id, 'job_id': job_id, 'scenario': scenario, 'owner': owner, 'tipo': tipo,
+            'creato': time.time(), 'n_lotti': int(df_risultati['ID_Lotto'].nunique()) if not df_risultati.empty else 0,
+            'config': json.dumps(config, default=str), **{k: kpi[k] for k in COLONNE_KPI},
+        }
+        fasi = _colonne(df_risultati, COLONNE_FASI).assign(run_id=run_id)
+        durata = pd.to_numeric(fasi['End']) - pd.to_numeric(fasi['Start'])
+        durate = pd.concat([
+            fasi.assign(Durata=durata).groupby(per, as_index=False)
+            .agg(Durata_media_min=('Durata', 'mean'), N_fasi=('Durata', 'size'))
+            .rename(columns={per: 'Valore'}).assign(Raggruppamento=per)
+            for per in RAGGRUPPAMENTI_DERIVA
+        ], ignore_index=True).assign(run_id=run_id)
+        eventi = frames.get('df_eventi')
+        eventi = (_colonne(eventi, COLONNE_EVENTI).assign(run_id=run_id)
+                  if eventi is not None else pd.DataFrame(columns=['run_id'] + COLONNE_EVENTI))
+        with self._lock, self._connessione() as con:
+            con.execute(f"INSERT INTO runs ({', '.join(riga)}) VALUES ({', '.join('?' * len(riga))})",
+                        tuple(riga.values()))
+            fasi.to_sql('fasi', con, if_exists='append', index=False)
+            durate.to_sql('durate', con, if_exists='append', index=False)
+            eventi.to_sql('eventi', con, if_exists='append', index=False)
+        return run_id
+
+    def elimina(self, run_ids):
+        """Rimuove le run indicate con le loro fasi ed eventi."""
+        segnaposto = ', '.join('?' * len(run_ids))
+        with self._lock, self._connessione() as con:
+            for tabella in ('eventi', 'durate', 'fasi', 'runs'):
+                con.execute(f"DELETE FROM {tabella} WHERE run_id IN ({segnaposto})", tuple(run_ids))
+
+    # -- Interrogazioni -------------------------------------------------------
+    def elenca(self, owner=None, tipi=None, limite=200):
+        """Run dalla più recente (senza la config), con i KPI e l'istante di creazione 'Creato'."""
+        condizioni, parametri = [], []
+        if owner is not None:
+            condizioni.append("owner = ?"); parametri.append(owner)
+        if tipi:
+            condizioni.append(f"tipo IN ({', '.join('?' * len(tipi))})"); parametri.extend(tipi)
+        where = f"WHERE {' AND '.join(condizioni)}" if condizioni else ""
+        df = self._query(
+            f"SELECT run_id, job_id, scenario, owner, tipo, creato, n_lotti, {', '.join(COLONNE_KPI)} "
+            f"FROM runs {where} ORDER BY creato DESC LIMIT ?", (*parametri, limite)
+        )
+        df['Creato'] = pd.to_datetime(df['creato'], unit='s')
+        return df
+
+    def config(self, run_id):
+        """Configurazione (dict) di una run."""
+        with self._connessione() as con:
+            riga = con.execute("SELECT config FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if riga is None:
+            raise KeyError(f"Run non trovata: {run_id}")
+        return json.loads(riga[0])
+
+    def storia_lotto(self, id_lotto, run_ids):
+        """
+        Fasi pianificate di un lotto nelle run indicate (es. le ultime ripianificazioni), con
+        l'istante di creazione della run: mostra come il lotto si è spostato tra un piano e l'altro.
+        """
+        if not run_ids:
+            return pd.DataFrame(columns=['scenario', 'creato', 'run_id'] + COLONNE_FASI)
+        segnaposto = ', '.join('?' * len(run_ids))
+        df = self._query(
+            "SELECT r.scenario, r.creato, f.* FROM fasi f JOIN runs r ON r.run_id = f.run_id "
+            f"WHERE f.ID_Lotto = ? AND f.run_id IN ({segnaposto}) ORDER BY r.creato, f.Start",
+            (str(id_lotto), *run_ids)
+        )
+        df['Creato'] = pd.to_datetime(df['creato'], unit='s')
+        for col in ('TimestampStart', 'TimestampEnd', 'Scadenza'):
+            df[col] = pd.to_datetime(df[col])
+        return df
+
+    def spostamenti_lotti(self, run_ids):
+        """
+        Fine pianificata di ogni lotto per run (una colonna per run, in ordine di creazione) e
+        spostamento tra la prima e l'ultima run in minuti ('Spostamento_min', positivo = più tardi).
+        """
+        if not run_ids:
+            return pd.DataFrame()
+        segnaposto = ', '.join('?' * len(run_ids))
+        df = self._query(
+            "SELECT f.ID_Lotto, f.run_id, r.creato, MAX(f.TimestampEnd) AS Fine FROM fasi f "
+            f"JOIN runs r ON r.run_id = f.run_id WHERE f.run_id IN ({segnaposto}) "
+            "GROUP BY f.ID_Lotto, f.run_id", tuple(run_ids)
+        )
+        if df.empty:
+            return pd.DataFrame()
+        df['Fine'] = pd.to_datetime(df['Fine'])
+        ordine = df.drop_duplicates('run_id').sort_values('creato')['run_id'].tolist()
+        tabella = df.pivot(index='ID_Lotto', columns='run_id', values='Fine')[ordine]
+        tabella['Spostamento_min'] = (tabella[ordine[-1]] - tabella[ordine[0]]) / pd.Timedelta(minutes=1)
+        return tabella.sort_values('Spostamento_min', ascending=False, key=abs)
+
+    def deriva(self, run_ids, per='Fase'):
+        """
+        Durata media pianificata (End - Start, minuti) e numero di fasi per run e per Fase o
+        Macchina: un valore che cambia tra le run indica una deriva del piano.
+        """
+        if per not in RAGGRUPPAMENTI_DERIVA:
+            raise ValueError(f"Raggruppamento non valido: {per}")
+        if not run_ids:
+            return pd.DataFrame(columns=['run_id', per, 'Durata_media_min', 'N_fasi', 'Creato'])
+        segnaposto = ', '.join('?' * len(run_ids))
+        df = self._query(
+            f"SELECT d.run_id, d.Valore AS {per}, d.Durata_media_min, d.N_fasi, r.creato FROM durate d "
+            f"JOIN runs r ON r.run_id = d.run_id WHERE d.Raggruppamento = ? AND d.run_id IN ({segnaposto}) "
+            "ORDER BY r.creato", (per, *run_ids)
+        )
+        df['Creato'] = pd.to_datetime(df.pop('creato'), unit='s')
+        return df
+
+    def eventi(self, run_id, id_lotto=None, fase=None, macchina=None):
+        """Log eventi di una run, filtrabile per lotto, fase e macchina."""
+        condizioni, parametri = ["run_id = ?"], [run_id]
+        for colonna, valore in (('ID_Lotto', id_lotto), ('Fase', fase), ('Macchina', macchina)):
+            if valore is not None:
+                condizioni.append(f"{colonna} = ?"); parametri.append(str(valore))
+        df = self._query(f"SELECT * FROM eventi WHERE {' AND '.join(condizioni)} ORDER BY SimTime", parametri)
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+        return df
+
+    def statistiche(self):
+        """Numero di run, fasi ed eventi archiviati e dimensione del file (MB)."""
+        with self._connessione() as con:
+            conteggi = {t: con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ('runs', 'fasi', 'eventi')}
+        return {**conteggi, 'mb': os.path.getsize(self.db_path) / 1e6}
+
+
+_archivio = None
+_archivio_lock = threading.Lock()
+
+
+def get_archivio():
+    """Istanza unica dell'archivio per il processo server (condivisa tra le sessioni)."""
+    global _archivio
+    with _archivio_lock:
+        if _archivio is None:
+            _archivio = ArchivioRun()
+        return _archivio
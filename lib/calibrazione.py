@@ -0,0 +1,141 @@
+"""
+lib/calibrazione.py
+Calibrazione delle durate delle fasi dai dati reali del consultivo (Start_Actual/End_Actual).
+
+Per ogni fase eseguita si calcola il rapporto durata reale / durata teorica (la stessa del
+simulatore: quantità / Pezzi x Tempo, tempo fisso per AUTOCLAVI), entrambe in minuti
+lavorativi sul calendario dei turni. I rapporti anomali sono
+scartati per gruppo (Fase, Formato, Macchina) con lo z-score robusto (mediana e MAD del
+logaritmo); per ogni gruppo con abbastanza campioni la tabella delle distribuzioni riporta i
+quantili del rapporto (COLONNE_QUANTILI di lib/simulator.py), dai quali il simulatore estrae
+in blocco per inversione (`df_distribuzioni_durate`). Si calibrano anche i livelli (Fase,
+Formato) e Fase ('*' nelle colonne generalizzate), usati come ripiego per i gruppi rari.
+Tutte le operazioni sono merge e groupby vettoriali: milioni di righe restano gestibili.
+"""
+import numpy as np
+import pandas as pd
+
+from lib.simulator import QUANTILI_DURATE, COLONNE_QUANTILI, TUTTI, minuti_lavorativi
+
+COLONNE_DISTRIBUZIONI = ['Fase', 'Formato', 'Macchina', 'N', 'N_scartati', 'Mediana', 'Sigma_log'] + COLONNE_QUANTILI
+LIVELLI = (('Fase', 'Formato', 'Macchina'), ('Fase', 'Formato'), ('Fase',))
+# Fattore che rende la MAD stimatore della deviazione standard per dati normali
+_COSTANTE_MAD = 0.6745
+
+
+def rapporti_durata(df_consultivo, df_lotti, df_fasi, config=None):
+    """
+    Una riga per fase completata del consultivo: Fase, Formato, Macchina, Durata_reale,
+    Durata_teorica (minuti) e Rapporto. La durata reale è in minuti lavorativi sul calendario
+    dei turni di `config` (`minuti_lavorativi` di lib/simulator.py), come quella teorica: una
+    fase che scavalca la fine del turno non risulta più lenta. Formato, quantità e prodotto vengono dal consultivo
+    se presenti (storico di lotti non più in df_lotti), altrimenti da df_lotti; la macchina
+    dal consultivo o dalla prima riga della fase in df_fasi. Sono escluse le fasi senza
+    durata teorica (passive, Pezzi nullo) e quelle non concluse o con durata non positiva.
+    """
+    mancanti = {'ID_Lotto', 'Fase', 'Start_Actual', 'End_Actual'} - set(df_consultivo.columns)
+    if mancanti:
+        raise KeyError(f"df_consultivo mancano le colonne: {mancanti}")
+    col_id_lotto = 'Lotto' if 'Lotto' in df_lotti.columns else 'ID_Lotto'
+    col_quantita = 'Quantità' if 'Quantità' in df_lotti.columns else 'Quantita'
+    tempo_col = 'Tempo_Minuti' if 'Tempo_Minuti' in df_fasi.columns else 'Tempo'
+    mancanti = {'Fase', 'Macchina', tempo_col, 'Pezzi'} - set(df_fasi.columns)
+    if mancanti:
+        raise KeyError(f"df_fasi mancano le colonne: {mancanti}")
+
+    inizio = pd.to_datetime(df_consultivo['Start_Actual'])
+    fine = pd.to_datetime(df_consultivo['End_Actual'])
+    concluse = (inizio.notna() & fine.notna()).to_numpy()
+    durata_reale = np.full(len(df_consultivo), np.nan)
+    durata_reale[concluse] = minuti_lavorativi(inizio[concluse], fine[concluse],
+                                               df_consultivo['Fase'][concluse], config)
+    reali = pd.DataFrame({
+        'ID_Lotto': df_consultivo['ID_Lotto'].astype(str),
+        'Fase': df_consultivo['Fase'],
+        'Durata_reale': durata_reale,
+    })
+    lotti = pd.DataFrame({'ID_Lotto': df_lotti[col_id_lotto].astype(str)})
+    for colonna, sorgente in (('Formato', 'Formato'), ('Quantita', col_quantita), ('Prodotto', 'Prodotto')):
+        valori_lotti = (df_lotti[sorgente] if sorgente in df_lotti.columns
+                        else pd.Series(np.nan, index=df_lotti.index))
+        lotti[colonna] = valori_lotti.to_numpy()
+        propri = next((c for c in (colonna, sorgente) if c in df_consultivo.columns), None)
+        reali[colonna] = df_consultivo[propri].to_numpy() if propri else np.nan
+    lotti = lotti.drop_duplicates('ID_Lotto').set_index('ID_Lotto')
+    for colonna in ('Formato', 'Quantita', 'Prodotto'):
+        reali[colonna] = reali[colonna].fillna(reali['ID_Lotto'].map(lotti[colonna]))
+    reali['Quantita'] = pd.to_numeric(reali['Quantita'], errors='coerce')
+    if reali['Formato'].isna().all():
+        raise ValueError("Nessun formato per i lotti del consultivo: servono 'Formato' nel consultivo o i lotti in df_lotti")
+
+    # Parametri della fase: per (Prodotto, Fase) se c'è il prodotto, altrimenti la prima riga della fase
+    fasi = df_fasi.assign(**{tempo_col: pd.to_numeric(df_fasi[tempo_col], errors='coerce'),
+                             'Pezzi': pd.to_numeric(df_fasi['Pezzi'], errors='coerce')})
+    per_fase = fasi.drop_duplicates('Fase').set_index('Fase')
+    tempo = reali['Fase'].map(per_fase[tempo_col])
+    pezzi = reali['Fase'].map(per_fase['Pezzi'])
+    macchina = reali['Fase'].map(per_fase['Macchina'])
+    if 'Prodotto' in fasi.columns:
+        per_prodotto = fasi.drop_duplicates(['Prodotto', 'Fase']).set_index(['Prodotto', 'Fase'])
+        indice = pd.MultiIndex.from_arrays([reali['Prodotto'], reali['Fase']])
+        tempo = pd.Series(per_prodotto[tempo_col].reindex(indice).to_numpy(), index=reali.index).fillna(tempo)
+        pezzi = pd.Series(per_prodotto['Pezzi'].reindex(indice).to_numpy(), index=reali.index).fillna(pezzi)
+        macchina = pd.Series(per_prodotto['Macchina'].reindex(indice).to_numpy(), index=reali.index).fillna(macchina)
+    if 'Macchina' in df_consultivo.columns:
+        macchina = pd.Series(df_consultivo['Macchina'].to_numpy(), index=reali.index).fillna(macchina)
+    reali['Macchina'] = macchina
+
+    tempo = tempo.to_numpy(dtype=float)
+    pezzi = pezzi.to_numpy(dtype=float)
+    quantita = reali['Quantita'].to_numpy(dtype=float)
+    per_pezzi = np.divide(quantita * tempo, pezzi, out=np.full(len(reali), np.nan), where=pezzi > 0)
+    reali['Durata_teorica'] = np.where(reali['Fase'].to_numpy() == 'AUTOCLAVI', tempo, per_pezzi)
+    validi = (reali['Durata_teorica'] > 0) & (reali['Durata_reale'] > 0) & reali['Formato'].notna()
+    reali = reali[validi]
+    return reali.assign(Rapporto=reali['Durata_reale'] / reali['Durata_teorica'])[
+        ['ID_Lotto', 'Fase', 'Formato', 'Macchina', 'Durata_reale', 'Durata_teorica', 'Rapporto']
+    ].reset_index(drop=True)
+
+
+def scarta_anomali(df_rapporti, soglia=3.5):
+    """
+    Maschera booleana dei rapporti da tenere: |z robusto| <= soglia nel gruppo (Fase, Formato,
+    Macchina), con z = 0.6745 (log r - mediana) / MAD. I gruppi con MAD nulla tengono tutto.
+    """
+    log_r = np.log(df_rapporti['Rapporto'])
+    gruppi = df_rapporti.groupby(list(LIVELLI[0]), dropna=False, sort=False).ngroup()
+    mediana = log_r.groupby(gruppi).transform('median')
+    mad = (log_r - mediana).abs().groupby(gruppi).transform('median')
+    z = np.divide(_COSTANTE_MAD * (log_r - mediana), mad, out=np.zeros(len(log_r)), where=mad.to_numpy() > 0)
+    return pd.Series(np.abs(z) <= soglia, index=df_rapporti.index)
+
+
+def calibra_durate(df_rapporti, min_campioni=20, soglia_outlier=3.5):
+    """
+    Tabella delle distribuzioni (COLONNE_DISTRIBUZIONI) da `rapporti_durata`: una riga per
+    gruppo di ogni livello (LIVELLI) con almeno `min_campioni` rapporti dopo lo scarto degli
+    anomali. Mediana e quantili sono del rapporto reale / teorico, Sigma_log è la deviazione
+    standard del suo logaritmo; N_scartati conta gli anomali del gruppo.
+    """
+    if df_rapporti.empty:
+        return pd.DataFrame(columns=COLONNE_DISTRIBUZIONI)
+    tenuti = scarta_anomali(df_rapporti, soglia_outlier)
+    dati = df_rapporti.assign(Tenuto=tenuti, LogRapporto=np.log(df_rapporti['Rapporto']))
+    tabelle = []
+    for chiavi in LIVELLI:
+        chiavi = list(chiavi)
+        buoni = dati[dati['Tenuto']]
+        quantili = buoni.groupby(chiavi, sort=False)['Rapporto'].quantile(QUANTILI_DURATE).unstack()
+        quantili.columns = COLONNE_QUANTILI
+        sintesi = buoni.groupby(chiavi, sort=False).agg(N=('Rapporto', 'size'), Sigma_log=('LogRapporto', 'std'))
+        sintesi['N_scartati'] = (~dati['Tenuto']).groupby([dati[c] for c in chiavi], sort=False).sum()
+        tabella = sintesi.join(quantili).reset_index()
+        for colonna in LIVELLI[0]:
+            if colonna not in chiavi:
+                tabella[colonna] = TUTTI
+        tabelle.append(tabella[tabella['N'] >= min_campioni])
+    risultato = pd.concat(tabelle, ignore_index=True)
+    risultato['Mediana'] = risultato['Q050']
+    risultato['N_scartati'] = risultato['N_scartati'].fillna(0).astype(int)
+    risultato['Sigma_log'] = risultato['Sigma_log'].fillna(0.0)
+    return risultato[COLONNE_DISTRIBUZIONI].astype({'Fase': str, 'Formato': str, 'Macchina': str})
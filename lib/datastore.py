@@ -0,0 +1,220 @@
+"""
+lib/datastore.py
+Archivio condiviso (per processo server) delle tabelle di input e dei risultati di simulazione.
+
+- Le tabelle identiche vengono deduplicate per hash del contenuto: più sessioni che caricano
+  lo stesso file condividono un solo DataFrame. I DataFrame condivisi vanno trattati in sola
+  lettura (il simulatore non li modifica).
+- I risultati degli scenari sono conservati come tabelle Arrow; `RisultatoScenario` è un
+  Mapping che li converte in pandas solo quando una pagina li legge.
+- Ogni voce ha un contatore di riferimenti (sessioni o handle di risultato ancora vivi) e
+  viene eliminata quando arriva a zero. Se la memoria occupata supera il budget, le voci di
+  risultato meno usate di recente vengono scritte su disco in Parquet e ricaricate on demand.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STORE_DIR = os.environ.get(
+    'SCHEDULATORE_STORE_DIR', os.path.join(tempfile.gettempdir(), 'schedulatore_store')
+)
+# Budget di memoria per le tabelle Arrow dei risultati, oltre il quale si scrive su disco
+BUDGET_MEMORIA_MB = float(os.environ.get('SCHEDULATORE_STORE_MB', 1024))
+
+
+def hash_tabella(df):
+    """Hash del contenuto di un DataFrame (valori, indice, nomi e tipi delle colonne)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class _TokenSessione:
+    """Oggetto salvato in session_state: quando la sessione viene distrutta rilascia le sue tabelle."""
+    __slots__ = ('__weakref__',)
+
+
+class _Voce:
+    __slots__ = ('df', 'tabella', 'percorso', 'nbytes', 'refs')
+
+    def __init__(self, df=None, tabella=None):
+        self.df = df              # input: DataFrame condiviso (sempre in memoria)
+        self.tabella = tabella    # risultato: pa.Table, None se scritto su disco
+        self.percorso = None      # file Parquet quando la voce è su disco
+        self.nbytes = tabella.nbytes if tabella is not None else int(df.memory_usage(deep=True).sum())
+        self.refs = 0
+
+
+class DataStore:
+    """Usare `get_data_store()`; tutti i metodi sono thread-safe."""
+
+    def __init__(self, base_dir=STORE_DIR, budget_mb=BUDGET_MEMORIA_MB):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._lock = threading.RLock()
+        self._voci = OrderedDict()   # chiave -> _Voce, in ordine LRU (più recente in fondo)
+        self._slot_sessioni = {}     # id(token) -> {slot: chiave}
+
+    # -- Contatori --------------------------------------------------------
+    def _acquisisci(self, chiave):
+        self._voci[chiave].refs += 1
+
+    def _rilascia(self, chiave):
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is None:
+                return
+            voce.refs -= 1
+            if voce.refs <= 0:
+                del self._voci[chiave]
+                if voce.percorso and os.path.exists(voce.percorso):
+                    os.remove(voce.percorso)
+
+    def _rilascia_sessione(self, token_id):
+        with self._lock:
+            for chiave in self._slot_sessioni.pop(token_id, {}).values():
+                self._rilascia(chiave)
+
+    # -- Tabelle di input -------------------------------------------------
+    def token_sessione(self, session_state):
+        """Token della sessione (creato al primo uso) a cui legare le tabelle condivise."""
+        token = session_state.get('_datastore_token')
+        if token is None:
+            token = _TokenSessione()
+            session_state['_datastore_token'] = token
+            with self._lock:
+                self._slot_sessioni[id(token)] = {}
+            weakref.finalize(token, self._rilascia_sessione, id(token))
+        return token
+
+    def condividi(self, df, session_state, slot):
+        """
+        Registra `df` come tabella `slot` della sessione e restituisce l'istanza condivisa
+        con contenuto identico (se già presente) al posto di `df`.
+        """
+        if df is None:
+            return None
+        token = self.token_sessione(session_state)
+        chiave = 'in:' + hash_tabella(df)
+        with self._lock:
+            slots = self._slot_sessioni.setdefault(id(token), {})
+            precedente = slots.get(slot)
+            if precedente == chiave:
+                return self._voci[chiave].df
+            if chiave not in self._voci:
+                self._voci[chiave] = _Voce(df=df)
+            self._acquisisci(chiave)
+            slots[slot] = chiave
+            if precedente is not None:
+                self._rilascia(precedente)
+            return self._voci[chiave].df
+
+    # -- Risultati --------------------------------------------------------
+    def _registra_risultato(self, df):
+        tabella = pa.Table.from_pandas(df, preserve_index=False)
+        chiave = 'out:' + hash_tabella(df)
+        with self._lock:
+            if chiave not in self._voci:
+                self._voci[chiave] = _Voce(tabella=tabella)
+            self._acquisisci(chiave)
+            self._voci.move_to_end(chiave)
+            self._libera_memoria()
+        return chiave
+
+    def _tabella_risultato(self, chiave):
+        with self._lock:
+            voce = self._voci[chiave]
+            self._voci.move_to_end(chiave)
+            if voce.tabella is None:
+                voce.tabella = pq.read_table(voce.percorso)
+                self._libera_memoria(esclusa=chiave)
+            return voce.tabella
+
+    def _schema_risultato(self, chiave):
+        with self._lock:
+            voce = self._voci[chiave]
+            return voce.tabella.schema if voce.tabella is not None else pq.read_schema(voce.percorso)
+
+    def _libera_memoria(self, esclusa=None):
+        """Scrive su Parquet le voci di risultato più fredde finché si rientra nel budget."""
+        in_memoria = sum(v.nbytes for v in self._voci.values() if v.tabella is not None)
+        for chiave, voce in self._voci.items():
+            if in_memoria <= self.budget_bytes:
+                break
+            if voce.tabella is None or chiave == esclusa:
+                continue
+            if voce.percorso is None:
+                voce.percorso = os.path.join(self.base_dir, chiave.replace(':', '_') + '.parquet')
+                pq.write_table(voce.tabella, voce.percorso)
+            voce.tabella = None
+            in_memoria -= voce.nbytes
+
+    def salva_risultato(self, frames):
+        """Converte i DataFrame di uno scenario ({nome: df}) in un `RisultatoScenario`."""
+        return RisultatoScenario(self, {nome: self._registra_risultato(df) for nome, df in frames.items()})
+
+    def statistiche(self):
+        with self._lock:
+            voci = list(self._voci.values())
+        return {
+            'voci': len(voci),
+            'mb_in_memoria': sum(v.nbytes for v in voci if v.tabella is not None or v.df is not None) / 2**20,
+            'mb_su_disco': sum(v.nbytes for v in voci if v.tabella is None and v.df is None) / 2**20,
+        }
+
+
+class RisultatoScenario(Mapping):
+    """
+    Risultati di uno scenario ({'df_risultati': ..., 'df_persone': ..., ...}) conservati nel
+    DataStore. Ogni accesso restituisce un DataFrame nuovo, modificabile dalla pagina.
+    """
+
+    def __init__(self, store, chiavi):
+        self._store = store
+        self._chiavi = chiavi
+        for chiave in chiavi.values():
+            weakref.finalize(self, store._rilascia, chiave)
+
+    def __getitem__(self, nome):
+        return self._store._tabella_risultato(self._chiavi[nome]).to_pandas()
+
+    def tabella(self, nome):
+        """Tabella Arrow del risultato, senza conversione in pandas (per letture in streaming)."""
+        return self._store._tabella_risultato(self._chiavi[nome])
+
+    def schema(self, nome):
+        """Schema Arrow del risultato, senza ricaricare da disco la tabella."""
+        return self._store._schema_risultato(self._chiavi[nome])
+
+    def __iter__(self):
+        return iter(self._chiavi)
+
+    def __len__(self):
+        return len(self._chiavi)
+
+    def __reduce__(self):
+        # Serializzato (pickle) come dict di DataFrame
+        return (dict, (dict(self.items()),))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_data_store():
+    """Istanza unica dell'archivio per il processo server (condivisa tra le sessioni)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DataStore()
+        return _store
@@ -0,0 +1,262 @@
+"""
+lib/export.py
+Esportazione in un solo passaggio dei risultati di tutti gli scenari:
+- un file Excel (xlsxwriter in modalità constant_memory) con, per scenario, il log eventi,
+  una lista di dispacciamento per macchina e il piano operatori per giorno;
+- tre dataset Parquet (eventi, dispacciamento, turni_operatori) con colonna 'Scenario',
+  scritti a blocchi con pyarrow.ParquetWriter.
+
+Le tabelle sono lette come Arrow (RisultatoScenario.tabella) e scritte riga per riga da
+array NumPy: non si costruiscono DataFrame intermedi per foglio. Il log eventi ha colonne
+diverse a seconda delle funzioni usate dallo scenario (fasi a batch, aree, ...): il dataset
+eventi ha lo schema unione di tutti gli scenari, con null dove una colonna manca. In constant_memory
+xlsxwriter tiene in memoria una sola riga per foglio, quindi i fogli vengono scritti
+uno alla volta, in ordine di riga.
+"""
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+# Righe per blocco Parquet
+DIMENSIONE_BLOCCO = 50_000
+# Excel ammette al massimo 1.048.576 righe per foglio: oltre, la tabella continua su '<nome> (2)', ...
+MAX_RIGHE_EXCEL = 1_048_575
+
+COLONNE_DISPACCIAMENTO = ['Macchina', 'Sequenza', 'ID_Lotto', 'Fase', 'Inizio', 'Fine', 'Durata_min']
+COLONNE_TURNI = ['Giorno', 'Macchina', 'Fase', 'Addetti_max', 'Inizio', 'Fine', 'Minuti_operatore']
+
+
+def _tabella(risultato, nome):
+    """Tabella Arrow di un risultato (RisultatoScenario o dict di DataFrame), o None."""
+    if nome not in risultato:
+        return None
+    if hasattr(risultato, 'tabella'):
+        return risultato.tabella(nome)
+    return pa.Table.from_pandas(risultato[nome], preserve_index=False)
+
+
+def _schema(risultato, nome):
+    """Schema Arrow di un risultato, senza leggerne i dati quando possibile, o None."""
+    if nome not in risultato:
+        return None
+    if hasattr(risultato, 'schema'):
+        return risultato.schema(nome)
+    return pa.Schema.from_pandas(risultato[nome], preserve_index=False)
+
+
+def _colonna(tabella, nome):
+    return tabella.column(nome).to_numpy(zero_copy_only=False)
+
+
+class _NomiFogli:
+    """Nomi di foglio Excel validi (max 31 caratteri, senza []:*?/\\) e univoci."""
+
+    def __init__(self):
+        self._usati = set()
+
+    def __call__(self, nome):
+        base = ''.join('_' if c in '[]:*?/\\' else c for c in str(nome))[:31]
+        candidato, i = base, 1
+        while candidato.lower() in self._usati:
+            suffisso = f"~{i}"
+            candidato = base[:31 - len(suffisso)] + suffisso
+            i += 1
+        self._usati.add(candidato.lower())
+        return candidato
+
+    def continuazione(self, nome_foglio, parte):
+        """Foglio di continuazione '<nome_foglio> (parte)', troncato mantenendo l'eventuale '~i' finale."""
+        suffisso = f" ({parte})"
+        radice, marca = nome_foglio, ''
+        if '~' in nome_foglio and nome_foglio.rsplit('~', 1)[1].isdigit():
+            radice, numero = nome_foglio.rsplit('~', 1)
+            marca = f"~{numero}"
+        return self(radice[:31 - len(marca) - len(suffisso)] + marca + suffisso)
+
+
+def _scrivi_foglio(workbook, nomi_fogli, nome, intestazioni, colonne, formati):
+    """
+    Scrive una tabella riga per riga da una lista di array colonna, nel foglio `nome` (reso
+    valido da `nomi_fogli`, un _NomiFogli) e, oltre MAX_RIGHE_EXCEL righe, nei fogli di
+    continuazione '<nome> (2)', '<nome> (3)', ... con le stesse intestazioni.
+    """
+    n = len(colonne[0]) if colonne else 0
+    primo = nomi_fogli(nome)
+    for parte, inizio in enumerate(range(0, max(n, 1), MAX_RIGHE_EXCEL), start=1):
+        ws = workbook.add_worksheet(primo if parte == 1 else nomi_fogli.continuazione(primo, parte))
+        ws.write_row(0, 0, intestazioni, formati['intestazione'])
+        for r in range(min(n - inizio, MAX_RIGHE_EXCEL)):
+            for c, arr in enumerate(colonne):
+                v = arr[inizio + r]
+                if isinstance(v, (np.datetime64, pd.Timestamp)):
+                    if not pd.isna(v):
+                        ws.write_datetime(r + 1, c, pd.Timestamp(v).to_pydatetime(), formati['data'])
+                elif v is None or (isinstance(v, float) and np.isnan(v)):
+                    continue
+                elif isinstance(v, (np.integer, np.floating)):
+                    ws.write_number(r + 1, c, v.item())
+                else:
+                    ws.write(r + 1, c, v)
+        ws.freeze_panes(1, 0)
+
+
+def _dispacciamento(fasi):
+    """
+    Lista di dispacciamento: fasi ordinate per (Macchina, Inizio), con numero di sequenza
+    per macchina. Restituisce (colonne, confini) dove confini[i]:confini[i+1] è una macchina.
+    """
+    macchine = _colonna(fasi, 'Macchina').astype(object)
+    inizio = _colonna(fasi, 'TimestampStart')
+    codici, uniche = pd.factorize(macchine, sort=True)
+    ordine = np.lexsort((inizio, codici))
+    codici = codici[ordine]
+    confini = np.flatnonzero(np.r_[True, codici[1:] != codici[:-1], True])
+    sequenza = np.arange(len(ordine)) - np.repeat(confini[:-1], np.diff(confini))
+    start = _colonna(fasi, 'Start')[ordine]
+    end = _colonna(fasi, 'End')[ordine]
+    colonne = [macchine[ordine], sequenza + 1, _colonna(fasi, 'ID_Lotto')[ordine],
+               _colonna(fasi, 'Fase')[ordine], inizio[ordine],
+               _colonna(fasi, 'TimestampEnd')[ordine], end - start]
+    return colonne, confini
+
+
+def _turni_operatori(eventi):
+    """Per (giorno, macchina, fase): addetti massimi, primo inizio, ultima fine e minuti-operatore."""
+    tipo = _colonna(eventi, 'Evento').astype(object)
+    sel = tipo == 'INIZIO_CHUNK'
+    ts = _colonna(eventi, 'Timestamp')[sel].astype('datetime64[s]')
+    durata = np.nan_to_num(_colonna(eventi, 'DurataChunkPianificata')[sel].astype(float))
+    persone = np.nan_to_num(_colonna(eventi, 'PersoneRichieste')[sel].astype(float))
+    giorno = ts.astype('datetime64[D]').astype('datetime64[s]')
+    chiavi = pd.MultiIndex.from_arrays([giorno, _colonna(eventi, 'Macchina')[sel].astype(object),
+                                        _colonna(eventi, 'Fase')[sel].astype(object)])
+    codici, uniche = pd.factorize(chiavi, sort=True)
+    n = len(uniche)
+    fine = ts + np.round(durata * 60).astype('timedelta64[s]')
+    addetti = np.zeros(n); np.maximum.at(addetti, codici, persone)
+    minuti = np.zeros(n); np.add.at(minuti, codici, persone * durata)
+    inizio_min = np.full(n, np.datetime64('NaT'), dtype='datetime64[s]')
+    fine_max = np.full(n, np.datetime64('NaT'), dtype='datetime64[s]')
+    ordine = np.argsort(ts, kind='stable')
+    # primo inizio: la prima occorrenza di ogni codice in ordine di tempo
+    _, primi = np.unique(codici[ordine], return_index=True)
+    inizio_min[codici[ordine][primi]] = ts[ordine][primi]
+    ordine_fine = np.argsort(fine, kind='stable')[::-1]
+    _, ultimi = np.unique(codici[ordine_fine], return_index=True)
+    fine_max[codici[ordine_fine][ultimi]] = fine[ordine_fine][ultimi]
+    return [uniche.get_level_values(0).to_numpy(), uniche.get_level_values(1).to_numpy(),
+            uniche.get_level_values(2).to_numpy(), addetti, inizio_min, fine_max, minuti]
+
+
+class _ScrittoreParquet:
+    """
+    ParquetWriter aperto al primo blocco, con lo `schema` dato (comune a tutti gli scenari) o
+    quello del primo blocco. Le colonne dello schema assenti in un blocco diventano null tipizzati.
+    """
+
+    def __init__(self, percorso, schema=None):
+        self.percorso = percorso
+        self.schema = schema
+        self._writer = None
+
+    def scrivi(self, tabella):
+        if tabella.num_rows == 0:
+            return
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.percorso, self.schema or tabella.schema)
+        schema = self._writer.schema
+        for campo in schema:
+            if campo.name not in tabella.column_names:
+                tabella = tabella.append_column(campo.name, pa.nulls(tabella.num_rows, campo.type))
+        tabella = tabella.select(schema.names)
+        for batch in tabella.to_batches(max_chunksize=DIMENSIONE_BLOCCO):
+            self._writer.write_batch(batch.cast(schema))
+
+    def chiudi(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _da_colonne(nomi, colonne, scenario):
+    arrays = {'Scenario': pa.array([scenario] * len(colonne[0]), pa.string())}
+    for nome, arr in zip(nomi, colonne):
+        arrays[nome] = pa.array(arr, from_pandas=True)
+    return pa.table(arrays)
+
+
+def esporta_scenari(risultati_scenari, cartella, progress_cb=None, should_stop=None):
+    """
+    Scrive `schedulazione.xlsx` e `<dataset>.parquet` in `cartella` per tutti gli scenari
+    ({nome: RisultatoScenario}). Restituisce il dict {nome_file: percorso}.
+    """
+    os.makedirs(cartella, exist_ok=True)
+    percorso_xlsx = os.path.join(cartella, 'schedulazione.xlsx')
+    # Schema unione dei log eventi di tutti gli scenari (i tipi si promuovono, es. null -> double)
+    schemi = [s.remove_metadata() for s in (_schema(r, 'df_eventi') for r in risultati_scenari.values())
+              if s is not None]
+    schema_eventi = None
+    if schemi:
+        schema_eventi = pa.unify_schemas(schemi, promote_options='permissive').append(pa.field('Scenario', pa.string()))
+    parquet = {nome: _ScrittoreParquet(os.path.join(cartella, f"{nome}.parquet"),
+                                       schema_eventi if nome == 'eventi' else None)
+               for nome in ('eventi', 'dispacciamento', 'turni_operatori')}
+    workbook = xlsxwriter.Workbook(percorso_xlsx, {'constant_memory': True})
+    formati = {'intestazione': workbook.add_format({'bold': True}),
+               'data': workbook.add_format({'num_format': 'dd/mm/yyyy hh:mm'})}
+    nome_foglio = _NomiFogli()
+    try:
+        for i, (scenario, risultato) in enumerate(risultati_scenari.items()):
+            if should_stop is not None and should_stop():
+                break
+            fasi = _tabella(risultato, 'df_risultati')
+            eventi = _tabella(risultato, 'df_eventi')
+
+            if fasi is not None and fasi.num_rows:
+                colonne, confini = _dispacciamento(fasi)
+                parquet['dispacciamento'].scrivi(_da_colonne(COLONNE_DISPACCIAMENTO, colonne, scenario))
+                for a, b in zip(confini[:-1], confini[1:]):
+                    _scrivi_foglio(workbook, nome_foglio, f"{scenario} {colonne[0][a]}",
+                                   COLONNE_DISPACCIAMENTO[1:], [c[a:b] for c in colonne[1:]], formati)
+
+            if eventi is not None and eventi.num_rows:
+                colonne_turni = _turni_operatori(eventi)
+                _scrivi_foglio(workbook, nome_foglio, f"{scenario} Turni", COLONNE_TURNI, colonne_turni, formati)
+                parquet['turni_operatori'].scrivi(_da_colonne(COLONNE_TURNI, colonne_turni, scenario))
+                _scrivi_foglio(workbook, nome_foglio, f"{scenario} Eventi", eventi.column_names,
+                               [_colonna(eventi, c) for c in eventi.column_names], formati)
+                parquet['eventi'].scrivi(eventi.append_column(
+                    'Scenario', pa.array([scenario] * eventi.num_rows, pa.string())))
+
+            if progress_cb is not None:
+                progress_cb((i + 1) / len(risultati_scenari), scenario)
+    finally:
+        workbook.close()
+        for scrittore in parquet.values():
+            scrittore.chiudi()
+    file = {'schedulazione.xlsx': percorso_xlsx}
+    file.update({os.path.basename(s.percorso): s.percorso for s in parquet.values() if os.path.exists(s.percorso)})
+    return file
+
+
+def comprimi(file, percorso_zip):
+    """Raccoglie i file esportati in un archivio zip (per il download dalla pagina)."""
+    with zipfile.ZipFile(percorso_zip, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for nome, percorso in file.items():
+            zf.write(percorso, arcname=nome)
+    return percorso_zip
+
+
+def esegui_esportazione(payload, ctx):
+    """Funzione di job (vedi lib/jobs.py): payload {'risultati': {...}, 'cartella': str}."""
+    file = esporta_scenari(
+        payload['risultati'], payload['cartella'],
+        progress_cb=lambda frazione, scenario: ctx.aggiorna(frazione, f"{scenario} esportato"),
+        should_stop=ctx.annullato
+    )
+    file['schedulazione.zip'] = comprimi(file, os.path.join(payload['cartella'], 'schedulazione.zip'))
+    return file
@@ -0,0 +1,98 @@
+"""
+lib/job_panel.py
+Componenti Streamlit condivisi dalle pagine che lanciano job in background (3, 6, 7):
+stato e avanzamento del job, annullamento e riconnessione ai job dell'utente.
+"""
+import streamlit as st
+from datetime import datetime
+
+from lib.jobs import get_job_manager, STATI_ATTIVI
+
+ETICHETTE_STATO = {
+    'in_coda': '⏳ In coda',
+    'in_esecuzione': '⚙️ In esecuzione',
+    'completato': '✅ Completato',
+    'errore': '❌ Errore',
+    'annullato': '🛑 Annullato',
+}
+
+# Intervallo di aggiornamento automatico del pannello (secondi)
+REFRESH_SECONDI = 2
+
+
+def owner_corrente():
+    """Utente proprietario dei job della sessione corrente."""
+    return st.session_state.get("username") or "anonimo"
+
+
+def selettore_job(tipo, chiave_sessione):
+    """
+    Permette di riconnettersi a un job dell'utente di un certo tipo (es. dopo aver
+    chiuso il browser): l'id scelto viene salvato in `st.session_state[chiave_sessione]`.
+    """
+    jobs = [j for j in get_job_manager().elenca(owner_corrente()) if j['tipo'] == tipo]
+    if not jobs:
+        return st.session_state.get(chiave_sessione)
+    etichette = {
+        j['id']: f"{datetime.fromtimestamp(j['creato']):%d/%m %H:%M} — "
+                 f"{j['descrizione'] or j['tipo']} ({ETICHETTE_STATO[j['stato']]})"
+        for j in jobs
+    }
+    ids = list(etichette)
+    corrente = st.session_state.get(chiave_sessione)
+    with st.expander("🔌 I miei job", expanded=False):
+        scelta = st.selectbox(
+            "Riconnetti a un job", ids,
+            index=ids.index(corrente) if corrente in ids else 0,
+            format_func=etichette.get, key=f"sel_{chiave_sessione}"
+        )
+        if st.button("Riconnetti", key=f"btn_{chiave_sessione}"):
+            st.session_state[chiave_sessione] = scelta
+    return st.session_state.get(chiave_sessione)
+
+
+def _pannello(job_id):
+    manager = get_job_manager()
+    owner = owner_corrente()
+    info = manager.stato(job_id, owner)
+    if info is None:
+        st.warning("Job non trovato.")
+        return None
+    st.markdown(f"**Job `{job_id}`** — {info['descrizione'] or info['tipo']}: {ETICHETTE_STATO[info['stato']]}")
+    if info['stato'] in STATI_ATTIVI:
+        st.progress(min(max(info['progresso'], 0.0), 1.0), text=info['messaggio'] or "")
+        if st.button("🛑 Annulla job", key=f"annulla_{job_id}"):
+            manager.annulla(job_id, owner)
+    elif info['stato'] == 'errore':
+        st.error(info['errore'])
+    return info
+
+
+def mostra_job(job_id):
+    """
+    Mostra stato e avanzamento del job. Finché il job è attivo il pannello si aggiorna da solo
+    e, quando il job termina, ricarica la pagina. Restituisce la riga del job (dict) o None.
+    """
+    info = get_job_manager().stato(job_id, owner_corrente())
+    attivo = info is not None and info['stato'] in STATI_ATTIVI
+    if attivo and hasattr(st, "fragment"):
+        @st.fragment(run_every=REFRESH_SECONDI)
+        def _pannello_live():
+            stato = _pannello(job_id)
+            if stato is None or stato['stato'] not in STATI_ATTIVI:
+                st.rerun()
+        _pannello_live()
+        return info
+    info = _pannello(job_id)
+    if attivo and st.button("🔄 Aggiorna stato", key=f"refresh_{job_id}"):
+        st.rerun()
+    return info
+
+
+def risultati_parziali(job_id):
+    """Risultati parziali del job attivo (vedi `lib.jobs._job_scenari`), o None."""
+    return get_job_manager().parziale(job_id, owner_corrente())
+
+
+def risultato_job(job_id):
+    return get_job_manager().risultato(job_id, owner_corrente())
@@ -0,0 +1,300 @@
+"""
+lib/jobs.py
+Gestore locale di job in background per simulazioni, ripianificazioni e what-if.
+
+I job girano in thread del server Streamlit, fuori dallo script della pagina: un rerun
+o un cambio pagina non li interrompe né li ripete. Lo stato è salvato in una tabella
+SQLite (file locale), i risultati completati in file pickle accanto al database,
+così un utente può riconnettersi ai propri job anche da una nuova sessione del browser.
+In memoria i risultati vivono nel DataStore condiviso (lib/datastore.py) come handle
+`RisultatoScenario`, finché almeno una sessione li usa.
+Ogni job appartiene a un utente (`owner`): elenchi, risultati e annullamenti sono
+filtrati per owner, in modo che più pianificatori possano condividere lo stesso server.
+Gli scenari completati sono anche registrati come run nell'archivio storico (lib/archivio.py).
+"""
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from lib.archivio import get_archivio
+from lib.datastore import get_data_store
+from lib.simulator import esegui_simulazione_ottimizzata, SimulazioneAnnullata
+
+TIPI_JOB = ('simulazione', 'ripianificazione', 'whatif', 'sweep', 'verifica_surrogato', 'export',
+            'ottimizzazione', 'sensitivita')
+STATI_ATTIVI = ('in_coda', 'in_esecuzione')
+STATI_FINALI = ('completato', 'errore', 'annullato')
+
+# Chiavi di st.session_state passate al simulatore, nell'ordine della firma
+CHIAVI_INPUT = ('df_lotti', 'df_fasi', 'df_posticipi', 'df_equivalenze', 'df_posticipi_fisiologici')
+# Tabelle opzionali (Pagina 1), passate al simulatore come argomenti keyword solo se caricate
+CHIAVI_OPZIONALI = ('df_cambi_formato', 'df_competenze', 'df_turni_personale', 'df_stato_iniziale',
+                    'df_distribuzioni_durate')
+
+JOBS_DIR = os.environ.get(
+    'SCHEDULATORE_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'schedulatore_jobs')
+)
+MAX_JOB_CONCORRENTI = int(os.environ.get('SCHEDULATORE_MAX_JOB', 2))
+MAX_JOB_PER_UTENTE = int(os.environ.get('SCHEDULATORE_MAX_JOB_UTENTE', 2))
+
+# Intervallo minimo (secondi) tra due scritture di avanzamento sul database
+INTERVALLO_AGGIORNAMENTO = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    owner        TEXT NOT NULL,
+    tipo         TEXT NOT NULL,
+    descrizione  TEXT,
+    stato        TEXT NOT NULL,
+    progresso    REAL NOT NULL DEFAULT 0,
+    messaggio    TEXT,
+    errore       TEXT,
+    creato       REAL NOT NULL,
+    aggiornato   REAL NOT NULL,
+    pid          INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, creato);
+"""
+
+
+def raccogli_input(session_state):
+    """Estrae da `st.session_state` i DataFrame di input del simulatore."""
+    return {k: session_state.get(k) for k in CHIAVI_INPUT + CHIAVI_OPZIONALI}
+
+
+def simula(inputs, config, **kwargs):
+    """Esegue il simulatore su un dict di input (vedi `raccogli_input`)."""
+    opzionali = {k: inputs[k] for k in CHIAVI_OPZIONALI if inputs.get(k) is not None}
+    return esegui_simulazione_ottimizzata(
+        *(inputs[k] for k in CHIAVI_INPUT), config, **opzionali, **kwargs
+    )
+
+
+class ContestoJob:
+    """Handle passato alla funzione del job per notificare avanzamento e leggere l'annullamento."""
+
+    def __init__(self, manager, job_id):
+        self._manager = manager
+        self.job_id = job_id
+        self._ultimo_aggiornamento = 0.0
+
+    def annullato(self):
+        return self._manager._evento_annullamento(self.job_id).is_set()
+
+    def aggiorna(self, progresso, messaggio=None, parziale=None, forza=False):
+        """Registra avanzamento (0-1) e, opzionalmente, risultati parziali (solo in memoria)."""
+        if parziale is not None:
+            self._manager._parziali[self.job_id] = parziale
+        now = time.time()
+        if forza or now - self._ultimo_aggiornamento >= INTERVALLO_AGGIORNAMENTO:
+            self._ultimo_aggiornamento = now
+            self._manager._aggiorna_riga(self.job_id, progresso=float(progresso), messaggio=messaggio)
+
+
+def _job_scenari(payload, ctx):
+    """
+    Esegue in sequenza gli scenari del payload ({'input': {...}, 'scenari': {nome: cfg}}).
+    I parziali sono i risultati degli scenari già completati più le fasi dello scenario in corso.
+    """
+    inputs = payload['input']
+    scenari = payload['scenari']
+    risultati = {}
+    n = len(scenari)
+    for i, (nome, cfg) in enumerate(scenari.items()):
+        def progress_cb(frazione, df_parziale, i=i, nome=nome):
+            ctx.aggiorna((i + frazione) / n, f"{nome}: {frazione:.0%} lotti completati",
+                         parziale={'completati': dict(risultati), 'in_corso': (nome, df_parziale)})
+
+        df_ris, df_pers, df_eng, df_car, df_eventi, df_buffer = simula(
+            inputs, cfg,
+            progress_cb=progress_cb, should_stop=ctx.annullato, con_eventi=True, con_buffer=True
+        )
+        risultati[nome] = {
+            "df_risultati": df_ris,
+            "df_persone": df_pers,
+            "df_energia": df_eng,
+            "df_carrelli": df_car,
+            "df_eventi": df_eventi,  # log completo, usato dall'esportazione (lib/export.py)
+            "df_buffer": df_buffer   # WIP e occupazione dei buffer
+        }
+        ctx.aggiorna((i + 1) / n, f"{nome} completato",
+                     parziale={'completati': dict(risultati), 'in_corso': None}, forza=True)
+    return risultati
+
+
+class JobManager:
+    """Coda di job in thread con stato persistito su SQLite. Usare `get_job_manager()`."""
+
+    def __init__(self, base_dir=JOBS_DIR, max_workers=MAX_JOB_CONCORRENTI):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+        self.db_path = os.path.join(base_dir, 'jobs.sqlite')
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._annullamenti = {}
+        self._parziali = {}
+        # (job_id, scenario) -> RisultatoScenario; la voce sparisce quando nessuna sessione lo usa
+        self._risultati = weakref.WeakValueDictionary()
+        with self._connessione() as con:
+            con.executescript(_SCHEMA)
+            # Job rimasti attivi da un processo server precedente non verranno mai completati
+            con.execute(
+                "UPDATE jobs SET stato='errore', errore='Interrotto dal riavvio del server', aggiornato=? "
+                f"WHERE stato IN {STATI_ATTIVI} AND pid != ?",
+                (time.time(), os.getpid())
+            )
+
+    # -- Accesso al database ------------------------------------------------
+    @contextmanager
+    def _connessione(self):
+        """Connessione SQLite con commit all'uscita e chiusura garantita."""
+        con = sqlite3.connect(self.db_path, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _aggiorna_riga(self, job_id, **campi):
+        campi['aggiornato'] = time.time()
+        assegnazioni = ', '.join(f"{k}=?" for k in campi)
+        with self._lock, self._connessione() as con:
+            con.execute(f"UPDATE jobs SET {assegnazioni} WHERE id=?", (*campi.values(), job_id))
+
+    def _percorso_risultato(self, job_id):
+        return os.path.join(self.base_dir, f"{job_id}.pkl")
+
+    def _evento_annullamento(self, job_id):
+        with self._lock:
+            return self._annullamenti.setdefault(job_id, threading.Event())
+
+    # -- API pubblica -------------------------------------------------------
+    def invia(self, tipo, owner, payload, descrizione='', funzione=_job_scenari):
+        """Accoda un job e restituisce il suo id. `funzione(payload, ctx)` ne produce il risultato."""
+        if tipo not in TIPI_JOB:
+            raise ValueError(f"Tipo di job non valido: {tipo}")
+        attivi = [j for j in self.elenca(owner) if j['stato'] in STATI_ATTIVI]
+        if len(attivi) >= MAX_JOB_PER_UTENTE:
+            raise RuntimeError(
+                f"L'utente {owner} ha già {len(attivi)} job attivi (massimo {MAX_JOB_PER_UTENTE})."
+            )
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock, self._connessione() as con:
+            con.execute(
+                "INSERT INTO jobs (id, owner, tipo, descrizione, stato, creato, aggiornato, pid) "
+                "VALUES (?, ?, ?, ?, 'in_coda', ?, ?, ?)",
+                (job_id, owner, tipo, descrizione, now, now, os.getpid())
+            )
+        self._evento_annullamento(job_id)
+        self._executor.submit(self._esegui, job_id, funzione, payload, owner, tipo)
+        return job_id
+
+    def _esegui(self, job_id, funzione, payload, owner=None, tipo=None):
+        ctx = ContestoJob(self, job_id)
+        if ctx.annullato():
+            self._aggiorna_riga(job_id, stato='annullato', messaggio='Annullato prima dell\'avvio')
+            return
+        self._aggiorna_riga(job_id, stato='in_esecuzione', messaggio='Avviato')
+        try:
+            risultato = funzione(payload, ctx)
+        except SimulazioneAnnullata:
+            self._aggiorna_riga(job_id, stato='annullato', messaggio='Annullato dall\'utente')
+        except Exception as e:
+            self._aggiorna_riga(job_id, stato='errore', errore=f"{e}\n{traceback.format_exc()}")
+        else:
+            with open(self._percorso_risultato(job_id), 'wb') as f:
+                pickle.dump(risultato, f, protocol=pickle.HIGHEST_PROTOCOL)
+            messaggio = 'Completato'
+            if 'scenari' in payload:
+                # Ogni scenario diventa una run dell'archivio (lib/archivio.py); un errore
+                # di archiviazione non invalida il job
+                try:
+                    archivio = get_archivio()
+                    for nome, frames in risultato.items():
+                        archivio.archivia(frames, payload['scenari'][nome], job_id, nome, owner, tipo)
+                except Exception as e:
+                    messaggio = f"Completato (archiviazione non riuscita: {e})"
+            del risultato
+            self._aggiorna_riga(job_id, stato='completato', progresso=1.0, messaggio=messaggio)
+        finally:
+            self._parziali.pop(job_id, None)
+            with self._lock:
+                self._annullamenti.pop(job_id, None)
+
+    def stato(self, job_id, owner):
+        """Riga del job come dict, o None se non esiste o appartiene a un altro utente."""
+        with self._connessione() as con:
+            row = con.execute("SELECT * FROM jobs WHERE id=? AND owner=?", (job_id, owner)).fetchone()
+        return dict(row) if row else None
+
+    def elenca(self, owner, limite=20):
+        """Job dell'utente, dal più recente."""
+        with self._connessione() as con:
+            rows = con.execute(
+                "SELECT * FROM jobs WHERE owner=? ORDER BY creato DESC LIMIT ?", (owner, limite)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def parziale(self, job_id, owner):
+        if self.stato(job_id, owner) is None:
+            return None
+        return self._parziali.get(job_id)
+
+    def risultato(self, job_id, owner):
+        """
+        Risultato di un job completato. Per i job di scenari è {scenario: RisultatoScenario}:
+        gli handle già in uso da altre sessioni vengono riutilizzati, altrimenti si ricaricano
+        dal file.
+        """
+        info = self.stato(job_id, owner)
+        if info is None or info['stato'] != 'completato':
+            return None
+        with self._lock:
+            handles = {nome: h for (jid, nome), h in list(self._risultati.items()) if jid == job_id}
+        if handles:
+            return handles
+        with open(self._percorso_risultato(job_id), 'rb') as f:
+            frames = pickle.load(f)
+        if not (isinstance(frames, dict) and all(isinstance(v, dict) for v in frames.values())):
+            # Risultati che non sono scenari (es. tabella di uno sweep): restituiti così come sono
+            return frames
+        store = get_data_store()
+        handles = {nome: store.salva_risultato(dfs) for nome, dfs in frames.items()}
+        with self._lock:
+            for nome, h in handles.items():
+                self._risultati[(job_id, nome)] = h
+        return handles
+
+    def annulla(self, job_id, owner):
+        """Richiede l'annullamento; il job si ferma al prossimo passo di simulazione."""
+        info = self.stato(job_id, owner)
+        if info is None or info['stato'] not in STATI_ATTIVI:
+            return False
+        self._evento_annullamento(job_id).set()
+        self._aggiorna_riga(job_id, messaggio='Annullamento richiesto')
+        return True
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Istanza unica del gestore per il processo server (condivisa tra le sessioni)."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
@@ -0,0 +1,109 @@
+"""
+lib/kpi.py
+KPI sintetici di una simulazione, usati da sweep, confronti e ottimizzazioni.
+Tutti i tempi sono in minuti di simulazione (0 = inizio simulazione).
+"""
+import math
+
+import pandas as pd
+
+from lib.simulator import operatori_da_competenze
+
+# Pool della flotta carrelli in df_carrelli: in uso nelle fasi e, con il ciclo di rientro e
+# lavaggio, fuori servizio
+POOL_CARRELLI = {'Carrelli_occupati': 'In uso', 'Carrelli_rientro': 'Rientro', 'Carrelli_lavaggio': 'Lavaggio'}
+
+# KPI da minimizzare, nell'ordine mostrato nelle tabelle
+COLONNE_KPI = ['makespan_min', 'lead_time_medio_min', 'ore_personale', 'energia_tot',
+               'picco_persone', 'picco_carrelli', 'ritardo_totale_min']
+
+
+def calcola_kpi(df_risultati, df_persone, df_energia, df_carrelli, config):
+    """
+    Restituisce un dict di KPI:
+    - makespan_min: fine dell'ultima fase
+    - lead_time_medio_min: media per lotto di (fine ultima fase - inizio prima fase)
+    - ore_personale: ore-operatore pagate = max_personale x ore di turno dei giorni coperti dal makespan;
+      con un calendario turni (colonna 'Organico' di df_persone) le ore di organico fino al makespan
+    - energia_tot, picco_persone, picco_carrelli: dalle timeline delle risorse; il picco dei
+      carrelli conta anche quelli in rientro e al lavaggio (non disponibili)
+    - ritardo_totale_min: somma dei ritardi sulle scadenze dei lotti (NaN senza scadenze)
+    """
+    if df_risultati is None or df_risultati.empty:
+        return {k: float('nan') for k in COLONNE_KPI}
+    makespan = float(df_risultati['End'].max())
+    per_lotto = df_risultati.groupby('ID_Lotto').agg(inizio=('Start', 'min'), fine=('End', 'max'))
+    workday = config.get('workday_minutes', 1440)
+    turno = config.get('work_std', 480) + config.get('extension', 0)
+    giorni = max(1, math.ceil(makespan / workday))
+    ore_personale = config.get('max_personale', 1) * giorni * turno / 60.0
+    if 'Organico' in df_persone.columns and not df_persone.empty:
+        minuti = (df_persone['timestamp'] - df_persone['timestamp'].iloc[0]) / pd.Timedelta(minutes=1)
+        passo = minuti.diff().shift(-1).fillna(0)
+        ore_personale = float((df_persone['Organico'] * passo)[minuti < makespan].sum()) / 60.0
+    return {
+        'makespan_min': makespan,
+        'lead_time_medio_min': float((per_lotto['fine'] - per_lotto['inizio']).mean()),
+        'ore_personale': ore_personale,
+        'energia_tot': float(pd.to_numeric(df_energia['Energia']).sum()) if not df_energia.empty else 0.0,
+        'picco_persone': float(df_persone['Persone_occupate'].max()) if not df_persone.empty else 0.0,
+        'picco_carrelli': (float(df_carrelli[[c for c in POOL_CARRELLI if c in df_carrelli.columns]].sum(axis=1).max())
+                           if not df_carrelli.empty else 0.0),
+        'ritardo_totale_min': (float(puntualita_lotti(df_risultati)['Ritardo_min'].sum())
+                               if 'Scadenza' in df_risultati.columns else float('nan')),
+    }
+
+
+def puntualita_lotti(df_risultati):
+    """
+    Puntualità per lotto con scadenza: fine dell'ultima fase, scadenza, margine (Slack_min,
+    negativo se in ritardo) e ritardo in minuti di calendario. Richiede le colonne
+    'TimestampEnd' e 'Scadenza' di df_risultati (vedi esegui_simulazione_ottimizzata).
+    """
+    if 'Scadenza' not in df_risultati.columns:
+        raise KeyError("Colonna 'Scadenza' mancante nei risultati")
+    per_lotto = df_risultati[df_risultati['Scadenza'].notna()].groupby('ID_Lotto').agg(
+        Fine=('TimestampEnd', 'max'), Scadenza=('Scadenza', 'first'),
+        InizioUltimo=('InizioUltimo', 'min')
+    )
+    per_lotto['Slack_min'] = (per_lotto['Scadenza'] - per_lotto['Fine']) / pd.Timedelta(minutes=1)
+    per_lotto['Ritardo_min'] = per_lotto['Slack_min'].clip(upper=0).abs()
+    return per_lotto.reset_index().sort_values('Slack_min')
+
+
+def utilizzo_gruppi(df_persone, df_competenze):
+    """
+    Utilizzo per gruppo di competenze: media degli occupati del gruppo ('Occupati_<gruppo>'
+    in df_persone) sull'organico del gruppo, calcolata sugli istanti in cui almeno un
+    operatore è al lavoro (turni attivi). Restituisce un DataFrame Gruppo, Organico, Utilizzo.
+    """
+    organico = operatori_da_competenze(df_competenze)['Gruppo'].value_counts()
+    attivi = df_persone[df_persone['Persone_occupate'] > 0]
+    righe = []
+    for gruppo, n in organico.items():
+        colonna = f"Occupati_{gruppo}"
+        occupati = attivi[colonna].mean() if colonna in attivi.columns and not attivi.empty else 0.0
+        righe.append({'Gruppo': gruppo, 'Organico': int(n), 'Utilizzo': float(occupati) / n})
+    return pd.DataFrame(righe, columns=['Gruppo', 'Organico', 'Utilizzo']).sort_values('Utilizzo', ascending=False)
+
+
+def utilizzo_carrelli(df_carrelli, max_carrelli):
+    """
+    Utilizzo per pool della flotta carrelli (vedi POOL_CARRELLI): media e picco dei carrelli
+    del pool e quota media della flotta, fino all'ultimo istante con carrelli impegnati.
+    La flotta è 'Organico' di df_carrelli (calendario turni) o `max_carrelli`.
+    Restituisce un DataFrame Pool, Media, Picco, Utilizzo.
+    """
+    colonne = [c for c in POOL_CARRELLI if c in df_carrelli.columns]
+    impegnati = df_carrelli[colonne].sum(axis=1).to_numpy()
+    ultimo = impegnati.nonzero()[0][-1] + 1 if impegnati.any() else 0
+    periodo = df_carrelli.iloc[:ultimo]
+    flotta = periodo['Organico'] if 'Organico' in periodo.columns else pd.Series(float(max_carrelli), index=periodo.index)
+    righe = []
+    for colonna in colonne:
+        quota = (periodo[colonna] / flotta.where(flotta > 0)).mean()
+        righe.append({'Pool': POOL_CARRELLI[colonna],
+                      'Media': float(periodo[colonna].mean()) if ultimo else 0.0,
+                      'Picco': float(periodo[colonna].max()) if ultimo else 0.0,
+                      'Utilizzo': float(quota) if pd.notna(quota) else 0.0})
+    return pd.DataFrame(righe, columns=['Pool', 'Media', 'Picco', 'Utilizzo'])
@@ -0,0 +1,244 @@
+"""
+lib/parallel.py
+Esecuzione parallela di molte configurazioni sugli stessi input, su un pool di processi.
+
+Gli input vengono inviati una sola volta per processo (initializer) e ogni task restituisce
+solo i KPI (lib/kpi.py), non le timeline complete: così il costo di serializzazione resta
+trascurabile anche con centinaia di configurazioni.
+
+Simulazione partizionata per linea (`simula_per_linea`): le linee condividono solo operatori
+e carrelli, quindi ogni linea si simula in un processo separato con una quota fissa dei due
+pool (la somma delle quote non supera i totali: il piano combinato è sempre fattibile); una
+linea riceve almeno quanto preleva insieme la sua fase più esigente, quota zero se le sue
+fasi non usano il pool. Le quote si aggiustano per iterazioni, spostando un'unità verso la linea più lenta finché il
+makespan dell'impianto migliora.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import pandas as pd
+
+from lib.kpi import calcola_kpi
+from lib.jobs import simula
+from lib.rccp import carico_capacita, richieste_massime
+from lib.simulator import SimulazioneAnnullata
+
+MAX_PROCESSI = int(os.environ.get('SCHEDULATORE_MAX_PROCESSI', max(1, (os.cpu_count() or 2) - 1)))
+
+# Input del simulatore nel processo worker, impostati da `_init_worker`
+_INPUT_WORKER = None
+
+
+def _init_worker(inputs):
+    global _INPUT_WORKER
+    _INPUT_WORKER = inputs
+
+
+def _valuta(indice, config):
+    """Task del worker: simula una configurazione e restituisce (indice, kpi)."""
+    risultati = simula(_INPUT_WORKER, config)
+    return indice, calcola_kpi(*risultati, config)
+
+
+def valuta_configurazioni(inputs, configs, max_workers=None, should_stop=None):
+    """
+    Simula ogni config di `configs` (lista) con gli stessi `inputs` (dict, vedi
+    `lib.jobs.raccogli_input`) e produce coppie (indice, kpi) man mano che terminano.
+    Se `should_stop()` diventa True i task non ancora avviati vengono annullati.
+    """
+    if not configs:
+        return
+    workers = min(max_workers or MAX_PROCESSI, len(configs))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dict(inputs),)) as pool:
+        in_corso = {pool.submit(_valuta, i, cfg) for i, cfg in enumerate(configs)}
+        while in_corso:
+            if should_stop is not None and should_stop():
+                for fut in in_corso:
+                    fut.cancel()
+                return
+            completati, in_corso = wait(in_corso, timeout=0.5, return_when=FIRST_COMPLETED)
+            for fut in completati:
+                yield fut.result()
+
+
+# -- Simulazione partizionata per linea ----------------------------------
+# Pool condivisi tra le linee, ripartiti in quote
+RISORSE_CONDIVISE = ('max_personale', 'max_carrelli')
+# Tipo della verifica di capacità (lib/rccp.py) con il carico di ciascun pool
+TIPO_RCCP = {'max_personale': 'Operatori', 'max_carrelli': 'Carrelli'}
+COLONNE_ALLOCAZIONE = ['Linea', 'max_personale', 'max_carrelli', 'Makespan_min']
+
+
+def _simula_partizione(chiave, config):
+    """Task del worker: simula una linea con le sue quote e restituisce (chiave, risultati)."""
+    return chiave, simula(_INPUT_WORKER, config, con_eventi=True, con_buffer=True)
+
+
+def ripartisci(totale, pesi, minimo=1):
+    """
+    Quote intere >= `minimo` (uno scalare o uno per peso) con somma `totale`, proporzionali
+    ai pesi (resti più grandi).
+    """
+    pesi = np.asarray(pesi, dtype=float)
+    minimo = np.broadcast_to(np.asarray(minimo, dtype=int), pesi.shape)
+    liberi = totale - int(minimo.sum())
+    if liberi < 0:
+        raise ValueError(f"{totale} unità non bastano per i minimi delle linee ({int(minimo.sum())})")
+    pesi = pesi / pesi.sum() if pesi.sum() > 0 else np.full(len(pesi), 1.0 / len(pesi))
+    esatte = pesi * liberi
+    quote = np.floor(esatte).astype(int)
+    resti = np.argsort(-(esatte - quote), kind='stable')[:liberi - quote.sum()]
+    quote[resti] += 1
+    return (quote + minimo).tolist()
+
+
+def _somma_timeline(tabelle):
+    """Timeline dell'impianto: somma per istante delle timeline delle linee (stessa origine)."""
+    tabelle = [t for t in tabelle if not t.empty]
+    if not tabelle:
+        return pd.DataFrame(columns=['timestamp'])
+    return pd.concat(tabelle, ignore_index=True).fillna(0).groupby('timestamp', as_index=False).sum(numeric_only=True)
+
+
+def combina_partizioni(risultati_linee):
+    """Unisce i risultati delle linee ((df_risultati, df_persone, df_energia, df_carrelli, eventi, buffer))."""
+    df_risultati = pd.concat([r[0] for r in risultati_linee], ignore_index=True)
+    eventi = pd.concat([r[4] for r in risultati_linee], ignore_index=True).sort_values('SimTime', kind='stable')
+    timeline = [_somma_timeline([r[k] for r in risultati_linee]) for k in (1, 2, 3, 5)]
+    return (df_risultati, *timeline[:3], eventi.reset_index(drop=True), timeline[3])
+
+
+def simula_per_linea(inputs, config, max_workers=None, max_iterazioni=20, should_stop=None, progress_cb=None):
+    """
+    Simula l'impianto partizionato per 'Linea' (colonna di df_lotti) su un pool di processi.
+    Le linee condividono solo operatori e carrelli (max_personale, max_carrelli): le macchine
+    di una linea non servono le altre. Quote iniziali proporzionali al carico di ciascun pool
+    nella verifica di capacità (lib/rccp.py: operatori e carrelli), con minimo la richiesta
+    della fase più esigente della linea (`richieste_massime`) e 0 per le linee che non usano
+    il pool; a ogni iterazione si valutano in parallelo gli spostamenti di
+    un'unità da ogni altra linea alla linea più lenta (solo dei pool che questa usa) e si
+    applica il migliore, finché il makespan dell'impianto (massimo tra le linee) non migliora più.
+    Restituisce (df_risultati, df_persone, df_energia, df_carrelli, df_eventi, df_buffer,
+    df_allocazione) come `esegui_simulazione_ottimizzata` con eventi e buffer.
+    """
+    df_lotti = inputs['df_lotti']
+    if 'Linea' not in df_lotti.columns:
+        raise KeyError("df_lotti manca la colonna: 'Linea'")
+    if inputs.get('df_competenze') is not None or inputs.get('df_turni_personale') is not None:
+        raise ValueError("La simulazione per linea ripartisce max_personale/max_carrelli: "
+                         "non è compatibile con matrice competenze e calendario turni")
+    mask = df_lotti['Linea'].notna()
+    if config.get('filter_line'):
+        mask &= df_lotti['Linea'].isin(config['filter_line'])
+    if config.get('filter_format'):
+        mask &= df_lotti['Formato'].isin(config['filter_format'])
+    linee = list(pd.unique(df_lotti.loc[mask, 'Linea']))
+    if not linee:
+        raise ValueError("Nessuna linea da simulare dopo i filtri")
+
+    # Stessa origine dei tempi per tutte le linee: le timeline si sommano per istante
+    data_inizio = config.get('data_inizio') or pd.to_datetime(df_lotti.loc[mask, 'Giorno']).min()
+    config_linea = {linea: {**config, 'filter_line': [linea], 'data_inizio': data_inizio} for linea in linee}
+    rccp = {linea: carico_capacita(df_lotti[df_lotti['Linea'] == linea], inputs['df_fasi'], config_linea[linea],
+                                   inputs.get('df_equivalenze')).groupby('Tipo')['Carico_min'].sum()
+            for linea in linee}
+    carico = {r: [float(rccp[linea].get(TIPO_RCCP[r], 0.0)) for linea in linee] for r in RISORSE_CONDIVISE}
+    richieste = {linea: richieste_massime(df_lotti[mask & (df_lotti['Linea'] == linea)], inputs['df_fasi'],
+                                          config_linea[linea])
+                 for linea in linee}
+    # Una quota sotto la richiesta della fase più esigente la farebbe svolgere con meno risorse
+    minimi = {r: {linea: min(max(1, richieste[linea][TIPO_RCCP[r]]), int(config.get(r, 1))) if c > 0 else 0
+                  for linea, c in zip(linee, carico[r])}
+              for r in RISORSE_CONDIVISE}
+    quote = {r: dict(zip(linee, ripartisci(int(config.get(r, 1)), carico[r], list(minimi[r].values()))))
+             for r in RISORSE_CONDIVISE}
+
+    cache = {} # (linea, quota operatori, quota carrelli) -> risultati
+    workers = min(max_workers or MAX_PROCESSI, len(linee))
+
+    def chiave(linea, q):
+        return (linea,) + tuple(q[r][linea] for r in RISORSE_CONDIVISE)
+
+    def makespan(k):
+        df = cache[k][0]
+        return float(df['End'].max()) if not df.empty else 0.0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dict(inputs),)) as pool:
+        def valuta(chiavi):
+            mancanti = {k for k in chiavi if k not in cache}
+            # Quota zero solo per le linee che non usano il pool: al simulatore serve un pool non vuoto
+            in_corso = {pool.submit(_simula_partizione, k, {**config_linea[k[0]],
+                                                            **{r: max(1, q) for r, q in zip(RISORSE_CONDIVISE, k[1:])}})
+                        for k in mancanti}
+            while in_corso:
+                if should_stop is not None and should_stop():
+                    for fut in in_corso:
+                        fut.cancel()
+                    raise SimulazioneAnnullata("Simulazione per linea annullata")
+                completati, in_corso = wait(in_corso, timeout=0.5, return_when=FIRST_COMPLETED)
+                for fut in completati:
+                    k, risultati = fut.result()
+                    cache[k] = risultati
+
+        valuta([chiave(linea, quote) for linea in linee])
+        iterazioni = 0
+        while iterazioni < max_iterazioni:
+            tempi = {linea: makespan(chiave(linea, quote)) for linea in linee}
+            lenta = max(linee, key=tempi.get)
+            candidati = []
+            for r in RISORSE_CONDIVISE:
+                if not minimi[r][lenta]:
+                    continue
+                for donatrice in linee:
+                    if donatrice != lenta and quote[r][donatrice] > minimi[r][donatrice]:
+                        nuove = {q: dict(v) for q, v in quote.items()}
+                        nuove[r][lenta] += 1
+                        nuove[r][donatrice] -= 1
+                        candidati.append(nuove)
+            if not candidati:
+                break
+            valuta([chiave(linea, q) for q in candidati for linea in linee])
+            migliore = min(candidati, key=lambda q: max(makespan(chiave(linea, q)) for linea in linee))
+            if max(makespan(chiave(linea, migliore)) for linea in linee) >= tempi[lenta]:
+                break
+            quote = migliore
+            iterazioni += 1
+            if progress_cb is not None:
+                progress_cb(iterazioni / max_iterazioni)
+
+    df_allocazione = pd.DataFrame(
+        [{'Linea': linea, **{r: quote[r][linea] for r in RISORSE_CONDIVISE},
+          'Makespan_min': makespan(chiave(linea, quote))} for linea in linee],
+        columns=COLONNE_ALLOCAZIONE
+    )
+    return combina_partizioni([cache[chiave(linea, quote)] for linea in linee]) + (df_allocazione,)
+
+
+def esegui_per_linea(payload, ctx):
+    """
+    Funzione di job (vedi lib/jobs.py) con lo stesso payload e risultato della simulazione
+    degli scenari ({'input': ..., 'scenari': {nome: cfg}}), ma con `simula_per_linea`; ogni
+    scenario riporta anche 'df_allocazione' (quote di operatori e carrelli per linea).
+    """
+    risultati = {}
+    n = len(payload['scenari'])
+    for i, (nome, cfg) in enumerate(payload['scenari'].items()):
+        def progress_cb(frazione, i=i, nome=nome):
+            ctx.aggiorna((i + frazione) / n, f"{nome}: iterazione di ripartizione ({frazione:.0%} del massimo)")
+
+        df_ris, df_pers, df_eng, df_car, df_eventi, df_buffer, df_allocazione = simula_per_linea(
+            payload['input'], cfg, payload.get('max_workers'), should_stop=ctx.annullato, progress_cb=progress_cb
+        )
+        risultati[nome] = {
+            "df_risultati": df_ris,
+            "df_persone": df_pers,
+            "df_energia": df_eng,
+            "df_carrelli": df_car,
+            "df_eventi": df_eventi,
+            "df_buffer": df_buffer,
+            "df_allocazione": df_allocazione
+        }
+        ctx.aggiorna((i + 1) / n, f"{nome} completato", parziale={'completati': dict(risultati), 'in_corso': None},
+                     forza=True)
+    return risultati
@@ -0,0 +1,194 @@
+"""
+lib/rccp.py
+Verifica di capacità di massima (rough-cut capacity planning) prima della simulazione:
+carico delle fasi per macchina e per operatori, per giorno o settimana, confrontato con la
+capacità dei turni. Solo operazioni raggruppate pandas/NumPy, senza SimPy: abbastanza
+veloce da ricalcolarla a ogni modifica della configurazione (pagina 2).
+"""
+import numpy as np
+import pandas as pd
+
+from lib.simulator import cambi_organico, turni_del_roster
+
+COLONNE_RCCP = ['Periodo', 'Tipo', 'Risorsa', 'Carico_min', 'Capacita_min', 'Utilizzo', 'Sovraccarico']
+
+
+def minuti_turno_giornalieri(giorni, config):
+    """Minuti lavorabili di ogni giorno (DatetimeIndex o Series di date) secondo i turni della config."""
+    giorno_settimana = np.asarray(pd.DatetimeIndex(giorni).weekday)
+    fri38 = config.get('fri38_weekday', config.get('fri38', 4))
+    return np.select(
+        [giorno_settimana == fri38, giorno_settimana < 5],
+        [config.get('work_ven', 480), config.get('work_std', 480)],
+        default=0
+    ).astype(float)
+
+
+def _fasi_per_lotto(lotti, df_fasi):
+    """Una riga per (lotto, fase) del suo ciclo: le fasi del 'Prodotto' o, se assenti, tutte."""
+    if 'Prodotto' in lotti.columns and 'Prodotto' in df_fasi.columns:
+        noti = lotti['Prodotto'].isin(df_fasi['Prodotto'])
+        propri = lotti[noti].merge(df_fasi, on='Prodotto', how='inner')
+        altri = lotti[~noti].drop(columns='Prodotto').merge(df_fasi, how='cross')
+        return pd.concat([propri, altri], ignore_index=True)
+    return lotti.merge(df_fasi.drop(columns='Prodotto', errors='ignore'), how='cross')
+
+
+def richieste_massime(df_lotti, df_fasi, config):
+    """
+    Unità di operatori e carrelli che la fase più esigente dei lotti preleva insieme
+    ('Addetti' e 'Carrelli' di df_fasi; nessun operatore per RAFFREDDAMENTO e le fasi in
+    area): {'Operatori': n, 'Carrelli': n}. Con un pool più piccolo il simulatore limita la
+    richiesta al pool e la fase risulterebbe svolta con meno risorse del necessario.
+    """
+    if 'Prodotto' in df_lotti.columns:
+        righe = _fasi_per_lotto(df_lotti[['Prodotto']].drop_duplicates(), df_fasi)
+    else:
+        righe = df_fasi
+    passive = righe['Fase'].eq('RAFFREDDAMENTO') | righe['Fase'].isin(list(config.get('aree', {})))
+    richieste = {}
+    for tipo, colonna in (('Operatori', 'Addetti'), ('Carrelli', 'Carrelli')):
+        if colonna not in righe.columns:
+            richieste[tipo] = 0
+            continue
+        unita = pd.to_numeric(righe[colonna], errors='coerce').fillna(0)
+        if tipo == 'Operatori':
+            unita = unita[~passive]
+        richieste[tipo] = int(unita.max()) if len(unita) else 0
+    return richieste
+
+
+def minuti_organico_periodo(df_turni, config, inizi, frequenza, colonna='Operatori'):
+    """
+    Minuti-unità dell'organico del calendario turni (roster di config['roster'], vedi
+    `cambi_organico`) in ciascun periodo che inizia in `inizi`: l'integrale dell'organico
+    presente, quindi già al netto delle ore senza turno.
+    """
+    inizi = pd.DatetimeIndex(inizi)
+    origine = inizi.min()
+    fini = inizi + pd.tseries.frequencies.to_offset(frequenza)
+    n_giorni = (fini.max() - origine).days + 1
+    istanti, livelli = cambi_organico(turni_del_roster(df_turni, config), origine, n_giorni, colonna)
+    cumulato = np.concatenate([[0.0], np.cumsum(livelli[:-1] * np.diff(istanti))])
+
+    def integrale(t):
+        t = ((t - origine) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+        j = np.searchsorted(istanti, t, side='right') - 1
+        return cumulato[j] + livelli[j] * (t - istanti[j])
+
+    return pd.Series(integrale(fini) - integrale(inizi), index=inizi)
+
+
+def carico_capacita(df_lotti, df_fasi, config, df_equivalenze=None, frequenza='D', df_turni_personale=None):
+    """
+    Carico e capacità per periodo (`frequenza` 'D' giorno o 'W' settimana) e risorsa.
+    Il carico di un lotto cade tutto sul periodo del suo 'Giorno'; la durata di una fase è
+    quella pianificata del simulatore (quantità / Pezzi x Tempo, tempo fisso per AUTOCLAVI,
+    zero per RAFFREDDAMENTO e le fasi in area) con il margine. Nelle fasi a batch (config['fasi_batch']) il
+    carico macchina è la quota del ciclo occupata dal lotto (Equivalenza_Unita / capacità);
+    una fase con macchine alternative ripartisce il carico in parti uguali tra le macchine.
+    Con la colonna 'Carrelli' in df_fasi si verifica anche il pool carrelli (carico = durata x
+    Carrelli). La capacità di operatori e carrelli è turno x max_personale/max_carrelli o, con
+    il calendario turni `df_turni_personale`, l'organico del roster presente nel periodo
+    (vedi `minuti_organico_periodo`), come nel simulatore.
+    Restituisce un DataFrame con COLONNE_RCCP; Tipo è 'Macchina', 'Operatori' o 'Carrelli'.
+    """
+    col_id_lotto = 'Lotto' if 'Lotto' in df_lotti.columns else 'ID_Lotto'
+    col_quantita = 'Quantità' if 'Quantità' in df_lotti.columns else 'Quantita'
+    tempo_col = 'Tempo_Minuti' if 'Tempo_Minuti' in df_fasi.columns else 'Tempo'
+    mancanti = {col_id_lotto, col_quantita, 'Formato', 'Giorno'} - set(df_lotti.columns)
+    if mancanti:
+        raise KeyError(f"df_lotti mancano le colonne: {mancanti}")
+    mancanti = {'Fase', 'Macchina', tempo_col, 'Pezzi', 'Addetti'} - set(df_fasi.columns)
+    if mancanti:
+        raise KeyError(f"df_fasi mancano le colonne: {mancanti}")
+
+    mask = pd.Series(True, index=df_lotti.index)
+    if config.get('filter_format'):
+        mask &= df_lotti['Formato'].isin(config['filter_format'])
+    if config.get('filter_line') and 'Linea' in df_lotti.columns:
+        mask &= df_lotti['Linea'].isin(config['filter_line'])
+    lotti = pd.DataFrame({
+        'Formato': df_lotti.loc[mask, 'Formato'],
+        'Quantita': pd.to_numeric(df_lotti.loc[mask, col_quantita], errors='coerce').fillna(0),
+        'Periodo': pd.to_datetime(df_lotti.loc[mask, 'Giorno']).dt.to_period(frequenza).dt.start_time,
+    })
+    lotti['RigaLotto'] = np.arange(len(lotti))
+    if 'Prodotto' in df_lotti.columns:
+        lotti['Prodotto'] = df_lotti.loc[mask, 'Prodotto']
+    if lotti.empty:
+        return pd.DataFrame(columns=COLONNE_RCCP)
+
+    fasi = df_fasi[['Fase', 'Macchina', tempo_col, 'Pezzi', 'Addetti']
+                   + [c for c in ('Carrelli', 'Prodotto') if c in df_fasi.columns]]
+    righe = _fasi_per_lotto(lotti, fasi)
+    fase = righe['Fase'].to_numpy()
+    tempo = pd.to_numeric(righe[tempo_col], errors='coerce').fillna(0).to_numpy(dtype=float)
+    pezzi = pd.to_numeric(righe['Pezzi'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    quantita = righe['Quantita'].to_numpy(dtype=float)
+    per_pezzi = np.divide(quantita * tempo, pezzi, out=np.zeros_like(tempo), where=pezzi > 0)
+    # Le fasi in un'area passiva (config['aree']) non impegnano macchine né operatori
+    passive = (fase == 'RAFFREDDAMENTO') | np.isin(fase, list(config.get('aree', {})))
+    durata = np.select([passive, fase == 'AUTOCLAVI'], [0.0, tempo], default=per_pezzi)
+    durata *= 1 + config.get('margin_pct', 0.0)
+
+    carico_macchina = durata.copy()
+    for nome_fase, par in config.get('fasi_batch', {}).items():
+        if par.get('capacita', 0) <= 0:
+            continue
+        in_fase = fase == nome_fase
+        equivalenza = np.ones(in_fase.sum())
+        if df_equivalenze is not None and not df_equivalenze.empty:
+            eq = df_equivalenze[df_equivalenze['Fase'] == nome_fase].set_index('Formato')['Equivalenza_Unita']
+            equivalenza = pd.to_numeric(righe.loc[in_fase, 'Formato'].map(eq), errors='coerce').fillna(1.0).to_numpy()
+        carico_macchina[in_fase] *= equivalenza / float(par['capacita'])
+
+    # Macchine alternative (più righe della stessa fase): il carico si ripartisce in parti uguali
+    chiave_fase = ['RigaLotto', 'Fase'] + (['Prodotto'] if 'Prodotto' in righe.columns else [])
+    n_alternative = righe.groupby(chiave_fase, dropna=False)['Fase'].transform('size').to_numpy(dtype=float)
+    durata /= n_alternative
+    carico_macchina /= n_alternative
+
+    addetti = pd.to_numeric(righe['Addetti'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    righe = righe.assign(CaricoMacchina=carico_macchina, CaricoOperatori=durata * addetti)
+    carico_mac = righe.groupby(['Periodo', 'Macchina'], as_index=False)['CaricoMacchina'].sum()
+    carico_mac = carico_mac.rename(columns={'Macchina': 'Risorsa', 'CaricoMacchina': 'Carico_min'})
+    carico_mac['Tipo'] = 'Macchina'
+    # Pool condivisi: colonna del calendario turni -> (carico per riga, massimo della config)
+    pool = {'Operatori': ('CaricoOperatori', 'max_personale')}
+    if 'Carrelli' in righe.columns:
+        carrelli = pd.to_numeric(righe['Carrelli'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        righe['CaricoCarrelli'] = durata * carrelli
+        pool['Carrelli'] = ('CaricoCarrelli', 'max_carrelli')
+    carichi_pool = []
+    for tipo, (colonna, _) in pool.items():
+        carico = righe.groupby('Periodo', as_index=False)[colonna].sum().rename(columns={colonna: 'Carico_min'})
+        carichi_pool.append(carico.assign(Tipo=tipo, Risorsa=tipo))
+
+    # Minuti di turno per periodo: somma dei giorni del calendario che vi cadono
+    periodi = pd.concat([carico_mac['Periodo']] + [c['Periodo'] for c in carichi_pool]).unique()
+    giorni = pd.date_range(periodi.min(), pd.Series(periodi).max() + pd.tseries.frequencies.to_offset(frequenza),
+                           freq='D', inclusive='left')
+    turno = pd.Series(minuti_turno_giornalieri(giorni, config), index=giorni.to_period(frequenza).start_time)
+    turno_periodo = turno.groupby(level=0).sum()
+
+    macchine_cap = config.get('machine_caps', {})
+    carico_mac['Capacita_min'] = (carico_mac['Periodo'].map(turno_periodo)
+                                  * carico_mac['Risorsa'].map(lambda m: macchine_cap.get(m, 1)).astype(float))
+    con_turni = df_turni_personale is not None and not df_turni_personale.empty
+    for carico, (tipo, (_, chiave_max)) in zip(carichi_pool, pool.items()):
+        if con_turni and tipo in df_turni_personale.columns:
+            # Il simulatore ignora il massimo della config e segue l'organico del roster
+            capacita = minuti_organico_periodo(df_turni_personale, config, turno_periodo.index, frequenza, tipo)
+        else:
+            capacita = turno_periodo * float(config.get(chiave_max, 1))
+        carico['Capacita_min'] = carico['Periodo'].map(capacita)
+
+    risultato = pd.concat([carico_mac] + carichi_pool, ignore_index=True)
+    risultato = risultato[risultato['Carico_min'] > 0]
+    risultato['Utilizzo'] = np.divide(
+        risultato['Carico_min'].to_numpy(dtype=float), risultato['Capacita_min'].to_numpy(dtype=float),
+        out=np.full(len(risultato), np.inf), where=risultato['Capacita_min'].to_numpy() > 0
+    )
+    risultato['Sovraccarico'] = risultato['Utilizzo'] > 1
+    return risultato[COLONNE_RCCP].sort_values(['Periodo', 'Tipo', 'Risorsa']).reset_index(drop=True)
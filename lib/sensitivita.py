@@ -0,0 +1,166 @@
+"""
+lib/sensitivita.py
+Analisi di sensitività globale dei KPI rispetto ai parametri di configurazione
+(variability_factor, margin_pct, capacità macchine, max_carrelli, turni...).
+
+Ogni parametro è un intervallo (ParametroSweep, lib/sweep.py) mappato sul cubo unitario:
+- Morris (effetti elementari): r traiettorie su una griglia a `livelli` livelli, un passo
+  alla volta per parametro; mu* (media dei valori assoluti) ordina i parametri per
+  influenza, sigma misura non linearità e interazioni. Costo r x (k + 1) simulazioni.
+- Sobol (stimatori di Saltelli/Jansen): indici del primo ordine S1 (quota di varianza del
+  KPI dovuta al parametro da solo) e totali ST (con le interazioni), su matrici A, B da una
+  sequenza di Sobol. Costo N x (k + 2) simulazioni.
+- Oscillazione (tornado): KPI con un parametro al minimo e al massimo, gli altri al valore
+  dello scenario di base. Costo 2 x k + 1 simulazioni.
+
+Tutti i punti sono raccolti prima di simulare, arrotondati al passo dei parametri e
+deduplicati, poi valutati in un unico lotto sul pool di processi (lib/parallel.py). Con
+config['seed'] fissato ogni punto usa le stesse estrazioni di variabilità (numeri casuali
+comuni), quindi le differenze tra i punti dipendono solo dai parametri.
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from lib.kpi import COLONNE_KPI
+from lib.parallel import valuta_configurazioni
+from lib.simulator import SimulazioneAnnullata
+from lib.sweep import applica_punto, valore_config
+
+METODI = ('morris', 'sobol')
+COLONNE_INDICI = ['Parametro', 'KPI', 'Base', 'KPI_base', 'Basso', 'Alto', 'mu_star', 'mu', 'sigma', 'S1', 'ST']
+
+
+def _punto(parametri, u):
+    """Riga del cubo unitario -> punto {nome_parametro: valore} sul passo dei parametri."""
+    return {p.nome: p.arrotonda(p.minimo + ui * (p.massimo - p.minimo)) for p, ui in zip(parametri, u)}
+
+
+def traiettorie_morris(k, r, livelli, rng):
+    """
+    r traiettorie di Morris nel cubo unitario k-dimensionale: matrice (r x (k + 1), k) e,
+    per ogni traiettoria, l'ordine in cui i parametri si muovono. Ogni passo aumenta un
+    parametro di delta = livelli / (2 (livelli - 1)) partendo da un livello <= 1 - delta.
+    """
+    if livelli < 2 or livelli % 2:
+        raise ValueError(f"Il numero di livelli di Morris deve essere pari e >= 2: {livelli}")
+    delta = livelli / (2 * (livelli - 1))
+    righe, ordini = [], []
+    for _ in range(r):
+        x = rng.integers(0, livelli // 2, size=k) / (livelli - 1)
+        ordine = rng.permutation(k)
+        righe.append(x.copy())
+        for i in ordine:
+            x[i] += delta
+            righe.append(x.copy())
+        ordini.append(ordine)
+    return np.array(righe), ordini, delta
+
+
+def indici_morris(y, ordini, delta):
+    """Effetti elementari da y (r x (k + 1) valori del KPI) -> (mu_star, mu, sigma) per parametro."""
+    k = len(ordini[0])
+    effetti = np.full((len(ordini), k), np.nan)
+    for t, ordine in enumerate(ordini):
+        yt = y[t * (k + 1):(t + 1) * (k + 1)]
+        effetti[t, ordine] = np.diff(yt) / delta
+    with np.errstate(invalid='ignore'):
+        return (np.nanmean(np.abs(effetti), axis=0), np.nanmean(effetti, axis=0),
+                np.nanstd(effetti, axis=0, ddof=1) if len(ordini) > 1 else np.zeros(k))
+
+
+def matrici_saltelli(k, n, seed):
+    """Matrici A, B (n x k, n potenza di 2) da una sequenza di Sobol e le k matrici AB_i."""
+    esponente = max(1, int(np.ceil(np.log2(max(n, 2)))))
+    base = qmc.Sobol(d=2 * k, scramble=True, seed=seed).random_base2(esponente)
+    a, b = base[:, :k], base[:, k:]
+    ab = []
+    for i in range(k):
+        m = a.copy()
+        m[:, i] = b[:, i]
+        ab.append(m)
+    return a, b, ab
+
+
+def indici_sobol(y_a, y_b, y_ab):
+    """S1 (Saltelli 2010) e ST (Jansen) per parametro; NaN se il KPI non varia."""
+    varianza = np.nanvar(np.concatenate([y_a, y_b]))
+    if not varianza > 0:
+        nan = np.full(len(y_ab), np.nan)
+        return nan, nan
+    s1 = np.array([np.nanmean(y_b * (y - y_a)) for y in y_ab]) / varianza
+    st = np.array([np.nanmean((y_a - y) ** 2) / 2 for y in y_ab]) / varianza
+    return s1, st
+
+
+def esegui_sensitivita(payload, ctx):
+    """
+    Funzione di job (vedi lib/jobs.py). Payload:
+    {'input': dict input simulatore, 'config_base': dict, 'parametri': [ParametroSweep],
+     'metodi': sottoinsieme di METODI, 'traiettorie': int (Morris), 'livelli': int (Morris),
+     'n_sobol': int (campioni base Sobol), 'seed': int, 'max_workers': int|None}
+    Restituisce {'df_indici': COLONNE_INDICI, una riga per (parametro, KPI), 'df_campioni':
+    punti simulati con i KPI}.
+    """
+    parametri = payload['parametri']
+    if not parametri:
+        raise ValueError("Nessun parametro selezionato per l'analisi di sensitività")
+    metodi = payload.get('metodi', METODI)
+    if set(metodi) - set(METODI):
+        raise ValueError(f"Metodi non validi: {set(metodi) - set(METODI)}")
+    config_base = payload['config_base']
+    seed = payload.get('seed', 0)
+    rng = np.random.default_rng(seed)
+    k = len(parametri)
+    nomi = [p.nome for p in parametri]
+
+    # 1) Tutti i punti dei disegni
+    base = {p.nome: valore_config(config_base, p.nome, p.minimo) for p in parametri}
+    punti_oscillazione = [{**base, p.nome: valore} for p in parametri for valore in (p.minimo, p.massimo)]
+    disegni = {'base': [base], 'oscillazione': punti_oscillazione}
+    if 'morris' in metodi:
+        unita_morris, ordini, delta = traiettorie_morris(k, payload.get('traiettorie', 10),
+                                                         payload.get('livelli', 4), rng)
+        disegni['morris'] = [_punto(parametri, u) for u in unita_morris]
+    if 'sobol' in metodi:
+        a, b, ab = matrici_saltelli(k, payload.get('n_sobol', 32), seed)
+        disegni['sobol'] = [_punto(parametri, u) for u in np.vstack([a, b, *ab])]
+
+    # 2) Un solo lotto di simulazioni sui punti distinti
+    chiavi = {}
+    for punti in disegni.values():
+        for punto in punti:
+            chiavi.setdefault(tuple(punto[n] for n in nomi), punto)
+    distinti = list(chiavi.values())
+    kpi_punti = {}
+    configs = [applica_punto(config_base, p) for p in distinti]
+    for indice, kpi in valuta_configurazioni(payload['input'], configs, payload.get('max_workers'), ctx.annullato):
+        kpi_punti[tuple(distinti[indice][n] for n in nomi)] = kpi
+        ctx.aggiorna(len(kpi_punti) / len(distinti), f"{len(kpi_punti)}/{len(distinti)} punti simulati")
+    if ctx.annullato():
+        raise SimulazioneAnnullata(f"Analisi annullata dopo {len(kpi_punti)} punti")
+
+    def valori(punti, kpi):
+        return np.array([kpi_punti[tuple(p[n] for n in nomi)][kpi] for p in punti], dtype=float)
+
+    # 3) Indici per KPI (quelli definiti, es. il ritardo solo con le scadenze)
+    righe = []
+    for kpi in COLONNE_KPI:
+        if np.isnan(valori(distinti, kpi)).all():
+            continue
+        kpi_base = valori([base], kpi)[0]
+        oscillazione = valori(punti_oscillazione, kpi).reshape(k, 2)
+        mu_star = mu = sigma = s1 = st = np.full(k, np.nan)
+        if 'morris' in metodi:
+            mu_star, mu, sigma = indici_morris(valori(disegni['morris'], kpi), ordini, delta)
+        if 'sobol' in metodi:
+            y = valori(disegni['sobol'], kpi).reshape(k + 2, -1)
+            s1, st = indici_sobol(y[0], y[1], y[2:])
+        for i, p in enumerate(parametri):
+            righe.append({
+                'Parametro': p.nome, 'KPI': kpi, 'Base': float(base[p.nome]), 'KPI_base': kpi_base,
+                'Basso': oscillazione[i, 0], 'Alto': oscillazione[i, 1],
+                'mu_star': mu_star[i], 'mu': mu[i], 'sigma': sigma[i], 'S1': s1[i], 'ST': st[i],
+            })
+    df_campioni = pd.DataFrame([{**dict(zip(nomi, chiave)), **kpi} for chiave, kpi in kpi_punti.items()])
+    return {'df_indici': pd.DataFrame(righe, columns=COLONNE_INDICI), 'df_campioni': df_campioni}
@@ -6,56 +6,864 @@ Gestisce posticipi globali (solo 'Fase') o per lotto ('Lotto').
 
 Versione ottimizzata.
 """
-import random
+import heapq
+import re
+import zlib
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
 import simpy
 import pandas as pd
 from datetime import timedelta
+from simpy.resources.resource import Request
+
+
+class SimulazioneAnnullata(Exception):
+    """Sollevata quando `should_stop` chiede l'interruzione di una simulazione in corso."""
+
+
+class RichiestaMacchina(Request):
+    """Richiesta di una macchina con il codice del formato del lotto (-1 se non noto)."""
+
+    def __init__(self, resource, formato=-1):
+        # Il formato deve esistere prima che la richiesta entri in coda (Request.__init__)
+        self.formato = formato
+        super().__init__(resource)
+
+
+class RisorsaMacchina(simpy.Resource):
+    """
+    Macchina che ricorda l'ultimo formato lavorato e addebita il cambio formato all'acquisizione.
+
+    `cambi` è la matrice dei tempi di cambio della macchina, (n_formati + 1) x n_formati,
+    indicizzata dai codici dei formati; l'ultima riga (codice -1) è la macchina ancora ferma.
+    Con `campagne=True` la macchina che si libera serve per prima la richiesta in coda con il
+    suo ultimo formato, raggruppando i lotti dello stesso formato. Con capacità > 1 l'ultimo
+    formato è quello dell'ultima acquisizione.
+    """
+
+    def __init__(self, env, capacity=1, cambi=None, campagne=False):
+        super().__init__(env, capacity)
+        self.cambi = cambi
+        self.campagne = campagne
+        self.ultimo_formato = -1
+
+    def request(self, formato=-1):
+        return RichiestaMacchina(self, formato)
+
+    def cambio_verso(self, formato):
+        """Minuti di cambio dall'ultimo formato a `formato`, che diventa l'ultimo formato."""
+        if formato < 0:
+            return 0
+        minuti = int(self.cambi[self.ultimo_formato, formato]) if self.cambi is not None else 0
+        self.ultimo_formato = formato
+        return minuti
+
+    def _trigger_put(self, get_event):
+        if self.campagne and len(self.put_queue) > 1 and len(self.users) < self.capacity:
+            for i, richiesta in enumerate(self.put_queue):
+                if richiesta.formato == self.ultimo_formato:
+                    if i > 0:
+                        self.put_queue.insert(0, self.put_queue.pop(i))
+                    break
+        super()._trigger_put(get_event)
+
+
+def operatori_da_competenze(df_competenze):
+    """
+    Espande la matrice competenze (Operatore, Macchina, Fase, [Numero], [Gruppo]) in un
+    operatore per riga: Operatore, Gruppo e l'insieme delle qualifiche (macchina, fase), dove
+    None vale "qualsiasi". Una squadra con Numero=n diventa n operatori con le stesse
+    qualifiche. Il gruppo, se non indicato, è l'elenco delle qualifiche.
+    """
+    def _valore(v):
+        return None if v is None or (isinstance(v, float) and pd.isna(v)) or str(v).strip() == '' else v
+
+    qualifiche, numero, gruppo = {}, {}, {}
+    for rec in df_competenze.to_dict('records'):
+        nome = rec['Operatore']
+        qualifiche.setdefault(nome, set()).add((_valore(rec.get('Macchina')), _valore(rec.get('Fase'))))
+        numero[nome] = max(numero.get(nome, 1), int(rec.get('Numero', 1) or 1))
+        if _valore(rec.get('Gruppo')) is not None:
+            gruppo[nome] = rec['Gruppo']
+    righe = []
+    for nome, qual in qualifiche.items():
+        etichetta = gruppo.get(nome) or '+'.join(sorted(
+            '/'.join(str(x) for x in q if x is not None) or 'Polivalente' for q in qual))
+        righe += [{'Operatore': nome, 'Gruppo': etichetta, 'Qualifiche': frozenset(qual)}] * numero[nome]
+    return pd.DataFrame(righe, columns=['Operatore', 'Gruppo', 'Qualifiche'])
+
+
+class PoolOperatori:
+    """
+    Operatori qualificati come pool a bitmask. Ogni operatore è un bit; `idonei[k]` è la
+    maschera degli operatori qualificati per la chiave k (una coppia fase-macchina) e `liberi`
+    quella degli operatori liberi, quindi un'assegnazione è un AND tra interi. I bit sono
+    ordinati per numero crescente di qualifiche: prendendo i bit più bassi si impegnano
+    prima gli operatori meno polivalenti. Le richieste in coda sono servite in ordine, ma una
+    richiesta soddisfacibile non aspetta quelle precedenti che non lo sono.
+    """
+
+    def __init__(self, env, idonei, gruppo_operatore, n_gruppi):
+        self.env = env
+        self.idonei = idonei
+        self.gruppo_operatore = gruppo_operatore
+        self.liberi = (1 << len(gruppo_operatore)) - 1
+        self.coda = []
+        self.variazioni_gruppi = [[] for _ in range(n_gruppi)]
+
+    def richiedi(self, chiave, quanti):
+        """Evento che si attiva con la maschera degli operatori assegnati."""
+        evento = self.env.event()
+        self.coda.append((evento, chiave, quanti))
+        self._assegna()
+        return evento
+
+    def rilascia(self, maschera):
+        self.liberi |= maschera
+        self._registra(maschera, -1)
+        self._assegna()
+
+    def _registra(self, maschera, segno):
+        conteggi = {}
+        while maschera:
+            bit = maschera & -maschera
+            g = self.gruppo_operatore[bit.bit_length() - 1]
+            conteggi[g] = conteggi.get(g, 0) + 1
+            maschera ^= bit
+        for g, n in conteggi.items():
+            self.variazioni_gruppi[g].append((self.env.now, segno * n))
+
+    def _assegna(self):
+        in_attesa = []
+        for evento, chiave, quanti in self.coda:
+            disponibili = self.liberi & self.idonei[chiave]
+            if disponibili.bit_count() < quanti:
+                in_attesa.append((evento, chiave, quanti))
+                continue
+            scelti = 0
+            for _ in range(quanti):
+                bit = disponibili & -disponibili
+                scelti |= bit
+                disponibili ^= bit
+            self.liberi &= ~scelti
+            self._registra(scelti, 1)
+            evento.succeed(scelti)
+        self.coda = in_attesa
+
+
+class AvanzamentoFase:
+    """Pezzi di un lotto completati da una fase; `attendi(soglia)` si attiva quando sono almeno `soglia`."""
+
+    def __init__(self, env):
+        self.env = env
+        self.pezzi = 0
+        self.attese = [] # heap di (soglia, progressivo, evento)
+
+    def attendi(self, soglia):
+        evento = self.env.event()
+        if self.pezzi >= soglia - 1e-9: # Tolleranza: le porzioni sono float
+            evento.succeed()
+        else:
+            heapq.heappush(self.attese, (soglia, id(evento), evento))
+        return evento
+
+    def aggiungi(self, pezzi):
+        self.pezzi += pezzi
+        while self.attese and self.attese[0][0] <= self.pezzi + 1e-9:
+            heapq.heappop(self.attese)[2].succeed()
+
+
+def porzioni_trasferimento(quantita, dimensione):
+    """Quantità dei lotti di trasferimento (l'ultimo prende il resto); un solo lotto se `dimensione` non divide."""
+    if not dimensione or dimensione <= 0 or quantita <= dimensione:
+        return [quantita]
+    n_pieni, resto = divmod(quantita, dimensione)
+    return [dimensione] * int(n_pieni) + ([resto] if resto > 0 else [])
+
+
+class RisorsaBatch:
+    """
+    Formazione dei batch per una fase a ciclo fisso (es. AUTOCLAVI): lotti compatibili
+    (stessa `chiave`) sono caricati insieme fino a `capacita` unità di carico. Le code sono
+    indicizzate per chiave con il carico accumulato, quindi un arrivo costa O(1): il batch
+    parte appena la coda raggiunge la capacità o, al più tardi, `attesa_max` minuti dopo
+    l'arrivo del primo lotto in coda. Un lotto più grande della capacità parte da solo.
+    Finché il capofila attende la macchina il batch resta aperto: i lotti compatibili che
+    arrivano nel frattempo vi salgono se c'è posto (il capofila lo chiude con `chiudi`).
+
+    L'evento di `carica` si attiva con (membri, fine): `membri[0]` è il capofila che lavora
+    la fase per tutto il batch, `fine` l'evento che il capofila attiva a ciclo concluso.
+    """
+
+    def __init__(self, env, capacita, attesa_max=0):
+        self.env = env
+        self.capacita = capacita
+        self.attesa_max = attesa_max
+        self.code = {}     # chiave -> deque di (carico, membro, evento)
+        self.carichi = {}  # chiave -> carico totale in coda
+        self.generazione = {} # chiave -> contatore dei batch formati, per i timer scaduti
+        self.aperti = {}   # chiave -> [membri, carico, fine] del batch in attesa della macchina
+
+    def carica(self, chiave, carico, membro):
+        evento = self.env.event()
+        coda = self.code.setdefault(chiave, deque())
+        aperto = self.aperti.get(chiave)
+        if not coda and aperto is not None and aperto[1] + carico <= self.capacita:
+            aperto[0].append(membro)
+            aperto[1] += carico
+            evento.succeed((aperto[0], aperto[2]))
+            return evento
+        if not coda:
+            self.env.process(self._scadenza(chiave, self.generazione.get(chiave, 0)))
+        coda.append((carico, membro, evento))
+        self.carichi[chiave] = self.carichi.get(chiave, 0) + carico
+        while self.code[chiave] and self.carichi[chiave] >= self.capacita:
+            self._avvia(chiave)
+        return evento
+
+    def _scadenza(self, chiave, generazione):
+        yield self.env.timeout(self.attesa_max)
+        while self.code[chiave] and self.generazione.get(chiave, 0) == generazione:
+            self._avvia(chiave)
+
+    def _avvia(self, chiave):
+        """Forma un batch con i lotti in testa alla coda (FIFO) che stanno nella capacità."""
+        coda = self.code[chiave]
+        presi = [coda.popleft()]
+        totale = presi[0][0]
+        while coda and totale + coda[0][0] <= self.capacita:
+            presi.append(coda.popleft())
+            totale += presi[-1][0]
+        self.carichi[chiave] -= totale
+        self.generazione[chiave] = self.generazione.get(chiave, 0) + 1
+        if coda: # I rimasti aspettano al più `attesa_max` da ora
+            self.env.process(self._scadenza(chiave, self.generazione[chiave]))
+        membri = [membro for _, membro, _ in presi]
+        fine = self.env.event()
+        self.aperti[chiave] = [membri, totale, fine]
+        for _, _, evento in presi:
+            evento.succeed((membri, fine))
+
+    def chiudi(self, chiave, membri):
+        """Chiude il batch `membri` ai nuovi arrivi (il capofila ha ottenuto la macchina)."""
+        if chiave in self.aperti and self.aperti[chiave][0] is membri:
+            del self.aperti[chiave]
+
+
+@dataclass
+class Instradamento:
+    """Ciclo di lavoro compilato di un prodotto: fasi in ordine topologico e, per ciascuna,
+    le posizioni (in `fasi`) dei predecessori. `lineare` se ogni fase segue solo la precedente."""
+    fasi: list
+    predecessori: list
+    lineare: bool
+
+    def __post_init__(self):
+        # Fasi che alimentano almeno un'altra fase (hanno un buffer a valle, vedi 'buffer_fasi')
+        referenziate = {j for preds in self.predecessori for j in preds}
+        self.ha_successori = [k in referenziate for k in range(len(self.fasi))]
+
+    def aree_a_valle(self, aree):
+        """Per ogni fase, la fase area (nome in `aree`) di cui è l'unico predecessore, o None:
+        la fase occupa l'area prima di rilasciare la macchina (blocco a area piena)."""
+        out = [None] * len(self.fasi)
+        for j, preds in enumerate(self.predecessori):
+            if len(preds) == 1 and self.fasi[j]['Fase'] in aree:
+                out[preds[0]] = self.fasi[j]
+        return out
+
+
+def _nomi_predecessori(valore):
+    """'FASE_A, FASE_B' -> ['FASE_A', 'FASE_B'] (separatori ',' o ';'); vuoto/NaN -> []."""
+    if valore is None or (isinstance(valore, float) and pd.isna(valore)):
+        return []
+    return [nome.strip() for nome in re.split(r'[,;]', str(valore)) if nome.strip()]
+
+
+def raggruppa_alternative(fasi):
+    """
+    Unisce le righe della stessa fase (stesso 'Prodotto', se presente, e 'Fase') in un solo
+    record, il primo, con in 'Alternative' tutte le righe: macchine intercambiabili, ciascuna
+    con i suoi Tempo/Pezzi. Le fasi con una sola macchina restano invariate.
+    """
+    gruppi = {}
+    for fase in fasi:
+        gruppi.setdefault((fase.get('Prodotto'), fase['Fase']), []).append(fase)
+    out = []
+    for righe in gruppi.values():
+        out.append(righe[0] if len(righe) == 1 else {**righe[0], 'Alternative': righe})
+    return out
+
+
+class IndiceDisponibilita:
+    """
+    Indice delle fini previste del lavoro già assegnato alle macchine: per ogni macchina un
+    heap con una voce per unità di capacità. La scelta tra macchine alternative legge solo la
+    testa degli heap delle candidate, senza interrogare le risorse SimPy e le loro code.
+    Le previsioni ignorano le pause di turno; a fine fase la voce è riportata all'istante reale.
+    """
+
+    def __init__(self, capacita):
+        self.fini = {macchina: [0.0] * int(cap) for macchina, cap in capacita.items()}
+
+    def fine_prevista(self, macchina, ora, durata):
+        return max(ora, self.fini[macchina][0]) + durata
+
+    def prenota(self, macchina, ora, durata):
+        fine = self.fine_prevista(macchina, ora, durata)
+        heapq.heapreplace(self.fini[macchina], fine)
+        return macchina, fine
+
+    def libera(self, prenotazione, ora):
+        """A fase conclusa la fine prevista lascia il posto a quella reale."""
+        macchina, fine = prenotazione
+        heap = self.fini[macchina]
+        if fine != ora and fine in heap:
+            heap[heap.index(fine)] = ora
+            heapq.heapify(heap)
+
+
+def compila_instradamento(fasi):
+    """
+    Compila le fasi di un prodotto (record di df_tempi in ordine di riga) in un Instradamento.
+    Se nessuna fase indica 'Predecessori' le fasi sono in sequenza nell'ordine di riga;
+    altrimenti il ciclo è un grafo di precedenze e le fasi senza predecessori partono subito.
+    """
+    predecessori = [_nomi_predecessori(f.get('Predecessori')) for f in fasi]
+    if not any(predecessori):
+        return Instradamento(list(fasi), [[i - 1] if i else [] for i in range(len(fasi))], True)
+
+    nomi = [f['Fase'] for f in fasi]
+    if len(set(nomi)) < len(nomi):
+        raise ValueError(f"Fasi duplicate nello stesso ciclo con predecessori: {nomi}")
+    indice = {nome: i for i, nome in enumerate(nomi)}
+    successori = [[] for _ in fasi]
+    for i, preds in enumerate(predecessori):
+        ignoti = [p for p in preds if p not in indice]
+        if ignoti:
+            raise ValueError(f"Predecessori sconosciuti per la fase {nomi[i]}: {ignoti}")
+        for p in preds:
+            successori[indice[p]].append(i)
+
+    # Ordinamento topologico (Kahn), stabile rispetto all'ordine di riga
+    entranti = [len(set(p)) for p in predecessori]
+    pronte = [i for i, n in enumerate(entranti) if n == 0]
+    ordine = []
+    while pronte:
+        i = pronte.pop(0)
+        ordine.append(i)
+        for j in successori[i]:
+            entranti[j] -= 1
+            if entranti[j] == 0:
+                pronte.append(j)
+    if len(ordine) < len(fasi):
+        raise ValueError(f"Ciclo nelle precedenze delle fasi: {[nomi[i] for i in range(len(fasi)) if i not in ordine]}")
+
+    posizione = {i: k for k, i in enumerate(ordine)}
+    pred_ordinati = [sorted({posizione[indice[p]] for p in predecessori[i]}) for i in ordine]
+    lineare = all(preds == ([k - 1] if k else []) for k, preds in enumerate(pred_ordinati))
+    return Instradamento([fasi[i] for i in ordine], pred_ordinati, lineare)
+
+
+def _sintesi_fasi(df_risultati_eventi):
+    """Riduce il log eventi a una riga per (ID_Lotto, Fase) con Start/End in minuti e timestamp."""
+    return df_risultati_eventi[
+        df_risultati_eventi['Evento'].isin(['INIZIO_CHUNK', 'FINE_CHUNK'])
+    ].groupby(['ID_Lotto', 'Fase']).agg(
+        Macchina=('Macchina', 'first'),
+        Start=('SimTime', 'min'),
+        End=('SimTime', 'max'),
+        TimestampStart=('Timestamp', 'min'),
+        TimestampEnd=('Timestamp', 'max')
+    ).reset_index()
+
+
+def _successori(instradamento):
+    """Per ogni fase del ciclo compilato, le posizioni delle fasi che la seguono."""
+    successori = [[] for _ in instradamento.fasi]
+    for k, preds in enumerate(instradamento.predecessori):
+        for j in preds:
+            successori[j].append(k)
+    return successori
+
+
+def ultimi_inizi(instradamento, durate, fine_massima, calendari):
+    """
+    Passo all'indietro su un ciclo compilato, vettoriale sui lotti: `durate` [n_lotti, n_fasi]
+    in minuti lavorativi e `fine_massima` (scadenze) [n_lotti] in minuti di simulazione. Ogni
+    fase deve finire entro l'ultimo inizio dei suoi successori (le fasi finali entro la
+    scadenza); la sua durata si conta sul calendario della fase, `calendari[k]`
+    (CalendarioTurni, vedi `calendario_turni`) o, se None (soste in area), in minuti di calendario.
+    Restituisce gli ultimi inizi [n_lotti, n_fasi] in minuti di simulazione.
+    """
+    successori = _successori(instradamento)
+    inizi = np.empty_like(durate, dtype=float)
+    # In ordine topologico i successori hanno posizione maggiore: basta scorrere al contrario
+    for k in reversed(range(len(instradamento.fasi))):
+        fine = inizi[:, successori[k]].min(axis=1) if successori[k] else np.asarray(fine_massima, dtype=float)
+        if calendari[k] is None:
+            inizi[:, k] = fine - durate[:, k]
+        else:
+            inizi[:, k] = calendari[k].da_lavorativi(calendari[k].lavorativi(fine) - durate[:, k], inizio=True)
+    return inizi
+
+
+def rilasci_a_capacita(cicli, scadenze, capacita):
+    """
+    Passo all'indietro a capacità finita sulle macchine, per il rilascio dei lotti. I lotti, in
+    ordine di scadenza decrescente (a pari scadenza nell'ordine di `cicli`), prenotano ogni fase all'indietro dalla scadenza sull'unità
+    (`capacita`: {macchina: unità}) che la lascia finire più tardi tra le macchine della fase,
+    prima del lavoro già prenotato su quell'unità. `cicli` ha per lotto (instradamento, durate
+    [n_fasi], calendari, macchine): calendari come in `ultimi_inizi`, macchine[k] le macchine
+    della fase k o nessuna (fase che non impegna macchine). `scadenze` in minuti di simulazione.
+    Restituisce l'inizio della prima fase di ogni lotto, in minuti di simulazione.
+    """
+    libere = {m: [np.inf] * int(c) for m, c in capacita.items()} # per unità: inizio del primo lavoro prenotato
+    successori = {}
+    rilasci = np.empty(len(cicli))
+    for i in np.argsort(-np.asarray(scadenze, dtype=float), kind='stable'):
+        instradamento, durate, calendari, macchine = cicli[i]
+        succ = successori.setdefault(id(instradamento), _successori(instradamento))
+        inizi = np.empty(len(durate))
+        for k in reversed(range(len(durate))):
+            fine = min(inizi[j] for j in succ[k]) if succ[k] else float(scadenze[i])
+            calendario = calendari[k]
+            if calendario is None:
+                inizi[k] = fine - durate[k]
+                continue
+            unita = None
+            if macchine[k] and durate[k] > 0:
+                unita = max(((m, u) for m in macchine[k] for u in range(len(libere.setdefault(m, [np.inf])))),
+                            key=lambda mu: libere[mu[0]][mu[1]])
+                fine = min(fine, libere[unita[0]][unita[1]])
+            inizi[k] = calendario.da_lavorativi(calendario.lavorativi(fine) - durate[k], inizio=True)
+            if unita is not None:
+                libere[unita[0]][unita[1]] = inizi[k]
+        rilasci[i] = inizi.min()
+    return rilasci
+
+
+class CalendarioTurni:
+    """
+    Turni giornalieri (dalle 06:00) in minuti di simulazione con i minuti lavorativi cumulati
+    a inizio giorno: conversioni vettoriali tra tempo di calendario e tempo lavorativo.
+    """
+
+    def __init__(self, primo_giorno, n_giorni, origine, minuti_turno):
+        giorni = pd.date_range(pd.Timestamp(primo_giorno).normalize(), periods=n_giorni, freq='D')
+        self.turno = np.array([minuti_turno(g.weekday()) for g in giorni], dtype=float)
+        self.inizio = ((giorni - origine) / pd.Timedelta(minutes=1)).to_numpy(dtype=float) + 6 * 60
+        self.cumulati = np.concatenate([[0.0], np.cumsum(self.turno)])
+
+    def lavorativi(self, t):
+        """Minuti lavorativi cumulati all'istante t (minuti di simulazione)."""
+        t = np.asarray(t, dtype=float)
+        d = np.clip(np.searchsorted(self.inizio, t, side='right') - 1, 0, len(self.turno) - 1)
+        return self.cumulati[d] + np.clip(t - self.inizio[d], 0, self.turno[d])
+
+    def da_lavorativi(self, w, inizio=True):
+        """
+        Istante (minuti di simulazione) corrispondente a w minuti lavorativi cumulati: con
+        `inizio` il primo minuto di lavoro utile (un inizio), altrimenti la fine di un turno.
+        """
+        w = np.asarray(w, dtype=float)
+        d = np.searchsorted(self.cumulati[1:], w, side='right' if inizio else 'left')
+        d = np.clip(d, 0, len(self.turno) - 1)
+        return self.inizio[d] + np.clip(w - self.cumulati[d], 0, self.turno[d])
+
+
+def calendario_turni(config, primo_giorno, n_giorni, origine, estesa=False):
+    """
+    Calendario dei turni di `config` (vedi `CalendarioTurni`): work_std, work_ven il giorno
+    fri38, nessun turno nel fine settimana. Con `estesa` (fase in config['Turni_modificati'])
+    ogni turno dura config['extension'] minuti in più, come nel simulatore.
+    """
+    work_std, work_ven = config.get('work_std', 480), config.get('work_ven', 480)
+    fri38 = config.get('fri38_weekday', config.get('fri38', 4))
+    estensione = config.get('extension', 0) if estesa else 0
+
+    def minuti_turno(giorno_settimana):
+        minuti = work_ven if giorno_settimana == fri38 else (work_std if giorno_settimana < 5 else 0)
+        return minuti + estensione if minuti > 0 else 0
+
+    return CalendarioTurni(primo_giorno, n_giorni, origine, minuti_turno)
+
+
+def minuti_lavorativi(inizio, fine, fasi, config=None):
+    """
+    Minuti lavorativi tra `inizio` e `fine` (Timestamp, uno per elemento di `fasi`) sul
+    calendario dei turni di `config` (`calendario_turni`, esteso per le fasi in
+    Turni_modificati), come il lavoro che il simulatore conta; per le fasi in area
+    (config['aree'], soste senza turni) sono minuti di calendario. Array di float.
+    """
+    config = config or {}
+    inizio = pd.DatetimeIndex(pd.to_datetime(inizio))
+    fine = pd.DatetimeIndex(pd.to_datetime(fine))
+    if len(inizio) == 0:
+        return np.zeros(0)
+    origine = inizio.min().normalize()
+    n_giorni = (fine.max().normalize() - origine).days + 2
+    t_inizio = ((inizio - origine) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+    t_fine = ((fine - origine) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+
+    def svolti(estesa):
+        calendario = calendario_turni(config, origine, n_giorni, origine, estesa)
+        return calendario.lavorativi(t_fine) - calendario.lavorativi(t_inizio)
+
+    fasi = pd.Series(np.asarray(fasi))
+    minuti = svolti(False)
+    estese = fasi.isin(config.get('Turni_modificati', [])).to_numpy()
+    if estese.any() and config.get('extension', 0):
+        minuti = np.where(estese, svolti(True), minuti)
+    in_area = fasi.isin(list(config.get('aree', {}))).to_numpy()
+    return np.where(in_area, t_fine - t_inizio, minuti)
+
+
+class ContainerTurni(simpy.Container):
+    """
+    Pool di unità (operatori, carrelli) con organico variabile nel tempo. Un aumento entra
+    subito nel livello disponibile; una riduzione toglie le unità libere e, se non bastano,
+    lascia un debito saldato dalle unità restituite: chi è già al lavoro finisce il suo chunk.
+    """
+
+    def __init__(self, env, init=0):
+        super().__init__(env, capacity=float('inf'), init=init)
+        self.debito = 0
+
+    def varia_organico(self, delta):
+        if delta > 0:
+            saldo = min(delta, self.debito)
+            self.debito -= saldo
+            self._level += delta - saldo
+            self._trigger_get(None)
+        elif delta < 0:
+            tolte = min(-delta, self._level)
+            self._level -= tolte
+            self.debito += -delta - tolte
+
+    def _do_put(self, event):
+        saldo = min(event.amount, self.debito)
+        self.debito -= saldo
+        self._level += event.amount - saldo
+        event.succeed()
+        return True
+
+
+class FlottaCarrelli:
+    """
+    Carrelli identificati (1..n): il conteggio resta nel Container dei carrelli, che rende
+    atomiche le richieste di più unità; la flotta assegna gli identificativi dalla coda FIFO
+    dei liberi, così i carrelli ruotano, e conta i cicli di ciascuno. Con un calendario turni
+    l'organico può superare n: i carrelli mancanti ricevono un nuovo identificativo.
+    """
+
+    def __init__(self, n):
+        self.n = int(n)
+        self.liberi = deque(range(1, self.n + 1))
+        self.cicli = {}
+
+    def preleva(self, quanti):
+        presi = []
+        for _ in range(quanti):
+            if not self.liberi:
+                self.n += 1
+                self.liberi.append(self.n)
+            presi.append(self.liberi.popleft())
+        return presi
+
+    def restituisci(self, carrello):
+        self.cicli[carrello] = self.cicli.get(carrello, 0) + 1
+        self.liberi.append(carrello)
+
+
+def _minuti_ora(valori):
+    """Ora del giorno in minuti da numeri (ore), testi 'HH:MM[:SS]' o datetime.time."""
+    serie = pd.Series(valori)
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.to_numpy(dtype=float) * 60
+    testo = serie.astype(str).str.strip()
+    testo = testo.where(testo.str.count(':') >= 2, testo + ':00')
+    return (pd.to_timedelta(testo) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+
+
+def turni_del_roster(df_turni, config):
+    """
+    Righe del calendario turni del roster scelto: con la colonna 'Roster' (più calendari
+    alternativi) quelle di config['roster'], di default il primo; altrimenti tutte.
+    """
+    if 'Roster' not in df_turni.columns:
+        return df_turni
+    codici_roster = df_turni['Roster'].astype(str)
+    roster = str(config['roster']) if config.get('roster') is not None else codici_roster.iloc[0]
+    turni = df_turni[codici_roster == roster]
+    if turni.empty:
+        raise ValueError(f"Roster '{roster}' non presente nel calendario turni")
+    return turni
+
+
+def cambi_organico(df_turni, inizio, n_giorni, colonna='Operatori'):
+    """
+    Punti di cambio dell'organico da un calendario turni: restituisce (istanti, livelli), con
+    gli istanti in minuti da `inizio` (il primo è 0) e il livello valido da ciascuno in poi.
+
+    df_turni ha 'Ora_Inizio', 'Ora_Fine', la colonna `colonna` con le unità presenti e, per
+    riga, 'Data' (un giorno preciso, es. un festivo) o 'Giorno_Settimana' (0 = lunedì,
+    ricorrente). I giorni con righe 'Data' usano solo quelle. Gli intervalli sovrapposti si
+    sommano e quelli con fine <= inizio terminano il giorno dopo.
+    """
+    mancanti = {'Ora_Inizio', 'Ora_Fine', colonna} - set(df_turni.columns)
+    if mancanti:
+        raise KeyError(f"df_turni_personale mancano le colonne: {mancanti}")
+    giorni = pd.DataFrame({'Giorno': pd.date_range(pd.Timestamp(inizio).normalize(), periods=n_giorni, freq='D')})
+    turni = pd.DataFrame({
+        'Data': pd.to_datetime(df_turni['Data']).dt.normalize() if 'Data' in df_turni.columns else pd.NaT,
+        'Giorno_Settimana': (pd.to_numeric(df_turni['Giorno_Settimana'], errors='coerce')
+                             if 'Giorno_Settimana' in df_turni.columns else np.nan),
+        'Inizio': _minuti_ora(df_turni['Ora_Inizio']),
+        'Fine': _minuti_ora(df_turni['Ora_Fine']),
+        'Unita': pd.to_numeric(df_turni[colonna], errors='coerce').fillna(0).to_numpy(dtype=float),
+    })
+    specifici = turni[turni['Data'].notna()]
+    ricorrenti = turni[turni['Data'].isna() & turni['Giorno_Settimana'].notna()]
+    giorni['Giorno_Settimana'] = giorni['Giorno'].dt.weekday.astype(float)
+    giorni_normali = giorni[~giorni['Giorno'].isin(specifici['Data'])]
+    intervalli = pd.concat([
+        giorni_normali.merge(ricorrenti.drop(columns='Data'), on='Giorno_Settimana'),
+        specifici.rename(columns={'Data': 'Giorno'}).merge(giorni[['Giorno']], on='Giorno'),
+    ], ignore_index=True)
+    if intervalli.empty:
+        return np.zeros(1), np.zeros(1)
+    base = ((intervalli['Giorno'] - inizio) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+    inizi = base + intervalli['Inizio'].to_numpy()
+    fini = base + intervalli['Fine'].to_numpy() + np.where(intervalli['Fine'] <= intervalli['Inizio'], 24 * 60, 0)
+    tempi = np.maximum(np.concatenate([inizi, fini, [0.0]]), 0)
+    delta = np.concatenate([intervalli['Unita'], -intervalli['Unita'], [0.0]])
+    istanti, posizioni = np.unique(tempi, return_inverse=True)
+    return istanti, np.cumsum(np.bincount(posizioni, weights=delta))
+
+
+COLONNE_STATO_INIZIALE = ['ID_Lotto', 'Fase', 'Completata', 'Minuti_Svolti', 'Istante']
+
+
+def stato_da_consultivo(df_consultivo, istante, config=None):
+    """
+    Stato di avanzamento dei lotti all'`istante` dal consultivo (ID_Lotto, Fase, Start_Actual,
+    End_Actual), per l'avvio a caldo del simulatore (`df_stato_iniziale`): una riga per fase
+    completata (End_Actual <= istante) o in corso (iniziata e non ancora finita, con i minuti
+    già svolti). Le fasi non iniziate non compaiono. Una 'Macchina' nel consultivo è riportata.
+    I minuti svolti sono quelli lavorativi tra Start_Actual e `istante` sul calendario dei
+    turni di `config` (work_std, work_ven, fri38, extension per le Turni_modificati; default
+    del simulatore), come il lavoro residuo che il simulatore sottrae; per le fasi in area
+    (config['aree'], soste senza turni) sono minuti di calendario.
+    """
+    mancanti = {'ID_Lotto', 'Fase', 'Start_Actual', 'End_Actual'} - set(df_consultivo.columns)
+    if mancanti:
+        raise KeyError(f"df_consultivo mancano le colonne: {mancanti}")
+    istante = pd.Timestamp(istante)
+    inizio = pd.to_datetime(df_consultivo['Start_Actual'])
+    fine = pd.to_datetime(df_consultivo['End_Actual'])
+    completata = fine.notna() & (fine <= istante)
+    in_corso = ~completata & inizio.notna() & (inizio <= istante)
+    righe = df_consultivo.loc[completata | in_corso, ['ID_Lotto', 'Fase'] +
+                              (['Macchina'] if 'Macchina' in df_consultivo.columns else [])].copy()
+    righe['Completata'] = completata[righe.index]
+    righe['Minuti_Svolti'] = np.nan
+    aperte = righe.index[~righe['Completata']]
+    if len(aperte):
+        righe.loc[aperte, 'Minuti_Svolti'] = minuti_lavorativi(
+            inizio[aperte], np.full(len(aperte), istante), righe.loc[aperte, 'Fase'], config
+        )
+    righe['Istante'] = istante
+    # Una fase registrata più volte (es. ripresa) vale con il suo stato più avanzato
+    righe = righe.sort_values('Completata').drop_duplicates(['ID_Lotto', 'Fase'], keep='last')
+    return righe[COLONNE_STATO_INIZIALE + [c for c in righe.columns if c not in COLONNE_STATO_INIZIALE]]
+
+
+def _livelli_su_timeline(variazioni, istanti):
+    """
+    Livello di una risorsa negli `istanti` (minuti di simulazione, array ordinato) a partire
+    dalle variazioni registrate [(minuto, delta), ...]: somma cumulativa dei delta ordinati
+    per tempo e ricerca binaria dell'ultima variazione <= istante.
+    """
+    if not variazioni:
+        return np.zeros(len(istanti))
+    tempi, delta = np.asarray(variazioni, dtype=float).T
+    ordine = np.argsort(tempi, kind='stable')
+    livelli = np.cumsum(delta[ordine])
+    posizioni = np.searchsorted(tempi[ordine], istanti, side='right') - 1
+    return np.where(posizioni >= 0, livelli[np.maximum(posizioni, 0)], 0.0)
+
+
+# Estrazioni precalcolate per ogni (lotto, fase); oltre (durate richieste più volte per la
+# stessa fase) si calcolano al bisogno con la stessa funzione
+N_ESTRAZIONI = 4
+
+
+def _mescola64(x):
+    """Finalizzatore SplitMix64 vettoriale su uint64 (gli overflow sono modulo 2**64)."""
+    x = np.asarray(x, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def chiavi_stabili(valori):
+    """Chiavi uint64 deterministiche (CRC32 del testo), uguali tra processi ed esecuzioni."""
+    return np.array([zlib.crc32(str(v).encode()) for v in valori], dtype=np.uint64)
+
+
+def estrazioni_uniformi(seme, chiavi_lotti, chiavi_fasi, n):
+    """
+    Numeri casuali comuni: array [lotti, fasi, n] in [0, 1). Ogni (lotto, fase) ha un proprio
+    flusso, funzione solo del seme principale e delle due chiavi (vedi `chiavi_stabili`): due
+    scenari con lo stesso seme estraggono gli stessi valori per la stessa coppia, qualunque
+    sia l'ordine degli eventi o l'insieme degli altri lotti. Generatore basato su contatore
+    (SplitMix64), calcolato in blocco per tutte le coppie.
+    """
+    base = _mescola64(np.uint64(seme) ^ np.asarray(chiavi_lotti, dtype=np.uint64))
+    coppie = _mescola64(base[:, None] ^ _mescola64(np.asarray(chiavi_fasi, dtype=np.uint64))[None, :])
+    bit = _mescola64(coppie[:, :, None] + np.arange(n, dtype=np.uint64)[None, None, :])
+    return (bit >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+# Distribuzioni calibrate delle durate (lib/calibrazione.py): per gruppo (Fase, Formato,
+# Macchina) i quantili del rapporto durata reale / durata teorica; '*' = qualunque valore
+QUANTILI_DURATE = np.linspace(0.0, 1.0, 21)
+COLONNE_QUANTILI = [f"Q{round(q * 100):03d}" for q in QUANTILI_DURATE]
+TUTTI = '*'
+
+
+def righe_distribuzione(df_distribuzioni, chiavi):
+    """
+    Riga di df_distribuzioni (posizione, -1 se assente) per ogni chiave (fase, formato,
+    macchina), dal gruppo più specifico al più generale: (fase, formato, macchina),
+    (fase, formato, '*'), (fase, '*', '*').
+    """
+    gruppi = {
+        (str(f), str(fo), str(m)): i for i, (f, fo, m) in
+        enumerate(zip(df_distribuzioni['Fase'], df_distribuzioni['Formato'], df_distribuzioni['Macchina']))
+    }
+    righe = []
+    for fase, formato, macchina in chiavi:
+        fase, formato, macchina = str(fase), str(formato), str(macchina)
+        righe.append(gruppi.get((fase, formato, macchina),
+                                gruppi.get((fase, formato, TUTTI), gruppi.get((fase, TUTTI, TUTTI), -1))))
+    return np.array(righe, dtype=int)
+
+
+def rapporti_da_quantili(quantili, righe, u):
+    """
+    Estrazione in blocco per inversione della funzione di ripartizione: `quantili` (gruppi x
+    COLONNE_QUANTILI), `righe` (indice di gruppo, -1 = nessuno) e `u` in [0, 1) con forme
+    compatibili. Interpolazione lineare tra quantili consecutivi; NaN dove righe == -1.
+    """
+    quantili = np.asarray(quantili, dtype=float)
+    righe, u = np.broadcast_arrays(np.asarray(righe), np.asarray(u, dtype=float))
+    posizione = u * (quantili.shape[1] - 1)
+    k = np.minimum(np.floor(posizione).astype(int), quantili.shape[1] - 2)
+    frazione = posizione - k
+    r = np.maximum(righe, 0)
+    valori = quantili[r, k] * (1.0 - frazione) + quantili[r, k + 1] * frazione
+    return np.where(righe >= 0, valori, np.nan)
+
 
 def esegui_simulazione_ottimizzata(
     df_lotti_orig, df_tempi_orig, df_posticipi_orig, df_equivalenze_orig, 
-    df_posticipi_fisiologici_orig, config
+    df_posticipi_fisiologici_orig, config, *, df_cambi_formato=None, df_competenze=None,
+    df_turni_personale=None, df_stato_iniziale=None, df_distribuzioni_durate=None, progress_cb=None,
+    should_stop=None, con_eventi=False, con_buffer=False
 ):
-    # 0) Copia dei DataFrame per evitare modifiche agli originali passati
-    df_lotti = df_lotti_orig.copy()
-    df_tempi = df_tempi_orig.copy()
-    df_posticipi = df_posticipi_orig.copy() if df_posticipi_orig is not None else pd.DataFrame()
-    df_equivalenze = df_equivalenze_orig.copy()
-    df_posticipi_fisiologici = df_posticipi_fisiologici_orig.copy() if df_posticipi_fisiologici_orig is not None else pd.DataFrame()
-
-    # 0.1) Rinomina colonne lotti se necessario
-    # È più sicuro controllare se le colonne esistono prima di rinominarle
-    rename_map_lotti = {}
-    if 'Lotto' in df_lotti.columns:
-        rename_map_lotti['Lotto'] = 'ID_Lotto'
-    if 'Quantità' in df_lotti.columns:
-        rename_map_lotti['Quantita'] = 'Quantita'
-    if rename_map_lotti:
-        df_lotti = df_lotti.rename(columns=rename_map_lotti)
-    
+    """
+    Esegue la simulazione e restituisce (df_risultati, df_persone, df_energia, df_carrelli);
+    con `con_eventi=True` aggiunge in coda il log eventi completo (un evento per riga) e con
+    `con_buffer=True` la timeline di WIP e occupazione dei buffer e delle aree (colonne 'WIP',
+    'Buffer_<fase>', 'Area_<fase>').
+
+    Ogni lotto segue il ciclo del suo 'Prodotto' (vedi `compila_instradamento`): fasi in
+    sequenza o, con la colonna 'Predecessori', rami paralleli eseguiti in concorrenza.
+    Più righe della stessa fase sono macchine alternative (vedi `raggruppa_alternative`):
+    ogni fase va sulla macchina con la fine prevista più vicina (`IndiceDisponibilita`).
+
+    Con una colonna 'Scadenza' nei lotti si calcolano, con un passo all'indietro sul
+    calendario dei turni, gli ultimi inizi di ogni fase (df_risultati: 'InizioUltimo',
+    'Scadenza'), ciascuna sul calendario della sua fase (con config['extension'] per le
+    Turni_modificati). Con config['pianificazione'] == 'indietro' il lotto entra in produzione
+    al primo ultimo inizio anticipato di config['anticipo_rilascio'] minuti lavorativi (default
+    una giornata, margine per le code che il passo all'indietro non vede), non prima del suo
+    'Giorno'; le fasi successive partono appena possibile.
+
+    df_cambi_formato: tempi di cambio formato opzionali (Macchina, Da_Formato, A_Formato,
+        Tempo_Cambio in minuti); le coppie non elencate non hanno cambio.
+
+    df_competenze: matrice competenze opzionale (vedi `operatori_da_competenze`); se presente
+        gli operatori sono un pool di persone qualificate e `max_personale` è ignorato.
+        df_persone riporta anche gli occupati per gruppo ('Occupati_<gruppo>').
+    df_turni_personale: calendario turni opzionale (vedi `cambi_organico`) con 'Operatori' e,
+        facoltativa, 'Carrelli': sostituisce `max_personale`/`max_carrelli` con un organico
+        variabile nel tempo (df_persone/df_carrelli: colonna 'Organico'). Con la matrice
+        competenze vale solo per i carrelli. Con una colonna 'Roster' la tabella contiene più
+        calendari alternativi e config['roster'] sceglie quello da usare.
+
+    df_stato_iniziale: avvio a caldo opzionale (vedi `stato_da_consultivo`): la simulazione
+        parte dal suo 'Istante' invece che dalle 06:00 del primo giorno; le fasi completate non
+        si simulano e quelle in corso riprendono con il lavoro residuo (senza attese di inizio
+        né cambio formato), con i lotti in volo serviti per primi sulle risorse che tengono.
+
+    df_distribuzioni_durate: distribuzioni calibrate opzionali (vedi `lib.calibrazione`): la
+        durata di una fase il cui gruppo (Fase, Formato, Macchina principale, con ripiego su
+        (Fase, Formato) e Fase) è presente è moltiplicata per un rapporto reale / teorico
+        estratto dai quantili del gruppo invece della variabilità uniforme `variability_factor`,
+        con gli stessi numeri casuali comuni per (lotto, fase).
+
+    Carrelli: con config['ritorno_carrelli'] / ['lavaggio_carrelli'] un carrello rilasciato
+        rientra e passa dal lavaggio (config['stazioni_lavaggio']) prima di tornare disponibile
+        (vedi `FlottaCarrelli`); df_carrelli aggiunge 'Carrelli_rientro' e 'Carrelli_lavaggio'
+        e il log eventi un evento LAVAGGIO_CARRELLO per ciclo di ogni carrello.
+
+    progress_cb(frazione, df_parziale): chiamata periodicamente (ogni `passo_avanzamento`
+        minuti simulati, default una giornata) con la frazione di lotti completati e la
+        sintesi delle fasi già eseguite.
+    should_stop(): se restituisce True la simulazione si interrompe con `SimulazioneAnnullata`.
+    """
+    # 0) Gli input sono trattati come viste in sola lettura: possono essere DataFrame condivisi
+    # tra sessioni (lib/datastore.py), quindi niente copie né modifiche in place.
+    # Le colonne convertite vengono calcolate a parte e lette da dict/record locali.
+    df_lotti = df_lotti_orig
+    df_tempi = df_tempi_orig
+    df_posticipi = df_posticipi_orig if df_posticipi_orig is not None else pd.DataFrame()
+    df_equivalenze = df_equivalenze_orig
+    df_posticipi_fisiologici = df_posticipi_fisiologici_orig if df_posticipi_fisiologici_orig is not None else pd.DataFrame()
+
+    # 0.1) Nomi colonna dei lotti: 'Lotto'/'Quantità' (file caricati) o 'ID_Lotto'/'Quantita'
+    col_id_lotto = 'Lotto' if 'Lotto' in df_lotti.columns else 'ID_Lotto'
+    col_quantita = 'Quantità' if 'Quantità' in df_lotti.columns else 'Quantita'
+
     # 1) Validazione df_tempi
     tempo_col_name = 'Tempo_Minuti' if 'Tempo_Minuti' in df_tempi.columns else 'Tempo'
     required_cols_tempi = {'Fase', 'Macchina', tempo_col_name, 'Pezzi', 'Addetti', 'EnergiaFase'}
     missing_cols_tempi = required_cols_tempi - set(df_tempi.columns)
     if missing_cols_tempi:
         raise KeyError(f"df_tempi mancano le colonne: {missing_cols_tempi}")
-    # Assicurati che la colonna tempo_col_name sia numerica
-    df_tempi[tempo_col_name] = pd.to_numeric(df_tempi[tempo_col_name], errors='coerce')
-    df_tempi['Pezzi'] = pd.to_numeric(df_tempi['Pezzi'], errors='coerce')
+    # Record delle fasi (tabella piccola) con tempo e pezzi numerici, letti nel loop dei lotti
+    fasi_records = df_tempi.to_dict('records')
+    for fase_rec in fasi_records:
+        fase_rec[tempo_col_name] = pd.to_numeric(fase_rec[tempo_col_name], errors='coerce')
+        fase_rec['Pezzi'] = pd.to_numeric(fase_rec['Pezzi'], errors='coerce')
 
 
     # 2) Validazione df_lotti
-    required_cols_lotti = {'ID_Lotto', 'Formato', 'Quantita', 'Giorno'}
+    required_cols_lotti = {col_id_lotto, 'Formato', col_quantita, 'Giorno'}
     missing_cols_lotti = required_cols_lotti - set(df_lotti.columns)
     if missing_cols_lotti:
         raise KeyError(f"df_lotti mancano le colonne: {missing_cols_lotti}")
-    df_lotti['Quantita'] = pd.to_numeric(df_lotti['Quantita'], errors='coerce')
 
     # 3) Validazione df_equivalenze
     required_cols_equivalenze = {'Formato', 'Fase', 'Equivalenza_Unita'}
     missing_cols_equivalenze = required_cols_equivalenze - set(df_equivalenze.columns)
     if missing_cols_equivalenze:
         raise KeyError(f"df_equivalenze mancano le colonne: {missing_cols_equivalenze}")
-    df_equivalenze['Equivalenza_Unita'] = pd.to_numeric(df_equivalenze['Equivalenza_Unita'], errors='coerce')
 
 
     # 4) Validazione opzionale df_posticipi_fisiologici
@@ -65,44 +873,169 @@ def esegui_simulazione_ottimizzata(
         missing_cols_fisiologici = required_cols_fisiologici - set(df_posticipi_fisiologici.columns)
         if missing_cols_fisiologici:
             raise KeyError(f"df_posticipi_fisiologici mancano le colonne: {missing_cols_fisiologici}")
-        df_posticipi_fisiologici['TEMPO'] = pd.to_numeric(df_posticipi_fisiologici['TEMPO'], errors='coerce')
     elif include_fisio and df_posticipi_fisiologici.empty:
         # Se l'opzione è attiva ma il df è vuoto, non c'è nulla da validare o usare.
         # Potrebbe essere utile un warning o un log.
         pass
 
+    # 4.1) Validazione opzionale df_cambi_formato
+    if df_cambi_formato is not None:
+        required_cols_cambi = {'Macchina', 'Da_Formato', 'A_Formato', 'Tempo_Cambio'}
+        missing_cols_cambi = required_cols_cambi - set(df_cambi_formato.columns)
+        if missing_cols_cambi:
+            raise KeyError(f"df_cambi_formato mancano le colonne: {missing_cols_cambi}")
+
+    # 4.2) Validazione opzionale df_competenze
+    if df_competenze is not None:
+        required_cols_competenze = {'Operatore', 'Macchina', 'Fase'}
+        missing_cols_competenze = required_cols_competenze - set(df_competenze.columns)
+        if missing_cols_competenze:
+            raise KeyError(f"df_competenze mancano le colonne: {missing_cols_competenze}")
+
 
     # 5) Estrazione config (invariato, ma più leggibile con default espliciti)
     max_carrelli = config.get('max_carrelli', 1) # Default a 1 se non specificato
+    # Ciclo dei carrelli: a fine fase un carrello rientra (ritorno_carrelli minuti) e passa dal
+    # lavaggio (lavaggio_carrelli minuti su una delle stazioni_lavaggio, 0 = senza coda) prima
+    # di tornare disponibile; con il ciclo attivo il lotto tiene i carrelli per tutta la fase
+    ritorno_carrelli = float(config.get('ritorno_carrelli', 0) or 0)
+    lavaggio_carrelli = float(config.get('lavaggio_carrelli', 0) or 0)
+    stazioni_lavaggio = int(config.get('stazioni_lavaggio', 0) or 0)
+    ciclo_carrelli = ritorno_carrelli > 0 or lavaggio_carrelli > 0
     max_personale = config.get('max_personale', 1) # Default a 1 se non specificato
     machine_caps = config.get('machine_caps', {})
     work_std = config.get('work_std', 480) # Es. 8 ore
     work_ven = config.get('work_ven', 480) # Es. 8 ore venerdì
     workday_minutes = config.get('workday_minutes', 1440) # Minuti in un giorno 24h
     extension = config.get('extension', 0) # Estensione turno
-    fri38 = config.get('fri38_weekday', 4) # 4 per Venerdì (0 Lunedì - 6 Domenica)
+    fri38 = config.get('fri38_weekday', config.get('fri38', 4)) # 4 per Venerdì (0 Lunedì - 6 Domenica); la pagina 2 usa 'fri38'
     include_posticipi = config.get('includi_posticipi', False)
     
     variability_factor = config.get('variability_factor', 0.0) # Percentuale, es 0.1 per +/-10%
+    seme = int(config.get('seed', 0) or 0) # Seme principale dei flussi per (lotto, fase)
     margin_pct = config.get('margin_pct', 0.0) # Percentuale, es 0.05 per 5%
     granularity = config.get('granularity', 60) # Minuti
+    campagne_formato = config.get('campagne_formato', False) # Raggruppa i lotti per formato sulle macchine
+    # Buffer finiti a valle delle fasi: {fase: capacità} (0 o assente = illimitato), in lotti
+    # o, con buffer_in_carrelli, in carrelli; wip_max limita i lotti rilasciati in produzione
+    buffer_fasi = {fase: int(cap) for fase, cap in config.get('buffer_fasi', {}).items() if cap and cap > 0}
+    buffer_in_carrelli = config.get('buffer_in_carrelli', False)
+    wip_max = int(config.get('wip_max', 0) or 0)
+    # Fasi a batch (vedi `RisorsaBatch`): {fase: {'capacita': unità di carico, 'attesa_max':
+    # minuti, 'per_formato': bool}}; il carico di un lotto è la sua Equivalenza_Unita
+    fasi_batch = {fase: par for fase, par in config.get('fasi_batch', {}).items() if par.get('capacita', 0) > 0}
+    # Lotti di trasferimento: {fase: pezzi} in uscita dalla fase; la fase lavora il lotto intero
+    # sulla stessa macchina e ogni porzione completata passa subito alle fasi successive, che
+    # iniziano alla prima porzione (sovrapposizione). Fasi a batch, aree e fasi a tempo fisso
+    # (Pezzi nullo) attendono comunque tutto il lotto.
+    trasferimenti = {fase: float(dim) for fase, dim in config.get('lotti_trasferimento', {}).items()
+                     if dim and dim > 0 and fase not in fasi_batch}
+    # Aree passive (es. celle di raffreddamento/riposo): {fase: {'capacita': n, 'in_carrelli':
+    # bool}}; il lotto vi sosta per il 'Tempo' della riga della fase (per prodotto) senza
+    # macchina né operatori, occupando 1 posto o, con in_carrelli, i 'Carrelli' della riga
+    aree = {fase: par for fase, par in config.get('aree', {}).items() if par.get('capacita', 0) > 0}
     filter_format = config.get('filter_format', [])
     filter_line = config.get('filter_line', [])
     start_override = config.get('data_inizio', None)
+    pianificazione = config.get('pianificazione', 'avanti') # 'avanti' o 'indietro' (dalle scadenze)
+    # Posticipi e ritardi fisiologici di inizio fase: attese passive, o sulla macchina se True
+    trattieni_posticipi = config.get('trattieni_macchina_posticipi', False)
+    trattieni_fisiologici = config.get('trattieni_macchina_fisiologici', False)
 
-    # 6) Filtri lotti
-    lotti_filtrati = df_lotti.copy() # Lavora su una copia per i filtri
+    # 6) Filtri lotti: maschera booleana sull'input, senza copiare la tabella intera
+    mask_lotti = pd.Series(True, index=df_lotti.index)
     if filter_format:
-        lotti_filtrati = lotti_filtrati[lotti_filtrati['Formato'].isin(filter_format)]
-    if 'Linea' in lotti_filtrati.columns and filter_line:
-        lotti_filtrati = lotti_filtrati[lotti_filtrati['Linea'].isin(filter_line)]
-    
-    if lotti_filtrati.empty:
+        mask_lotti &= df_lotti['Formato'].isin(filter_format)
+    if 'Linea' in df_lotti.columns and filter_line:
+        mask_lotti &= df_lotti['Linea'].isin(filter_line)
+
+    if not mask_lotti.any():
         # Se non ci sono lotti dopo il filtraggio, restituisci DataFrame vuoti.
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+        vuoti = (pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame())
+        return vuoti + (pd.DataFrame(),) * (con_eventi + con_buffer)
+
+    # Solo le colonne usate dal simulatore, già convertite
+    lotti_filtrati = pd.DataFrame({
+        'ID_Lotto': df_lotti.loc[mask_lotti, col_id_lotto],
+        'Formato': df_lotti.loc[mask_lotti, 'Formato'],
+        'Quantita': pd.to_numeric(df_lotti.loc[mask_lotti, col_quantita], errors='coerce'),
+        'Giorno': pd.to_datetime(df_lotti.loc[mask_lotti, 'Giorno']),
+        'DifferenzaTempo': (df_lotti.loc[mask_lotti, 'DifferenzaTempo']
+                            if 'DifferenzaTempo' in df_lotti.columns else 0),
+    })
+
+    if 'Prodotto' in df_lotti.columns:
+        lotti_filtrati['Prodotto'] = df_lotti.loc[mask_lotti, 'Prodotto']
+    if 'Scadenza' in df_lotti.columns:
+        scadenze = pd.to_datetime(df_lotti.loc[mask_lotti, 'Scadenza'])
+        # Una data senza ora vale fino a fine giornata
+        lotti_filtrati['Scadenza'] = scadenze.where(scadenze != scadenze.dt.normalize(), scadenze + pd.Timedelta(days=1))
+
+    # 6.0) Variabilità: un flusso di numeri casuali per (lotto, fase) dal seme principale (vedi
+    # `estrazioni_uniformi`), così scenari con lo stesso seme differiscono solo per la config
+    chiavi_fasi = pd.unique(df_tempi['Fase'])
+    indice_lotti = {id_l: i for i, id_l in enumerate(pd.unique(lotti_filtrati['ID_Lotto']))}
+    indice_fasi = {fase: j for j, fase in enumerate(chiavi_fasi)}
+    calibrate = df_distribuzioni_durate is not None and not df_distribuzioni_durate.empty
+    tabella_estrazioni = (estrazioni_uniformi(seme, chiavi_stabili(indice_lotti), chiavi_stabili(chiavi_fasi), N_ESTRAZIONI)
+                          if variability_factor > 0 or calibrate else None)
+    estrazioni_usate = {}
+    # Distribuzioni calibrate: gruppo di ogni (lotto, fase) dalla macchina principale della fase
+    # nel ciclo del prodotto, e rapporti reale/teorico estratti in blocco per tutte le coppie
+    righe_gruppo = tabella_rapporti = quantili_durate = None
+    if calibrate:
+        mancanti = {'Fase', 'Formato', 'Macchina', *COLONNE_QUANTILI} - set(df_distribuzioni_durate.columns)
+        if mancanti:
+            raise KeyError(f"df_distribuzioni_durate mancano le colonne: {mancanti}")
+        quantili_durate = df_distribuzioni_durate[COLONNE_QUANTILI].to_numpy(dtype=float)
+        per_prodotto = 'Prodotto' in df_tempi.columns and 'Prodotto' in lotti_filtrati.columns
+        macchina_principale = {} # (prodotto, fase) e (None, fase) -> prima macchina della fase
+        for fase_rec in fasi_records:
+            macchina_principale.setdefault((fase_rec.get('Prodotto') if per_prodotto else None, fase_rec['Fase']),
+                                           fase_rec['Macchina'])
+            macchina_principale.setdefault((None, fase_rec['Fase']), fase_rec['Macchina'])
+        lotti_unici = lotti_filtrati.drop_duplicates('ID_Lotto')
+        prodotti = lotti_unici['Prodotto'] if per_prodotto else [None] * len(lotti_unici)
+        righe_gruppo = righe_distribuzione(df_distribuzioni_durate, [
+            (fase, formato, macchina_principale.get((prodotto, fase), macchina_principale.get((None, fase))))
+            for formato, prodotto in zip(lotti_unici['Formato'], prodotti) for fase in chiavi_fasi
+        ]).reshape(len(indice_lotti), len(chiavi_fasi))
+        tabella_rapporti = rapporti_da_quantili(quantili_durate, righe_gruppo[:, :, None], tabella_estrazioni)
+
+    def variabilita_fase(lotto_id, fase_nome):
+        """
+        Prossima variazione relativa della durata dal flusso (lotto, fase): rapporto calibrato - 1
+        se la fase ha una distribuzione, altrimenti uniforme in [-variability_factor, variability_factor).
+        """
+        if tabella_estrazioni is None:
+            return 0.0
+        k = estrazioni_usate.get((lotto_id, fase_nome), 0)
+        estrazioni_usate[(lotto_id, fase_nome)] = k + 1
+        i, j = indice_lotti[lotto_id], indice_fasi[fase_nome]
+        if righe_gruppo is not None and righe_gruppo[i, j] >= 0:
+            if k < N_ESTRAZIONI:
+                return float(tabella_rapporti[i, j, k]) - 1.0
+            u = estrazioni_uniformi(seme, chiavi_stabili([lotto_id]), chiavi_stabili([fase_nome]), k + 1)[0, 0, k]
+            return float(rapporti_da_quantili(quantili_durate, righe_gruppo[i, j], u)) - 1.0
+        if k < N_ESTRAZIONI:
+            u = tabella_estrazioni[i, j, k]
+        else:
+            u = estrazioni_uniformi(seme, chiavi_stabili([lotto_id]), chiavi_stabili([fase_nome]), k + 1)[0, 0, k]
+        return variability_factor * (2.0 * u - 1.0)
+
+    # 6.1) Cicli di lavoro compilati una volta per prodotto. Un lotto usa le fasi del suo
+    # 'Prodotto'; se il prodotto non ha fasi proprie (o manca la colonna) usa tutte le righe.
+    instradamenti = {}
+    if 'Prodotto' in df_tempi.columns and 'Prodotto' in lotti_filtrati.columns:
+        fasi_per_prodotto = {}
+        for fase_rec in fasi_records:
+            fasi_per_prodotto.setdefault(fase_rec['Prodotto'], []).append(fase_rec)
+        instradamenti = {prod: compila_instradamento(raggruppa_alternative(recs)) for prod, recs in fasi_per_prodotto.items()}
+    instradamento_base = None
+    if 'Prodotto' not in lotti_filtrati.columns or not lotti_filtrati['Prodotto'].isin(list(instradamenti)).all():
+        instradamento_base = compila_instradamento(raggruppa_alternative(fasi_records))
 
     # 7) Range temporale
-    lotti_filtrati['Giorno'] = pd.to_datetime(lotti_filtrati['Giorno'])
     if start_override:
         primo_giorno_sim = pd.to_datetime(start_override)
     else:
@@ -112,39 +1045,192 @@ def esegui_simulazione_ottimizzata(
     # Se start_override è una data senza ora, si assume l'inizio giornata (es. mezzanotte)
     # o si potrebbe specificare un'ora di default. Qui usiamo le 06:00 come nell'originale.
     start_sim_dt = primo_giorno_sim.replace(hour=6, minute=0, second=0, microsecond=0)
+
+    # 7.1) Avvio a caldo: la simulazione parte dall'istante dello stato di avanzamento.
+    # (ID_Lotto, Fase) -> minuti già svolti (fase in corso) o None (fase completata)
+    stato_iniziale = {}
+    macchine_in_corso = {}
+    if df_stato_iniziale is not None and not df_stato_iniziale.empty:
+        mancanti = set(COLONNE_STATO_INIZIALE) - set(df_stato_iniziale.columns)
+        if mancanti:
+            raise KeyError(f"df_stato_iniziale mancano le colonne: {mancanti}")
+        start_sim_dt = pd.Timestamp(df_stato_iniziale['Istante'].max())
+        for rec in df_stato_iniziale.to_dict('records'):
+            chiave = (str(rec['ID_Lotto']), rec['Fase'])
+            stato_iniziale[chiave] = None if rec['Completata'] else max(0.0, float(rec['Minuti_Svolti']))
+            if not rec['Completata'] and pd.notna(rec.get('Macchina')):
+                macchine_in_corso[chiave] = rec['Macchina']
+    lotti_in_volo = {id_l for id_l, _ in stato_iniziale}
     
     # Calcola fine simulazione: potrebbe essere basata sull'ultimo lotto o un orizzonte fisso
     # Qui usiamo l'ultimo giorno del lotto + un buffer (es. 30 giorni per sicurezza)
     # Questo evita di calcolare una `fine` troppo stretta.
     fine_sim_dt_estimata = lotti_filtrati['Giorno'].max() + timedelta(days=config.get('simulation_horizon_days', 30))
+    if 'Scadenza' in lotti_filtrati.columns and lotti_filtrati['Scadenza'].notna().any():
+        fine_sim_dt_estimata = max(fine_sim_dt_estimata, lotti_filtrati['Scadenza'].max() + timedelta(days=config.get('simulation_horizon_days', 30)))
     fine_sim_dt = fine_sim_dt_estimata.replace(hour=23, minute=59, second=59)
 
 
     # 8) Timeline risorse (saranno popolate DOPO la simulazione per efficienza)
     # Creeremo i DataFrame per il logging dopo, basati sui risultati effettivi.
     risultati_eventi = []
-    log_utilizzo_persone = []
-    log_utilizzo_carrelli = []
     log_consumo_energia = []
+    # Variazioni di livello [(minuto, delta)] aggregate in timeline a fine simulazione
+    # (vedi `_livelli_su_timeline`): una tupla per acquisizione/rilascio, nessuno snapshot
+    variazioni_persone = []
+    variazioni_carrelli = []
+    variazioni_rientro = [] # Carrelli in viaggio verso il lavaggio
+    variazioni_lavaggio = [] # Carrelli al lavaggio, in coda o in lavorazione
+    variazioni_wip = []
+    variazioni_buffer = {fase: [] for fase in buffer_fasi}
+    variazioni_aree = {fase: [] for fase in aree}
 
     # 9) Setup SimPy
     env = simpy.Environment(initial_time=0) # SimPy lavora con unità di tempo, non datetime diretti
                                           # La conversione avviene tramite start_sim_dt
 
-    persone_res = simpy.Resource(env, capacity=max_personale)
-    carrelli_res = simpy.Resource(env, capacity=max_carrelli)
+    # Operatori e carrelli sono pool di unità: una fase ne preleva `Addetti`/`Carrelli`
+    # e li restituisce a fine chunk. `simpy.Resource` non supporta richieste multiple,
+    # quindi si usano dei Container pieni all'avvio.
+    persone_res = simpy.Container(env, capacity=max_personale, init=max_personale)
+    carrelli_res = simpy.Container(env, capacity=max_carrelli, init=max_carrelli)
+
+    # Calendario turni: organico variabile, con i punti di cambio calcolati una volta sull'orizzonte.
+    # Le richieste sono limitate al picco dell'organico invece che al massimo costante.
+    organico = {} # 'Operatori'/'Carrelli' -> (istanti, livelli)
+    if df_turni_personale is not None and not df_turni_personale.empty:
+        turni = turni_del_roster(df_turni_personale, config)
+        n_giorni_turni = (fine_sim_dt - start_sim_dt).days + 2
+        for colonna in ('Operatori', 'Carrelli'):
+            if colonna in turni.columns:
+                organico[colonna] = cambi_organico(turni, start_sim_dt, n_giorni_turni, colonna)
+    istanti_riduzione = None # Cali dell'organico operatori: un chunk con operatori non li supera
+    if 'Operatori' in organico:
+        persone_res = ContainerTurni(env)
+        max_personale = max(1, int(organico['Operatori'][1].max()))
+        istanti_cambio, livelli = organico['Operatori']
+        istanti_riduzione = istanti_cambio[np.diff(livelli, prepend=0.0) < 0]
+    if 'Carrelli' in organico:
+        carrelli_res = ContainerTurni(env)
+        max_carrelli = int(organico['Carrelli'][1].max())
+
+    def processo_organico(env, pool, istanti, livelli):
+        attuale = 0
+        for t, livello in zip(istanti, livelli):
+            if t > env.now:
+                yield env.timeout(t - env.now)
+            pool.varia_organico(livello - attuale)
+            attuale = livello
+
+    for colonna, pool in (('Operatori', persone_res), ('Carrelli', carrelli_res)):
+        if colonna in organico:
+            env.process(processo_organico(env, pool, *organico[colonna]))
+    flotta = FlottaCarrelli(max_carrelli)
+    stazione_lavaggio = simpy.Resource(env, capacity=stazioni_lavaggio) if stazioni_lavaggio > 0 else None
+
+    def ciclo_carrello(carrello):
+        """Rientro e lavaggio di un carrello rilasciato, poi ritorno nel pool dei disponibili."""
+        if ritorno_carrelli > 0:
+            variazioni_rientro.append((env.now, 1))
+            yield env.timeout(ritorno_carrelli)
+            variazioni_rientro.append((env.now, -1))
+        variazioni_lavaggio.append((env.now, 1))
+        arrivo = env.now
+        if stazione_lavaggio is not None:
+            with stazione_lavaggio.request() as turno_lavaggio:
+                yield turno_lavaggio
+                inizio_lavaggio = env.now
+                yield env.timeout(lavaggio_carrelli)
+        else:
+            inizio_lavaggio = env.now
+            yield env.timeout(lavaggio_carrelli)
+        variazioni_lavaggio.append((env.now, -1))
+        flotta.restituisci(carrello)
+        carrelli_res.put(1)
+        risultati_eventi.append({
+            'Evento': 'LAVAGGIO_CARRELLO',
+            'Carrello': carrello,
+            'CicloCarrello': flotta.cicli[carrello],
+            'SimTime': inizio_lavaggio,
+            'Timestamp': get_datetime_from_sim_time(inizio_lavaggio),
+            'AttesaLavaggio': inizio_lavaggio - arrivo,
+            'DurataLavaggio': lavaggio_carrelli
+        })
+
+    def rilascia_carrelli(carrelli):
+        """Restituisce i carrelli di una fase: subito o, con il ciclo attivo, dopo rientro e lavaggio."""
+        variazioni_carrelli.append((env.now, -len(carrelli)))
+        if not ciclo_carrelli:
+            for carrello in carrelli:
+                flotta.restituisci(carrello)
+            carrelli_res.put(len(carrelli))
+            return
+        for carrello in carrelli:
+            env.process(ciclo_carrello(carrello))
+    # Buffer: livello = occupazione; pieno -> il lotto resta bloccato sulla macchina a monte
+    buffer_res = {fase: simpy.Container(env, capacity=cap, init=0) for fase, cap in buffer_fasi.items()}
+    wip_res = simpy.Container(env, capacity=wip_max, init=wip_max) if wip_max > 0 else None
+    # Aree: livello = posti (lotti o carrelli) occupati; piena -> blocca la fase a monte come un buffer
+    aree_res = {fase: simpy.Container(env, capacity=int(par['capacita']), init=0) for fase, par in aree.items()}
+    risorse_batch = {
+        fase: RisorsaBatch(env, float(par['capacita']), float(par.get('attesa_max', 0)))
+        for fase, par in fasi_batch.items()
+    }
     
+    # Cambi formato: un'unica matrice densa (macchina, da, a) indicizzata dai codici categorici
+    # di macchine e formati; il codice -1 ("nessun formato") cade sull'ultima riga, a zero.
+    macchine = pd.Index(pd.unique(df_tempi['Macchina']))
+    formati = pd.Index(pd.unique(lotti_filtrati['Formato']))
+    codice_formato = dict(zip(formati, range(len(formati))))
+    matrice_cambi = None
+    if df_cambi_formato is not None and not df_cambi_formato.empty:
+        matrice_cambi = np.zeros((len(macchine), len(formati) + 1, len(formati)), dtype=np.int32)
+        idx_mac = macchine.get_indexer(df_cambi_formato['Macchina'])
+        idx_da = formati.get_indexer(df_cambi_formato['Da_Formato'])
+        idx_a = formati.get_indexer(df_cambi_formato['A_Formato'])
+        minuti_cambio = pd.to_numeric(df_cambi_formato['Tempo_Cambio'], errors='coerce').fillna(0).round()
+        validi = (idx_mac >= 0) & (idx_da >= 0) & (idx_a >= 0) # Macchine/formati non simulati ignorati
+        matrice_cambi[idx_mac[validi], idx_da[validi], idx_a[validi]] = minuti_cambio.to_numpy()[validi]
+
+    # Competenze: operatori come bit (ordinati per polivalenza crescente) e, per ogni coppia
+    # (Fase, Macchina) di df_tempi, la maschera degli operatori qualificati, calcolata una volta
+    pool_operatori = None
+    chiave_competenza = {}
+    nomi_gruppi = []
+    if df_competenze is not None and not df_competenze.empty:
+        operatori = operatori_da_competenze(df_competenze)
+        operatori = operatori.iloc[np.argsort(operatori['Qualifiche'].map(len).to_numpy(), kind='stable')]
+        codici_gruppo, gruppi_idx = pd.factorize(operatori['Gruppo'])
+        nomi_gruppi = list(gruppi_idx)
+        idonei = []
+        for fase_rec in fasi_records:
+            chiave = (fase_rec['Fase'], fase_rec['Macchina'])
+            if chiave in chiave_competenza:
+                continue
+            maschera = 0
+            for bit, qual in enumerate(operatori['Qualifiche']):
+                if any((m is None or m == chiave[1]) and (f is None or f == chiave[0]) for m, f in qual):
+                    maschera |= 1 << bit
+            chiave_competenza[chiave] = len(idonei)
+            idonei.append(maschera)
+        pool_operatori = PoolOperatori(env, idonei, codici_gruppo.tolist(), len(nomi_gruppi))
+
     risorse_macchina = {
-        mac_name: simpy.Resource(env, capacity=machine_caps.get(mac_name, 1))
-        for mac_name in df_tempi['Macchina'].unique()
+        mac_name: RisorsaMacchina(
+            env, capacity=machine_caps.get(mac_name, 1),
+            cambi=matrice_cambi[i] if matrice_cambi is not None else None,
+            campagne=campagne_formato
+        )
+        for i, mac_name in enumerate(macchine)
     }
+    indice_macchine = IndiceDisponibilita({mac: risorsa.capacity for mac, risorsa in risorse_macchina.items()})
 
     # 10) Mappe ottimizzate
-    # Mappa tempi: Fase -> Tempo (in minuti)
-    tempo_map = df_tempi.set_index('Fase')[tempo_col_name].to_dict()
-
     # Mappa equivalenze: (Formato, Fase) -> Equivalenza_Unita
-    eq_map = df_equivalenze.set_index(['Formato', 'Fase'])['Equivalenza_Unita'].to_dict()
+    eq_map = dict(zip(
+        zip(df_equivalenze['Formato'], df_equivalenze['Fase']),
+        pd.to_numeric(df_equivalenze['Equivalenza_Unita'], errors='coerce')
+    ))
 
     # Mappa posticipi autorizzati
     post_map_specific = {} # (ID_Lotto, Fase) -> Tempo_Posticipo
@@ -162,13 +1248,11 @@ def esegui_simulazione_ottimizzata(
             else:
                  raise ValueError("df_posticipi non ha colonne per il tempo di posticipo.")
 
-        df_posticipi[col_tempo_posticipo] = pd.to_numeric(df_posticipi[col_tempo_posticipo], errors='coerce')
-
-        for _, row in df_posticipi.iterrows():
-            fase = row['Fase']
-            valore_posticipo = row[col_tempo_posticipo]
-            id_lotto = row.get('Lotto') # .get() gestisce se la colonna 'Lotto' non c'è o è opzionale
+        valori_posticipo = pd.to_numeric(df_posticipi[col_tempo_posticipo], errors='coerce')
+        # La colonna 'Lotto' è opzionale: senza, tutti i posticipi sono globali
+        lotti_posticipo = df_posticipi['Lotto'] if 'Lotto' in df_posticipi.columns else [None] * len(df_posticipi)
 
+        for fase, valore_posticipo, id_lotto in zip(df_posticipi['Fase'], valori_posticipo, lotti_posticipo):
             if pd.isna(id_lotto) or str(id_lotto).strip() == '': # Posticipo globale
                 post_map_global[(None, fase)] = post_map_global.get((None, fase), 0) + valore_posticipo
             else: # Posticipo specifico
@@ -179,7 +1263,9 @@ def esegui_simulazione_ottimizzata(
     if include_fisio and not df_posticipi_fisiologici.empty:
         # Assicurarsi che le colonne chiave non abbiano NA che romperebbero il set_index
         cols_fisio_key = ['FORMATO', 'FASE', 'QUANDO']
-        df_posticipi_fisiologici_cleaned = df_posticipi_fisiologici.dropna(subset=cols_fisio_key)
+        df_posticipi_fisiologici_cleaned = df_posticipi_fisiologici.dropna(subset=cols_fisio_key).assign(
+            TEMPO=lambda d: pd.to_numeric(d['TEMPO'], errors='coerce')
+        )
         if not df_posticipi_fisiologici_cleaned.empty:
             try:
                 fisio_map = df_posticipi_fisiologici_cleaned.set_index(cols_fisio_key)['TEMPO'].to_dict()
@@ -190,16 +1276,14 @@ def esegui_simulazione_ottimizzata(
                  fisio_map = df_posticipi_fisiologici_cleaned.groupby(cols_fisio_key)['TEMPO'].sum().to_dict()
         
 
-    # Pre-conversione di df_tempi in lista di record per accesso più rapido nel loop
-    # Questo è utile se si accede a più campi di fr (riga di df_tempi) ripetutamente
-    # df_tempi_records = df_tempi.to_dict('records') # Manteniamo df_tempi.iterrows() per ora,
-                                                  # la complessità è più nella logica interna al loop.
+    # df_tempi è già convertito in `fasi_records` (vedi punto 1): il loop dei lotti
+    # legge dict invece di creare una Series per riga con iterrows().
 
 
     # 11) Helpers
     def get_datetime_from_sim_time(sim_time_minutes):
         """Converte il tempo di simulazione (minuti dall'inizio) in un oggetto datetime."""
-        return start_sim_dt + timedelta(minutes=sim_time_minutes)
+        return start_sim_dt + timedelta(minutes=float(sim_time_minutes))
 
     def get_sim_time_from_datetime(dt_object):
         """Converte un oggetto datetime in tempo di simulazione (minuti dall'inizio)."""
@@ -279,7 +1363,18 @@ def esegui_simulazione_ottimizzata(
         return int(avail_in_current_shift_today), int(pause_night_duration), int(pause_weekend_duration)
 
 
-    def calculate_phase_times_resources(fase_info, quantita_lotto, formato_lotto):
+    def durata_prevista(fase_info, quantita):
+        """Durata di lavorazione senza variabilità, per le previsioni dell'indice macchine."""
+        pezzi, tempo = fase_info['Pezzi'], fase_info[tempo_col_name]
+        if fase_info['Fase'] == 'RAFFREDDAMENTO' or fase_info['Fase'] in aree:
+            return 0.0
+        if fase_info['Fase'] == 'AUTOCLAVI':
+            return float(tempo)
+        if pd.isna(pezzi) or pezzi == 0:
+            return 0.0
+        return quantita / float(pezzi) * float(tempo) * (1 + margin_pct)
+
+    def calculate_phase_times_resources(fase_info, quantita_lotto, formato_lotto, lotto_id):
         """Calcola durata, persone, energia, carrelli per una fase."""
         # fase_info è una riga (Series o dict) da df_tempi
         fase_nome = fase_info['Fase']
@@ -289,7 +1384,9 @@ def esegui_simulazione_ottimizzata(
         pezzi_per_tempo_unitario = fase_info['Pezzi']
         tempo_unitario = fase_info[tempo_col_name]
 
-        if pd.isna(pezzi_per_tempo_unitario) or pezzi_per_tempo_unitario == 0:
+        if fase_nome == 'RAFFREDDAMENTO' or fase_nome in aree:
+            durata_base = 0.0 # Sosta passiva: 'Pezzi' è 0 per costruzione (durata: vedi `sosta_in_area`)
+        elif pd.isna(pezzi_per_tempo_unitario) or pezzi_per_tempo_unitario == 0:
             if fase_nome == 'AUTOCLAVI': # Autoclavi ha tempo fisso
                 durata_base = float(tempo_unitario)
             else: # Altre fasi, se pezzi è 0, la durata potrebbe essere 0 o un default
@@ -304,7 +1401,7 @@ def esegui_simulazione_ottimizzata(
             durata_base = float(tempo_unitario)
 
         # Applica variabilità e margine
-        variabilita_effettiva = random.uniform(-variability_factor, variability_factor)
+        variabilita_effettiva = variabilita_fase(lotto_id, fase_nome)
         durata_calcolata = durata_base * (1 + margin_pct) * (1 + variabilita_effettiva)
         
         # Risorse
@@ -312,8 +1409,8 @@ def esegui_simulazione_ottimizzata(
         energia_consumata_per_unita_tempo_o_fase = float(fase_info.get('EnergiaFase', 0)) # Potrebbe essere energia totale per la fase o per minuto
         carrelli_necessari = int(fase_info.get('Carrelli', 0))
 
-        # Caso speciale RAFFREDDAMENTO
-        if fase_nome == 'RAFFREDDAMENTO':
+        # Caso speciale RAFFREDDAMENTO e fasi in un'area passiva (durata: vedi `sosta_in_area`)
+        if fase_nome == 'RAFFREDDAMENTO' or fase_nome in aree:
             durata_calcolata = 0 # Raffreddamento potrebbe essere un tempo di attesa passivo
             persone_necessarie = 0
             energia_consumata_per_unita_tempo_o_fase = 0
@@ -321,310 +1418,485 @@ def esegui_simulazione_ottimizzata(
             
         return int(round(durata_calcolata)), persone_necessarie, energia_consumata_per_unita_tempo_o_fase, carrelli_necessari
 
-    # 12) Processo SimPy per un lotto
-    def processo_lotto(env, lotto_record):
+    # 12) Processi SimPy per una fase e per un lotto
+    def processo_fase(env, lotto_record, fase_corrente_info, predecessori=(), ha_successori=True,
+                      buffer_lotto=None, flusso=None, area_valle=None):
+        """
+        Esegue una fase di un lotto: cambio formato, chunk di lavorazione per turno e ritardi.
+        Con `flusso` = (avanzamento della fase, soglie in uscita, avanzamenti dei predecessori)
+        la fase di un lotto di trasferimento lavora solo i pezzi già arrivati dai
+        predecessori, attendendo i successivi senza rilasciare la macchina, e segnala i pezzi
+        completati a ogni soglia (porzioni cumulate) in uscita.
+        `buffer_lotto` ({fase: (buffer, unità, variazioni)}) contiene i posti buffer e area
+        occupati dal lotto: la fase libera quelli dei `predecessori` quando acquisisce la
+        macchina e, se ha successori e un buffer a valle, vi entra prima di rilasciare la
+        macchina (blocco). Con `area_valle` (record della fase area successiva) il buffer a
+        valle è l'area stessa.
+        """
         lotto_id = lotto_record['ID_Lotto']
         formato_lotto = lotto_record['Formato']
+        codice_formato_lotto = codice_formato[formato_lotto]
         quantita_lotto = lotto_record['Quantita']
-        giorno_schedulato_lotto = lotto_record['Giorno'] # pd.Timestamp
-
-        # Calcola tempo di attesa iniziale se il lotto è schedulato per un giorno futuro
-        # rispetto all'inizio della simulazione o al tempo corrente di altri processi.
-        # SimPy gestisce questo implicitamente se i processi sono aggiunti con ritardi.
-        # Qui, potremmo voler un timeout esplicito per far partire il lotto non prima del suo 'Giorno'.
+        # Avvio a caldo: fase già completata (nulla da simulare) o in corso (lavoro residuo)
+        chiave_stato = (str(lotto_id), fase_corrente_info['Fase'])
+        in_volo = chiave_stato in stato_iniziale
+        if in_volo and stato_iniziale[chiave_stato] is None:
+            return
+        minuti_svolti = stato_iniziale.get(chiave_stato) or 0.0
+        alternative = fase_corrente_info.get('Alternative', ())
+        if chiave_stato in macchine_in_corso and any(a['Macchina'] == macchine_in_corso[chiave_stato] for a in alternative):
+            # Fase in corso: resta sulla macchina del consultivo
+            fase_corrente_info = next(a for a in alternative if a['Macchina'] == macchine_in_corso[chiave_stato])
+        elif alternative:
+            # Macchine alternative: quella con la fine prevista più vicina
+            fase_corrente_info = min(
+                fase_corrente_info['Alternative'],
+                key=lambda alt: indice_macchine.fine_prevista(alt['Macchina'], env.now,
+                                                              durata_prevista(alt, quantita_lotto))
+            )
+        fase_nome = fase_corrente_info['Fase']
+        macchina_richiesta = fase_corrente_info['Macchina']
         
-        # `DifferenzaTempo` nell'originale: `int(rec.get('DifferenzaTempo',0))*workday`
-        # Questo sembra un offset in giorni interi. Se `DifferenzaTempo` è una colonna in `lotti_filtrati`:
-        offset_giorni_lotto = int(lotto_record.get('DifferenzaTempo', 0))
-        if offset_giorni_lotto > 0:
-            yield env.timeout(offset_giorni_lotto * workday_minutes) # Timeout in minuti
+        # Ottieni equivalenza per la combinazione formato-fase
+        equivalenza = eq_map.get((formato_lotto, fase_nome), 1.0) # Default a 1.0 se non trovato
 
-        # In alternativa, o in aggiunta, assicurati che il lotto non inizi prima del suo giorno schedulato
-        sim_time_schedulato_lotto = get_sim_time_from_datetime(giorno_schedulato_lotto.replace(hour=6, minute=0)) # Inizia alle 6:00 del giorno schedulato
+        # Calcola posticipi autorizzati
+        posticipo_specifico = post_map_specific.get((str(lotto_id), fase_nome), 0)
+        posticipo_globale = post_map_global.get((None, fase_nome), 0)
+        posticipo_autorizzato_totale = posticipo_specifico + posticipo_globale
         
-        if env.now < sim_time_schedulato_lotto:
-            yield env.timeout(sim_time_schedulato_lotto - env.now)
+        # Calcola ritardi fisiologici (INIZIO_FASE)
+        ritardo_fisiologico_inizio = fisio_map.get((formato_lotto, fase_nome, 'INIZIO_FASE'), 0)
+        
+        # Attese prima della lavorazione (non per le fasi già in corso): sono attese passive,
+        # eseguite prima di `remaining_processing_time` (vedi `attese_pre_fase`)
+        if in_volo:
+            posticipo_autorizzato_totale = ritardo_fisiologico_inizio = 0
 
 
-        for _, fase_corrente_info in df_tempi.iterrows(): # Itera sulle righe di df_tempi (le fasi)
-            fase_nome = fase_corrente_info['Fase']
-            macchina_richiesta = fase_corrente_info['Macchina']
-            
-            # Ottieni equivalenza per la combinazione formato-fase
-            equivalenza = eq_map.get((formato_lotto, fase_nome), 1.0) # Default a 1.0 se non trovato
-
-            # Calcola posticipi autorizzati
-            posticipo_specifico = post_map_specific.get((str(lotto_id), fase_nome), 0)
-            posticipo_globale = post_map_global.get((None, fase_nome), 0)
-            posticipo_autorizzato_totale = posticipo_specifico + posticipo_globale
+        # Calcola tempo di processo base per la fase, quantità ed equivalenza
+        # La durata base da tempo_map è già per la quantità standard definita in df_tempi['Pezzi']
+        # Dobbiamo scalarla per la quantità del lotto e l'equivalenza.
+        # La funzione calculate_phase_times_resources fa già questo.
+        
+        # Il `tempo_map.get(fase_nome,0)` originale era usato per `t0`.
+        # Ma `calculate_phase_times_resources` prende `fase_corrente_info` che contiene già il tempo.
+        
+        # Il tempo_map originale era `df_tempi.set_index('Fase')[tempo_col_name].to_dict()`
+        # Questo è il tempo unitario per la quantità definita in 'Pezzi'.
+        # La durata effettiva dipende da `quantita_lotto`.
+        
+        # La logica originale: `remaining = int(t0 * eq + pdly + fdly)`
+        # Dove t0 era il tempo da `tempo_map`. Questo sembra implicare che `t0` fosse già
+        # il tempo totale per il lotto, non un tempo unitario.
+        # Se `tempo_map` contiene il tempo *totale* per una quantità standard,
+        # e `eq` scala questo, allora la logica è:
+        # tempo_base_da_mappa = tempo_map.get(fase_nome, 0)
+        # tempo_lavorazione_effettivo_fase = tempo_base_da_mappa * equivalenza
+        # Questa sembra essere l'interpretazione più vicina all'originale.
+        # Tuttavia, `calculate_phase_times_resources` è più esplicito e probabilmente più corretto
+        # se `df_tempi` definisce tassi di produzione (pezzi/tempo).
+
+        # Scegliamo di usare `calculate_phase_times_resources` per la durata,
+        # e aggiungiamo i ritardi/posticipi a questa durata.
+        durata_proc_calcolata, pers_req, energia_val, carrelli_req = \
+            calculate_phase_times_resources(fase_corrente_info, quantita_lotto, formato_lotto, lotto_id)
+
+        # Tempo di lavorazione della fase; posticipi e ritardi di inizio sono attese a parte
+        remaining_processing_time = max(0, durata_proc_calcolata - int(round(minuti_svolti)))
+
+        # Lotto di trasferimento: minuto di lavoro di ogni soglia in uscita (l'ultima porzione
+        # passa a fine fase) e minuti lavorabili con i pezzi arrivati dai predecessori
+        if flusso is not None:
+            avanzamento_uscita, soglie, ingressi = flusso
+            durata_flusso = remaining_processing_time
+            uscite = deque((int(np.ceil(durata_flusso * pezzi / quantita_lotto)), pezzi) for pezzi in soglie[:-1])
+
+        def minuti_turno_rimasti(istante):
+            """Minuti dall'`istante` alla fine del turno della fase nel suo giorno (0 fuori turno)."""
+            dt = get_datetime_from_sim_time(istante)
+            durata_turno = work_ven if dt.weekday() == fri38 else work_std
+            if fase_nome in config.get('Turni_modificati', []):
+                durata_turno += extension
+            minuti_giorno = dt.hour * 60 + dt.minute
+            return max(0, 6 * 60 + durata_turno - minuti_giorno) if minuti_giorno >= 6 * 60 else 0
+
+        def minuti_lavorabili():
+            """Minuti di lavoro della fase coperti dai pezzi arrivati da tutti i predecessori."""
+            arrivati = min((a.pezzi for a in ingressi), default=quantita_lotto)
+            if arrivati >= quantita_lotto - 1e-9:
+                return durata_flusso
+            return int(durata_flusso * arrivati // quantita_lotto)
+
+        def lavora_segnalando(minuti):
+            """Lavora `minuti` passando a valle le porzioni completate nel frattempo."""
+            inizio = env.now
+            svolti = durata_flusso - remaining_processing_time
+            while uscite and uscite[0][0] <= svolti + minuti:
+                minuto, pezzi = uscite.popleft()
+                yield env.timeout(max(0, inizio + minuto - svolti - env.now))
+                avanzamento_uscita.aggiungi(pezzi - avanzamento_uscita.pezzi)
+            yield env.timeout(inizio + minuti - env.now)
+
+        # Log dell'inizio fase (teorico, prima dell'acquisizione risorse)
+        # Non registriamo qui, ma quando il lavoro inizia effettivamente.
+
+        current_abs_start_time_fase = env.now # Momento in cui la fase è pronta per iniziare (dopo attese)
+
+        def unita_area(fase_area):
+            """Posti occupati nell'area della fase `fase_area`: 1 o, in carrelli, i 'Carrelli' della riga."""
+            area = aree_res[fase_area['Fase']]
+            if not aree[fase_area['Fase']].get('in_carrelli', False):
+                return 1
+            return min(max(1, int(fase_area.get('Carrelli', 0))), area.capacity)
+
+        # Buffer a valle: l'area della fase successiva o il buffer della fase (non per le aree,
+        # che fanno già da buffer), con nome, posti occupati e lista delle variazioni
+        buffer_uscita = None
+        if buffer_lotto is not None and area_valle is not None:
+            nome_uscita = area_valle['Fase']
+            buffer_uscita = aree_res[nome_uscita]
+            unita_uscita = unita_area(area_valle)
+            variazioni_uscita = variazioni_aree[nome_uscita]
+        elif ha_successori and buffer_lotto is not None and fase_nome in buffer_res and fase_nome not in aree_res:
+            nome_uscita = fase_nome
+            buffer_uscita = buffer_res[fase_nome]
+            unita_uscita = min(max(1, carrelli_req), buffer_uscita.capacity) if buffer_in_carrelli else 1
+            variazioni_uscita = variazioni_buffer[fase_nome]
+        in_buffer = False
+
+        def libera_buffer_predecessori():
+            for nome_pred in predecessori:
+                occupato = buffer_lotto.pop(nome_pred, None) if buffer_lotto is not None else None
+                if occupato is not None:
+                    buffer_pred, unita_pred, variazioni_pred = occupato
+                    buffer_pred.get(unita_pred)
+                    variazioni_pred.append((env.now, -unita_pred))
+
+        def entra_in_buffer():
+            inizio_attesa = env.now
+            yield buffer_uscita.put(unita_uscita)
+            variazioni_uscita.append((env.now, unita_uscita))
+            buffer_lotto[nome_uscita] = (buffer_uscita, unita_uscita, variazioni_uscita)
+            if env.now > inizio_attesa:
+                risultati_eventi.append({
+                    'ID_Lotto': lotto_id,
+                    'Formato': formato_lotto,
+                    'Fase': fase_nome,
+                    'Macchina': macchina_richiesta,
+                    'Evento': 'BLOCCO_BUFFER',
+                    'SimTime': inizio_attesa,
+                    'Timestamp': get_datetime_from_sim_time(inizio_attesa),
+                    'DurataBlocco': env.now - inizio_attesa
+                })
+
+        def attese_pre_fase():
+            """
+            Posticipi autorizzati e ritardi fisiologici di inizio fase come attese passive: il
+            lotto non impegna macchina, operatori né carrelli (es. prodotto a riposo). Con
+            config['trattieni_macchina_posticipi'] / ['trattieni_macchina_fisiologici'] quel tipo
+            di attesa si passa invece sulla macchina (solo la macchina), dopo quelle libere.
+            Restituisce la richiesta della macchina trattenuta, o None.
+            """
+            trattenibile = remaining_processing_time > 0 and fase_nome not in risorse_batch
+            attese = [('POSTICIPO', posticipo_autorizzato_totale, trattieni_posticipi and trattenibile),
+                      ('FISIOLOGICO', ritardo_fisiologico_inizio, trattieni_fisiologici and trattenibile)]
+            richiesta = None
+            for tipo, minuti, trattieni in sorted(attese, key=lambda a: a[2]):
+                if minuti <= 0:
+                    continue
+                if trattieni and richiesta is None:
+                    richiesta = risorse_macchina[macchina_richiesta].request(codice_formato_lotto)
+                    yield richiesta
+                    libera_buffer_predecessori()
+                risultati_eventi.append({
+                    'ID_Lotto': lotto_id,
+                    'Formato': formato_lotto,
+                    'Fase': fase_nome,
+                    'Macchina': macchina_richiesta,
+                    'Evento': 'ATTESA',
+                    'SimTime': env.now,
+                    'Timestamp': get_datetime_from_sim_time(env.now),
+                    'TipoAttesa': tipo,
+                    'DurataAttesa': minuti,
+                    'MacchinaTrattenuta': trattieni
+                })
+                yield env.timeout(minuti)
+            return richiesta
+
+        def sosta_in_area():
+            """
+            Fase in un'area passiva: il lotto occupa i suoi posti (se la fase a monte non li ha
+            già presi per lui) e vi resta per il 'Tempo' della riga, senza macchina, operatori né
+            turni. I posti si liberano quando la fase successiva acquisisce la macchina o, senza
+            successori o per i lotti di trasferimento, a fine sosta.
+            """
+            area = aree_res[fase_nome]
+            occupato = buffer_lotto.pop(fase_nome, None) if buffer_lotto is not None else None
+            if occupato is None:
+                unita = unita_area(fase_corrente_info)
+                yield area.put(unita)
+                variazioni_aree[fase_nome].append((env.now, unita))
+                occupato = (area, unita, variazioni_aree[fase_nome])
+            libera_buffer_predecessori()
+            durata = fase_corrente_info[tempo_col_name]
+            durata = max(0, int(round(float(durata) - minuti_svolti))) if pd.notna(durata) else 0
+            for evento, durata_chunk in (('INIZIO_CHUNK', 'DurataChunkPianificata'), ('FINE_CHUNK', 'DurataChunkEffettiva')):
+                risultati_eventi.append({
+                    'ID_Lotto': lotto_id,
+                    'Formato': formato_lotto,
+                    'Quantita': quantita_lotto,
+                    'Fase': fase_nome,
+                    'Macchina': macchina_richiesta,
+                    'Evento': evento,
+                    'SimTime': env.now,
+                    'Timestamp': get_datetime_from_sim_time(env.now),
+                    durata_chunk: durata,
+                    'PostiArea': occupato[1]
+                })
+                if evento == 'INIZIO_CHUNK':
+                    yield env.timeout(durata)
+            if buffer_lotto is not None and ha_successori:
+                buffer_lotto[fase_nome] = occupato
+            else:
+                area.get(occupato[1])
+                occupato[2].append((env.now, -occupato[1]))
+
+        richiesta_trattenuta = yield from attese_pre_fase()
+        if fase_nome in aree_res:
+            yield from sosta_in_area()
+
+        # Fasi a batch: si attende la formazione del batch. Lavorano solo i capofila, per tutti
+        # i membri (stesso ciclo: la chiave di compatibilità include il tempo della fase); gli
+        # altri lotti attendono la fine del ciclo senza impegnare risorse.
+        membri_batch = [lotto_record]
+        fine_batch = None
+        if fase_nome in risorse_batch and not in_volo:
+            per_formato = fasi_batch[fase_nome].get('per_formato', False)
+            chiave_batch = (macchina_richiesta, fase_corrente_info[tempo_col_name], formato_lotto if per_formato else None)
+            carico = float(equivalenza) if pd.notna(equivalenza) else 1.0
+            membri_batch, fine_batch = yield risorse_batch[fase_nome].carica(chiave_batch, carico, lotto_record)
+            if membri_batch[0] is not lotto_record:
+                libera_buffer_predecessori()
+                yield fine_batch
+                remaining_processing_time = 0
+                fine_batch = None
+
+        prenotazione = (indice_macchine.prenota(macchina_richiesta, env.now, remaining_processing_time)
+                        if remaining_processing_time > 0 else None)
+        carrelli_lotto = [] # Identificativi dei carrelli in uso (vedi `FlottaCarrelli`)
+
+        while remaining_processing_time > 0:
+            if flusso is not None and minuti_lavorabili() <= durata_flusso - remaining_processing_time:
+                # Lotto di trasferimento in attesa dei pezzi dei predecessori, con la macchina
+                # trattenuta (se già acquisita) e operatori liberi
+                arrivati = min(a.pezzi for a in ingressi)
+                yield simpy.AllOf(env, [a.attendi(arrivati + 1e-6) for a in ingressi if a.pezzi <= arrivati + 1e-9])
+                continue
+            sim_time_now = env.now
             
-            # Calcola ritardi fisiologici (INIZIO_FASE)
-            ritardo_fisiologico_inizio = fisio_map.get((formato_lotto, fase_nome, 'INIZIO_FASE'), 0)
+            # Calcola disponibilità turno corrente e pause
+            # Questa funzione helper deve essere robusta.
+            # `avail_in_current_shift_today` è quanto si può lavorare *ora* prima di una pausa.
+            # `pause_night_duration`, `pause_weekend_duration` sono le durate delle pause *successive*.
             
-            # Tempo di attesa totale prima di iniziare effettivamente la lavorazione della fase
-            tempo_attesa_pre_fase = posticipo_autorizzato_totale + ritardo_fisiologico_inizio
-            if tempo_attesa_pre_fase > 0:
-                # Questo tempo di attesa è tempo "morto" o di preparazione,
-                # durante il quale le risorse potrebbero non essere impegnate.
-                # La logica originale lo sommava a `remaining_processing_time`.
-                # Se è attesa pura, dovrebbe essere un timeout separato.
-                # Se è preparazione che usa risorse, va gestito diversamente.
-                # Assumiamo sia attesa passiva per ora.
-                # yield env.timeout(tempo_attesa_pre_fase) # Commentato, l'originale lo aggiungeva al tempo di processo
-                pass
-
-
-            # Calcola tempo di processo base per la fase, quantità ed equivalenza
-            # La durata base da tempo_map è già per la quantità standard definita in df_tempi['Pezzi']
-            # Dobbiamo scalarla per la quantità del lotto e l'equivalenza.
-            # La funzione calculate_phase_times_resources fa già questo.
+            # Logica turni: determina quanto si può lavorare ora.
+            # La funzione `get_turn_durations` deve essere precisa.
+            # Per semplicità, assumiamo che `work_std`, `work_ven` siano le durate lavorabili
+            # e che la simulazione salti i periodi non lavorativi.
             
-            # Il `tempo_map.get(fase_nome,0)` originale era usato per `t0`.
-            # Ma `calculate_phase_times_resources` prende `fase_corrente_info` che contiene già il tempo.
+            # Semplificazione della logica dei turni per l'integrazione con SimPy:
+            # 1. Calcola quanto tempo si può lavorare nel turno corrente.
+            # 2. Se il `chunk` da lavorare è più grande, lavora fino a fine turno.
+            # 3. Fai un timeout per la pausa (notte/weekend).
+            # 4. Ripeti.
+
+            dt_now = get_datetime_from_sim_time(sim_time_now)
+            current_weekday = dt_now.weekday()
             
-            # Il tempo_map originale era `df_tempi.set_index('Fase')[tempo_col_name].to_dict()`
-            # Questo è il tempo unitario per la quantità definita in 'Pezzi'.
-            # La durata effettiva dipende da `quantita_lotto`.
+            # Durata del turno lavorativo per OGGI
+            shift_duration_today = work_ven if current_weekday == fri38 else work_std
+            if fase_nome in config.get('Turni_modificati', []): # Applica estensioni
+                shift_duration_today += extension
+
+            # Ora di inizio turno (es. 6:00)
+            shift_start_hour = 6 
+            shift_start_minute_in_day = shift_start_hour * 60
+
+            # Minuti trascorsi dall'inizio del giorno civile corrente (00:00)
+            minutes_past_midnight = dt_now.hour * 60 + dt_now.minute
+
+            # Calcola quanto tempo è disponibile nel turno corrente
+            time_available_in_shift = 0
+            if minutes_past_midnight >= shift_start_minute_in_day and \
+               minutes_past_midnight < (shift_start_minute_in_day + shift_duration_today):
+                # Siamo nel turno lavorativo
+                time_available_in_shift = (shift_start_minute_in_day + shift_duration_today) - minutes_past_midnight
             
-            # La logica originale: `remaining = int(t0 * eq + pdly + fdly)`
-            # Dove t0 era il tempo da `tempo_map`. Questo sembra implicare che `t0` fosse già
-            # il tempo totale per il lotto, non un tempo unitario.
-            # Se `tempo_map` contiene il tempo *totale* per una quantità standard,
-            # e `eq` scala questo, allora la logica è:
-            # tempo_base_da_mappa = tempo_map.get(fase_nome, 0)
-            # tempo_lavorazione_effettivo_fase = tempo_base_da_mappa * equivalenza
-            # Questa sembra essere l'interpretazione più vicina all'originale.
-            # Tuttavia, `calculate_phase_times_resources` è più esplicito e probabilmente più corretto
-            # se `df_tempi` definisce tassi di produzione (pezzi/tempo).
-
-            # Scegliamo di usare `calculate_phase_times_resources` per la durata,
-            # e aggiungiamo i ritardi/posticipi a questa durata.
-            durata_proc_calcolata, pers_req, energia_val, carrelli_req = \
-                calculate_phase_times_resources(fase_corrente_info, quantita_lotto, formato_lotto)
-
-            # Tempo totale da processare per questa fase, inclusi ritardi che estendono la durata
-            remaining_processing_time = durata_proc_calcolata + tempo_attesa_pre_fase # Aggiungiamo qui i ritardi come nell'originale
-
-            # Log dell'inizio fase (teorico, prima dell'acquisizione risorse)
-            # Non registriamo qui, ma quando il lavoro inizia effettivamente.
-
-            current_abs_start_time_fase = env.now # Momento in cui la fase è pronta per iniziare (dopo attese)
-
-            while remaining_processing_time > 0:
-                sim_time_now = env.now
-                
-                # Calcola disponibilità turno corrente e pause
-                # Questa funzione helper deve essere robusta.
-                # `avail_in_current_shift_today` è quanto si può lavorare *ora* prima di una pausa.
-                # `pause_night_duration`, `pause_weekend_duration` sono le durate delle pause *successive*.
-                
-                # Logica turni: determina quanto si può lavorare ora.
-                # La funzione `get_turn_durations` deve essere precisa.
-                # Per semplicità, assumiamo che `work_std`, `work_ven` siano le durate lavorabili
-                # e che la simulazione salti i periodi non lavorativi.
-                
-                # Semplificazione della logica dei turni per l'integrazione con SimPy:
-                # 1. Calcola quanto tempo si può lavorare nel turno corrente.
-                # 2. Se il `chunk` da lavorare è più grande, lavora fino a fine turno.
-                # 3. Fai un timeout per la pausa (notte/weekend).
-                # 4. Ripeti.
-
-                dt_now = get_datetime_from_sim_time(sim_time_now)
-                current_weekday = dt_now.weekday()
-                
-                # Durata del turno lavorativo per OGGI
-                shift_duration_today = work_ven if current_weekday == fri38 else work_std
-                if fase_nome in config.get('Turni_modificati', []): # Applica estensioni
-                    shift_duration_today += extension
-
-                # Ora di inizio turno (es. 6:00)
-                shift_start_hour = 6 
-                shift_start_minute_in_day = shift_start_hour * 60
-
-                # Minuti trascorsi dall'inizio del giorno civile corrente (00:00)
-                minutes_past_midnight = dt_now.hour * 60 + dt_now.minute
-
-                # Calcola quanto tempo è disponibile nel turno corrente
-                time_available_in_shift = 0
-                if minutes_past_midnight >= shift_start_minute_in_day and \
-                   minutes_past_midnight < (shift_start_minute_in_day + shift_duration_today):
-                    # Siamo nel turno lavorativo
-                    time_available_in_shift = (shift_start_minute_in_day + shift_duration_today) - minutes_past_midnight
+            if time_available_in_shift <= 0 : # Siamo fuori turno o a fine turno
+                # Calcola il tempo fino all'inizio del prossimo turno
+                time_to_next_shift_start = 0
+                if minutes_past_midnight >= (shift_start_minute_in_day + shift_duration_today):
+                    # Il turno di oggi è finito, vai al giorno dopo
+                    time_to_next_shift_start = (workday_minutes - minutes_past_midnight) + shift_start_minute_in_day
+                else: # Siamo prima dell'inizio del turno di oggi
+                    time_to_next_shift_start = shift_start_minute_in_day - minutes_past_midnight
                 
-                if time_available_in_shift <= 0 : # Siamo fuori turno o a fine turno
-                    # Calcola il tempo fino all'inizio del prossimo turno
-                    time_to_next_shift_start = 0
-                    if minutes_past_midnight >= (shift_start_minute_in_day + shift_duration_today):
-                        # Il turno di oggi è finito, vai al giorno dopo
-                        time_to_next_shift_start = (workday_minutes - minutes_past_midnight) + shift_start_minute_in_day
-                    else: # Siamo prima dell'inizio del turno di oggi
-                        time_to_next_shift_start = shift_start_minute_in_day - minutes_past_midnight
-                    
-                    # Gestisci i weekend
-                    next_potential_start_dt = dt_now + timedelta(minutes=time_to_next_shift_start)
-                    while not (
-                        (next_potential_start_dt.weekday() != 5 and next_potential_start_dt.weekday() != 6) or # Non Sab o Dom
-                        (next_potential_start_dt.weekday() == fri38 and work_ven > 0) or # Venerdì lavorativo
-                        (next_potential_start_dt.weekday() < 5 and work_std > 0) # Altro feriale lavorativo
-                    ):
-                        # Siamo in un giorno non lavorativo, o un giorno con turno 0. Aggiungi 24 ore.
-                        time_to_next_shift_start += workday_minutes
-                        next_potential_start_dt += timedelta(days=1)
-
-                    if time_to_next_shift_start > 0:
-                        yield env.timeout(time_to_next_shift_start)
-                    continue # Ricalcola `time_available_in_shift` all'inizio del prossimo turno
-
-                # Quanto lavoro fare in questo blocco
-                work_chunk_duration = min(remaining_processing_time, time_available_in_shift)
-                
-                if work_chunk_duration <= 0: # Non dovrebbe succedere se la logica sopra è corretta
-                    # Forziamo un piccolo avanzamento per evitare loop infiniti se c'è un bug logico
-                    # o attendiamo fino al prossimo slot valido.
-                    # Questo indica un problema nella logica dei turni.
-                    # Per ora, se capita, si assume che il timeout precedente ci abbia portato a un momento valido.
-                    # Se ancora 0, potrebbe essere un turno di durata 0.
-                    # print(f"Warning: work_chunk_duration è {work_chunk_duration} a {dt_now} per fase {fase_nome}")
-                    # yield env.timeout(granularity) # Avanza di un po' per sbloccare
-                    # continue
-                    pass # Se work_chunk_duration è 0, il loop while dovrebbe terminare o la logica di pausa sopra dovrebbe scattare.
-
-
-                # Richiesta risorse SimPy
-                # Nota: la gestione di `persone_res` e `carrelli_res` come singole risorse globali
-                # implica che `pers_req` e `carrelli_req` devono essere 1 (o la capacità della risorsa).
-                # Se una fase richiede N persone, si usa `simpy.Container` o N richieste a una risorsa di capacità 1,
-                # oppure una singola risorsa con capacità N e si richiede N.
-                # L'originale usava `persone_res.request()` che prende 1 unità.
-                # Se `pers_req` > 1, questo deve cambiare. Assumiamo per ora che `pers_req` sia gestito
-                # dalla capacità totale di `persone_res` e che ogni richiesta sia per 1 "slot" di persona.
-                # Questo è un punto CRUCIALE: se `pers_req` è il numero di addetti,
-                # e `persone_res` ha capacità `max_personale`, allora si dovrebbe fare:
-                # with persone_res.request(amount=pers_req) as req_p: ...
-                # Ma l'originale faceva `persone_res.request()` e poi `len(persone_res.users)`.
-                # Questo suggerisce che `persone_res` è un pool, e si prende "un" addetto.
-                # Se `pers_req` è > 1, la logica originale non cattura l'uso di *multipli* addetti
-                # per *questa singola fase*.
-                # Per ora, manterrò la logica di richiesta singola, ma è un'area da chiarire.
-                # Stesso discorso per i carrelli.
-
-                # Per simulare l'uso di `pers_req` addetti e `carrelli_req` carrelli:
-                # Dovremmo avere N richieste separate o usare un Container/Level.
-                # Oppure, se `persone_res` è un pool, e `pers_req` è il numero di addetti
-                # necessari *da quel pool* per questa operazione:
-                
-                # Tentativo di acquisire tutte le risorse necessarie
-                # Questo è un punto complesso. Se `pers_req` è 2, servono 2 unità dalla risorsa `persone_res`.
-                # SimPy `Resource` di default ha `capacity=1` se non specificato.
-                # `max_personale` è la capacità totale.
-                # Quindi `persone_res` è `simpy.Resource(env, capacity=max_personale)`.
-                # La richiesta dovrebbe essere `persone_res.request(pers_req)`.
-
-                # Simuleremo l'acquisizione di tutte le risorse necessarie per la fase
-                # Questo è un possibile collo di bottiglia se le risorse sono molto contese.
-                
-                # Gestione risorse:
-                richiesta_macchina = risorse_macchina[macchina_richiesta].request()
-                # Se pers_req o carrelli_req è 0, non fare la richiesta per evitare errori.
-                richiesta_persone = persone_res.request(amount=pers_req) if pers_req > 0 else None
-                richiesta_carrelli = carrelli_res.request(amount=carrelli_req) if carrelli_req > 0 else None
-                
-                # Costruisci la lista delle richieste effettive da attendere
-                all_requests = [richiesta_macchina]
-                if richiesta_persone: all_requests.append(richiesta_persone)
-                if richiesta_carrelli: all_requests.append(richiesta_carrelli)
-
-                # Attendi tutte le risorse (AND condition)
-                # SimPy non ha un `yield env.all_of([req1, req2])` diretto per `Resource` nello stesso modo di `Process`.
-                # Si devono acquisire sequenzialmente o usare `Condition` events.
-                # L'originale usava `yield rm & rp & rc` che è per `Condition` events, non per `Resource.request()`.
-                # Per `Resource`, si fa `yield req`.
-                # Per acquisire multiple risorse in AND:
-                # 1. Richiedile tutte.
-                # 2. `yield req1` poi `yield req2` etc. (questo è sequenziale, non AND in termini di attesa)
-                # Oppure, usa un `Store` o `FilterStore` per modellare set di risorse.
-
-                # L'approccio più comune è fare richieste nidificate o usare `AllOf` se si convertono in eventi.
-                # Per semplicità e per seguire lo spirito dell'originale (anche se la sintassi era per Condition):
-                # Acquisiremo la macchina, poi le persone, poi i carrelli.
-                # Questo potrebbe non essere l'ideale se l'ordine di acquisizione conta o per deadlock.
-                
-                # Un modo più corretto per l'AND logico con risorse:
-                risorse_acquisite_correttamente = False
-                try:
-                    risultati_richieste = {}
-                    
-                    # Macchina
-                    risultati_richieste['macchina'] = yield richiesta_macchina
-                    
-                    # Persone (se necessarie)
-                    if richiesta_persone:
-                        risultati_richieste['persone'] = yield richiesta_persone
-                    
-                    # Carrelli (se necessari)
-                    if richiesta_carrelli:
-                        risultati_richieste['carrelli'] = yield richiesta_carrelli
-                    
-                    risorse_acquisite_correttamente = True
-
-                    # --- LAVORAZIONE ---
-                    actual_start_sim_time = env.now
-                    actual_start_dt = get_datetime_from_sim_time(actual_start_sim_time)
-                    
-                    # Log dell'inizio effettivo del chunk di lavoro
+                # Gestisci i weekend
+                next_potential_start_dt = dt_now + timedelta(minutes=time_to_next_shift_start)
+                while not (
+                    (next_potential_start_dt.weekday() != 5 and next_potential_start_dt.weekday() != 6) or # Non Sab o Dom
+                    (next_potential_start_dt.weekday() == fri38 and work_ven > 0) or # Venerdì lavorativo
+                    (next_potential_start_dt.weekday() < 5 and work_std > 0) # Altro feriale lavorativo
+                ):
+                    # Siamo in un giorno non lavorativo, o un giorno con turno 0. Aggiungi 24 ore.
+                    time_to_next_shift_start += workday_minutes
+                    next_potential_start_dt += timedelta(days=1)
+
+                if time_to_next_shift_start > 0:
+                    yield env.timeout(time_to_next_shift_start)
+                continue # Ricalcola `time_available_in_shift` all'inizio del prossimo turno
+
+            # Quanto lavoro fare in questo blocco
+            work_chunk_duration = min(remaining_processing_time, time_available_in_shift)
+            if flusso is not None:
+                work_chunk_duration = min(work_chunk_duration,
+                                          minuti_lavorabili() - (durata_flusso - remaining_processing_time))
+            
+            if work_chunk_duration <= 0: # Non dovrebbe succedere se la logica sopra è corretta
+                # Forziamo un piccolo avanzamento per evitare loop infiniti se c'è un bug logico
+                # o attendiamo fino al prossimo slot valido.
+                # Questo indica un problema nella logica dei turni.
+                # Per ora, se capita, si assume che il timeout precedente ci abbia portato a un momento valido.
+                # Se ancora 0, potrebbe essere un turno di durata 0.
+                # print(f"Warning: work_chunk_duration è {work_chunk_duration} a {dt_now} per fase {fase_nome}")
+                # yield env.timeout(granularity) # Avanza di un po' per sbloccare
+                # continue
+                pass # Se work_chunk_duration è 0, il loop while dovrebbe terminare o la logica di pausa sopra dovrebbe scattare.
+
+
+            # Richiesta risorse SimPy: macchina (Resource) + operatori e carrelli (Container).
+            # Una richiesta superiore alla capacità del pool bloccherebbe il lotto per sempre,
+            # quindi viene limitata alla capacità disponibile.
+            if pool_operatori is not None:
+                # Limite: operatori qualificati per questa fase-macchina
+                chiave_pool = chiave_competenza[(fase_nome, macchina_richiesta)]
+                qualificati = pool_operatori.idonei[chiave_pool].bit_count()
+                if pers_req > 0 and qualificati == 0:
+                    raise ValueError(f"Nessun operatore qualificato per la fase {fase_nome} su {macchina_richiesta}")
+                pers_req_eff = min(pers_req, qualificati)
+            else:
+                pers_req_eff = min(pers_req, max_personale)
+            carrelli_req_eff = min(carrelli_req, max_carrelli)
+
+            if richiesta_trattenuta is not None: # Macchina già presa durante le attese
+                richiesta_macchina, richiesta_trattenuta = richiesta_trattenuta, None
+            else:
+                richiesta_macchina = risorse_macchina[macchina_richiesta].request(codice_formato_lotto)
+                yield richiesta_macchina
+            if fine_batch is not None:
+                risorse_batch[fase_nome].chiudi(chiave_batch, membri_batch)
+            libera_buffer_predecessori()
+            operatori_assegnati = 0
+            if pers_req_eff > 0:
+                if pool_operatori is not None:
+                    operatori_assegnati = yield pool_operatori.richiedi(chiave_pool, pers_req_eff)
+                else:
+                    yield persone_res.get(pers_req_eff)
+                variazioni_persone.append((env.now, pers_req_eff))
+            if carrelli_req_eff > 0 and not carrelli_lotto:
+                yield carrelli_res.get(carrelli_req_eff)
+                variazioni_carrelli.append((env.now, carrelli_req_eff))
+                carrelli_lotto.extend(flotta.preleva(carrelli_req_eff))
+            operatori_rilasciati = False
+
+            def rilascia_operatori_carrelli():
+                # Con il ciclo dei carrelli il lotto li tiene fino alla fine della fase
+                if carrelli_lotto and (not ciclo_carrelli or remaining_processing_time <= 0):
+                    rilascia_carrelli(carrelli_lotto[:])
+                    carrelli_lotto.clear()
+                if pers_req_eff > 0:
+                    if pool_operatori is not None:
+                        pool_operatori.rilascia(operatori_assegnati)
+                    else:
+                        persone_res.put(pers_req_eff)
+                    variazioni_persone.append((env.now, -pers_req_eff))
+
+            try:
+                # Le code per le risorse possono aver portato il lotto oltre il turno del chunk:
+                # il chunk si ferma a fine turno e, fuori turno, si riprova al turno successivo
+                if env.now > sim_time_now:
+                    minuti_rimasti = minuti_turno_rimasti(env.now)
+                    if minuti_rimasti <= 0:
+                        continue
+                    work_chunk_duration = min(work_chunk_duration, minuti_rimasti)
+                minuti_cambio = risorse_macchina[macchina_richiesta].cambio_verso(codice_formato_lotto)
+                if in_volo: # La macchina è già attrezzata per il lotto in corso
+                    minuti_cambio = 0
+
+                # --- CAMBIO FORMATO --- (macchina e operatori impegnati, nessuna energia di fase)
+                if minuti_cambio > 0:
                     risultati_eventi.append({
                         'ID_Lotto': lotto_id,
                         'Formato': formato_lotto,
-                        'Quantita': quantita_lotto,
+                        'Fase': fase_nome,
+                        'Macchina': macchina_richiesta,
+                        'Evento': 'CAMBIO_FORMATO',
+                        'SimTime': env.now,
+                        'Timestamp': get_datetime_from_sim_time(env.now),
+                        'DurataCambio': minuti_cambio,
+                        'PersoneRichieste': pers_req_eff
+                    })
+                    yield env.timeout(minuti_cambio)
+
+                # --- LAVORAZIONE ---
+                # Il chunk si ferma al prossimo calo dell'organico: gli operatori rientrano nel pool
+                # (saldando il debito) e la fase riparte con chi resta in turno
+                if istanti_riduzione is not None and pers_req_eff > 0 and pool_operatori is None:
+                    k_riduzione = np.searchsorted(istanti_riduzione, env.now, side='right')
+                    if k_riduzione < len(istanti_riduzione):
+                        work_chunk_duration = min(work_chunk_duration, istanti_riduzione[k_riduzione] - env.now)
+                actual_start_sim_time = env.now
+                actual_start_dt = get_datetime_from_sim_time(actual_start_sim_time)
+
+                # Log dell'inizio effettivo del chunk di lavoro (per ogni lotto del batch)
+                for membro in membri_batch:
+                    risultati_eventi.append({
+                        'ID_Lotto': membro['ID_Lotto'],
+                        'Formato': membro['Formato'],
+                        'Quantita': membro['Quantita'],
                         'Fase': fase_nome,
                         'Macchina': macchina_richiesta,
                         'Evento': 'INIZIO_CHUNK',
                         'SimTime': actual_start_sim_time,
                         'Timestamp': actual_start_dt,
                         'DurataChunkPianificata': work_chunk_duration,
-                        'PersoneRichieste': pers_req,
-                        'CarrelliRichiesti': carrelli_req
-                    })
-                    
-                    # Log utilizzo risorse al momento dell'inizio del chunk
-                    # `persone_res.count` è il numero di unità attualmente in uso.
-                    # `persone_res.capacity` è la capacità totale.
-                    # `len(persone_res.users)` è la lista di chi sta usando la risorsa (oggetti Request).
-                    # `len(persone_res.queue)` è la lista di chi è in attesa.
-                    log_utilizzo_persone.append({
-                        'SimTime': actual_start_sim_time, 'Timestamp': actual_start_dt,
-                        'PersoneInUso': persone_res.count + pers_req if richiesta_persone else persone_res.count, # Stima dopo questa acquisizione
-                        'PersoneInCoda': len(persone_res.put_queue) # Coda per richieste di put (acquisizione)
-                    })
-                    log_utilizzo_carrelli.append({
-                        'SimTime': actual_start_sim_time, 'Timestamp': actual_start_dt,
-                        'CarrelliInUso': carrelli_res.count + carrelli_req if richiesta_carrelli else carrelli_res.count,
-                        'CarrelliInCoda': len(carrelli_res.put_queue)
-                    })
-                    # Energia: si assume che l'energia sia consumata durante il processo.
-                    # Se `energia_val` è un tasso (es. kWh/minuto), moltiplicare per `work_chunk_duration`.
-                    # Se è un valore fisso per la fase, registrarlo una volta per fase.
-                    # Assumiamo sia un tasso orario o per minuto. Se `EnergiaFase` è totale per la fase,
-                    # andrebbe divisa per la durata della fase per ottenere un tasso.
-                    # L'originale la loggava per chunk, quindi presumo sia un consumo durante il chunk.
-                    # Se `energia_val` è l'energia per l'intera fase, questo la somma più volte.
-                    # Se `energia_val` è un *tasso* (es. energia/minuto), allora:
-                    energia_consumata_nel_chunk = energia_val * work_chunk_duration
-                    log_consumo_energia.append({
-                        'SimTime': actual_start_sim_time, 'Timestamp': actual_start_dt,
-                        'ID_Lotto': lotto_id, 'Fase': fase_nome,
-                        'EnergiaConsumata': energia_consumata_nel_chunk
+                        'PersoneRichieste': pers_req_eff,
+                        'CarrelliRichiesti': carrelli_req_eff,
+                        **({'ID_Batch': lotto_id, 'LottiBatch': len(membri_batch)} if fine_batch is not None else {})
                     })
 
+                # Energia: `EnergiaFase` è trattata come tasso per minuto di lavorazione.
+                energia_consumata_nel_chunk = energia_val * work_chunk_duration
+                log_consumo_energia.append({
+                    'SimTime': actual_start_sim_time, 'Timestamp': actual_start_dt,
+                    'ID_Lotto': lotto_id, 'Fase': fase_nome,
+                    'EnergiaConsumata': energia_consumata_nel_chunk
+                })
+
+                if flusso is None:
                     yield env.timeout(work_chunk_duration) # Lavora per la durata del chunk
-                    
-                    actual_end_sim_time = env.now
-                    actual_end_dt = get_datetime_from_sim_time(actual_end_sim_time)
+                else:
+                    yield from lavora_segnalando(work_chunk_duration)
+
+                actual_end_sim_time = env.now
+                actual_end_dt = get_datetime_from_sim_time(actual_end_sim_time)
 
+                for membro in membri_batch:
                     risultati_eventi.append({
-                        'ID_Lotto': lotto_id,
-                        'Formato': formato_lotto,
-                        'Quantita': quantita_lotto,
+                        'ID_Lotto': membro['ID_Lotto'],
+                        'Formato': membro['Formato'],
+                        'Quantita': membro['Quantita'],
                         'Fase': fase_nome,
                         'Macchina': macchina_richiesta,
                         'Evento': 'FINE_CHUNK',
@@ -632,50 +1904,161 @@ def esegui_simulazione_ottimizzata(
                         'Timestamp': actual_end_dt,
                         'DurataChunkEffettiva': actual_end_sim_time - actual_start_sim_time
                     })
-                    
-                    remaining_processing_time -= work_chunk_duration
-
-                finally: # Blocco finally per assicurare il rilascio delle risorse
-                    if risorse_acquisite_correttamente:
-                        # Rilascia le risorse nell'ordine inverso di acquisizione (buona pratica)
-                        if richiesta_carrelli: carrelli_res.release(risultati_richieste['carrelli'])
-                        if richiesta_persone: persone_res.release(risultati_richieste['persone'])
-                        risorse_macchina[macchina_richiesta].release(risultati_richieste['macchina'])
-                    else: # Se non tutte acquisite, rilascia quelle che potremmo aver ottenuto
-                          # Questo è più complesso, SimPy gestisce eccezioni durante yield
-                          # Se una richiesta fallisce o viene interrotta, non si dovrebbe arrivare qui
-                          # con risorse parzialmente acquisite in questo modo.
-                          # Se `yield` lancia un'eccezione (es. `Interrupt`), la risorsa non è acquisita.
-                          # È più per la pulizia se il processo stesso viene interrotto.
-                          # Per ora, assumiamo che se non `risorse_acquisite_correttamente`,
-                          # nessuna risorsa di questo set è stata trattenuta a lungo termine.
-                          # Tuttavia, se una `yield` precedente avesse successo e una successiva fallisse
-                          # prima del `try...finally`, quelle risorse andrebbero rilasciate.
-                          # La struttura `with resource.request() as req:` è più sicura per questo.
-                          # Ma per multiple risorse in AND, è più complesso.
-                          # Per ora, questo `finally` si basa su `risorse_acquisite_correttamente`.
-                          pass
-
-
-            # Fine del while remaining_processing_time > 0 (la fase è completata)
-            
-            # Ritardo fisiologico di FINE_FASE
-            ritardo_fisiologico_fine = fisio_map.get((formato_lotto, fase_nome, 'FINE_FASE'), 0)
-            if ritardo_fisiologico_fine > 0:
-                yield env.timeout(ritardo_fisiologico_fine)
-            
-            # Log completamento fase
-            risultati_eventi.append({
-                'ID_Lotto': lotto_id,
-                'Formato': formato_lotto,
-                'Fase': fase_nome,
-                'Macchina': macchina_richiesta,
-                'Evento': 'FINE_FASE',
-                'SimTime': env.now,
-                'Timestamp': get_datetime_from_sim_time(env.now)
-            })
+
+                remaining_processing_time -= work_chunk_duration
+
+                # Blocco dopo il servizio: a fine fase il lotto libera operatori e carrelli ma
+                # tiene la macchina finché non trova posto nel buffer a valle
+                if remaining_processing_time <= 0 and buffer_uscita is not None:
+                    rilascia_operatori_carrelli()
+                    operatori_rilasciati = True
+                    yield from entra_in_buffer()
+                    in_buffer = True
+
+            finally: # Rilascio risorse nell'ordine inverso di acquisizione
+                if not operatori_rilasciati:
+                    rilascia_operatori_carrelli()
+                if flusso is not None and remaining_processing_time > 0:
+                    # Lotto di trasferimento: la macchina resta al lotto fino a fine fase
+                    richiesta_trattenuta = richiesta_macchina
+                else:
+                    risorse_macchina[macchina_richiesta].release(richiesta_macchina)
+
+
+        # Fine del while remaining_processing_time > 0 (la fase è completata)
+        if prenotazione is not None:
+            indice_macchine.libera(prenotazione, env.now)
+        if fine_batch is not None:
+            fine_batch.succeed()
+        # Fasi senza lavorazione (es. RAFFREDDAMENTO) passano dai buffer senza macchina
+        libera_buffer_predecessori()
+        if buffer_uscita is not None and not in_buffer:
+            yield from entra_in_buffer()
+        
+        # Ritardo fisiologico di FINE_FASE
+        ritardo_fisiologico_fine = fisio_map.get((formato_lotto, fase_nome, 'FINE_FASE'), 0)
+        if ritardo_fisiologico_fine > 0:
+            yield env.timeout(ritardo_fisiologico_fine)
+        
+        # Log completamento fase
+        risultati_eventi.append({
+            'ID_Lotto': lotto_id,
+            'Formato': formato_lotto,
+            'Fase': fase_nome,
+            'Macchina': macchina_richiesta,
+            'Evento': 'FINE_FASE',
+            'SimTime': env.now,
+            'Timestamp': get_datetime_from_sim_time(env.now)
+        })
+
+    def processo_fase_dopo(env, lotto_record, fase_corrente_info, attese, *args):
+        if attese:
+            yield simpy.AllOf(env, attese)
+        yield from processo_fase(env, lotto_record, fase_corrente_info, *args)
+
+    def lavora_a_pezzi(fase_corrente_info):
+        """Fase che può lavorare un lotto di trasferimento a pezzi (non a batch, area o tempo fisso)."""
+        pezzi = fase_corrente_info['Pezzi']
+        return (pd.notna(pezzi) and pezzi > 0 and fase_corrente_info['Fase'] not in risorse_batch
+                and fase_corrente_info['Fase'] not in aree_res)
+
+    def soglie_uscita(fase_corrente_info, quantita):
+        """Pezzi cumulati passati ai successori a ogni porzione completata dalla fase."""
+        dimensione = trasferimenti.get(fase_corrente_info['Fase']) if lavora_a_pezzi(fase_corrente_info) else None
+        return np.cumsum(porzioni_trasferimento(quantita, dimensione)).tolist()
+
+    def processo_fase_in_flusso(env, lotto_record, fasi, predecessori, avanzamenti, k):
+        """
+        Fase k di un lotto con lotti di trasferimento. Se lavora a pezzi parte alla prima
+        porzione di ogni predecessore e lavora il lotto intero sulla stessa macchina al ritmo
+        dei pezzi in arrivo (vedi `flusso` in `processo_fase`); altrimenti attende tutto il
+        lotto. A fine fase i pezzi restanti passano ai successori.
+        """
+        quantita = lotto_record['Quantita']
+        ingressi = [avanzamenti[j] for j in predecessori]
+        if lavora_a_pezzi(fasi[k]):
+            attese = [avanzamenti[j].attendi(soglie_uscita(fasi[j], quantita)[0]) for j in predecessori]
+            flusso = (avanzamenti[k], soglie_uscita(fasi[k], quantita), ingressi)
+        else:
+            attese = [a.attendi(quantita) for a in ingressi]
+            flusso = None
+        if attese:
+            yield simpy.AllOf(env, attese)
+        yield from processo_fase(env, lotto_record, fasi[k], flusso=flusso)
+        avanzamenti[k].aggiungi(quantita - avanzamenti[k].pezzi)
+
+    def processo_lotto(env, lotto_record):
+        lotto_id = lotto_record['ID_Lotto']
+        formato_lotto = lotto_record['Formato']
+        giorno_schedulato_lotto = lotto_record['Giorno'] # pd.Timestamp
+
+        # Calcola tempo di attesa iniziale se il lotto è schedulato per un giorno futuro
+        # rispetto all'inizio della simulazione o al tempo corrente di altri processi.
+        # SimPy gestisce questo implicitamente se i processi sono aggiunti con ritardi.
+        # Qui, potremmo voler un timeout esplicito per far partire il lotto non prima del suo 'Giorno'.
+        
+        # `DifferenzaTempo` nell'originale: `int(rec.get('DifferenzaTempo',0))*workday`
+        # Questo sembra un offset in giorni interi. Se `DifferenzaTempo` è una colonna in `lotti_filtrati`:
+        offset_giorni_lotto = int(lotto_record.get('DifferenzaTempo', 0))
+        in_volo = str(lotto_id) in lotti_in_volo # Avvio a caldo: lotto già in produzione
+        if offset_giorni_lotto > 0 and not in_volo:
+            yield env.timeout(offset_giorni_lotto * workday_minutes) # Timeout in minuti
+
+        # In alternativa, o in aggiunta, assicurati che il lotto non inizi prima del suo giorno schedulato
+        sim_time_schedulato_lotto = get_sim_time_from_datetime(giorno_schedulato_lotto.replace(hour=6, minute=0)) # Inizia alle 6:00 del giorno schedulato
         
+        if env.now < sim_time_schedulato_lotto:
+            yield env.timeout(sim_time_schedulato_lotto - env.now)
+
+
+        # Pianificazione all'indietro: il lotto entra in produzione al suo rilascio (primo ultimo
+        # inizio meno l'anticipo per le code); da lì le fasi partono appena possibile
+        if lotto_record.get('Rilascio') is not None and env.now < lotto_record['Rilascio'] and not in_volo:
+            yield env.timeout(lotto_record['Rilascio'] - env.now)
+
+        # Rilascio in produzione entro il limite di WIP
+        if wip_res is not None:
+            yield wip_res.get(1)
+        variazioni_wip.append((env.now, 1))
+
+        instradamento = instradamenti.get(lotto_record.get('Prodotto'), instradamento_base)
+        buffer_lotto = {} if buffer_res or aree_res else None
+        fasi = instradamento.fasi
+        aree_valle = instradamento.aree_a_valle(aree_res)
+        nomi_predecessori = [[fasi[j]['Fase'] for j in preds] for preds in instradamento.predecessori]
+        if not in_volo and trasferimenti and any(len(soglie_uscita(f, lotto_record['Quantita'])) > 1 for f in fasi):
+            # Lotti di trasferimento: tutte le fasi sono processi concorrenti, sincronizzati sui
+            # pezzi passati dai predecessori invece che sulla loro fine. I buffer finiti
+            # riguardano lotti interi e non si applicano.
+            avanzamenti = [AvanzamentoFase(env) for _ in fasi]
+            yield simpy.AllOf(env, [
+                env.process(processo_fase_in_flusso(env, lotto_record, fasi, instradamento.predecessori[k],
+                                                    avanzamenti, k))
+                for k in range(len(fasi))
+            ])
+        elif instradamento.lineare:
+            for k, fase_corrente_info in enumerate(fasi): # Itera sulle fasi in ordine
+                yield from processo_fase(env, lotto_record, fase_corrente_info, nomi_predecessori[k],
+                                         instradamento.ha_successori[k], buffer_lotto,
+                                         area_valle=aree_valle[k])
+        else:
+            # Rami indipendenti come sotto-processi concorrenti: ogni fase parte quando
+            # tutti i predecessori sono terminati (AllOf) e il lotto attende tutte le fasi.
+            processi = []
+            for k, (fase_corrente_info, predecessori) in enumerate(zip(fasi, instradamento.predecessori)):
+                processi.append(env.process(processo_fase_dopo(
+                    env, lotto_record, fase_corrente_info, [processi[j] for j in predecessori],
+                    nomi_predecessori[k], instradamento.ha_successori[k], buffer_lotto,
+                    None, aree_valle[k]
+                )))
+            yield simpy.AllOf(env, processi)
+
+        if wip_res is not None:
+            wip_res.put(1)
+        variazioni_wip.append((env.now, -1))
+
         # Tutte le fasi del lotto completate
+        lotti_completati[0] += 1
         risultati_eventi.append({
             'ID_Lotto': lotto_id,
             'Formato': formato_lotto,
@@ -684,20 +2067,108 @@ def esegui_simulazione_ottimizzata(
             'Timestamp': get_datetime_from_sim_time(env.now)
         })
 
+    # 12.1) Passo all'indietro dalle scadenze (vedi `ultimi_inizi`): per ciclo di lavoro,
+    # vettoriale su tutti i lotti che lo condividono, sul calendario dei turni di ogni fase
+    def durate_pianificate(lotti, fasi):
+        """Durate senza variabilità [n_lotti, n_fasi] (lavorazione, posticipi e ritardi fisiologici)."""
+        quantita = lotti['Quantita'].to_numpy(dtype=float)
+        coppie = list(zip(lotti['ID_Lotto'].astype(str), lotti['Formato']))
+        durate = np.zeros((len(lotti), len(fasi)))
+        for k, fase_rec in enumerate(fasi):
+            nome, pezzi, tempo = fase_rec['Fase'], fase_rec['Pezzi'], fase_rec[tempo_col_name]
+            margine = 1 + margin_pct
+            if nome in aree: # Sosta in area: tempo fisso della riga, senza margine
+                base, margine = np.full(len(lotti), float(tempo) if pd.notna(tempo) else 0.0), 1.0
+            elif nome == 'RAFFREDDAMENTO' or ((pd.isna(pezzi) or pezzi == 0) and nome != 'AUTOCLAVI'):
+                base = np.zeros(len(lotti))
+            elif nome == 'AUTOCLAVI':
+                base = np.full(len(lotti), float(tempo))
+            else:
+                base = quantita / float(pezzi) * float(tempo)
+            ritardi = [post_map_specific.get((id_l, nome), 0) + post_map_global.get((None, nome), 0)
+                       + fisio_map.get((formato, nome, 'INIZIO_FASE'), 0) + fisio_map.get((formato, nome, 'FINE_FASE'), 0)
+                       for id_l, formato in coppie]
+            durate[:, k] = np.round(base * margine) + np.asarray(ritardi, dtype=float)
+        return durate
+
+    rilasci_lotti = {}
+    df_ultimi_inizi = None
+    if 'Scadenza' in lotti_filtrati.columns and lotti_filtrati['Scadenza'].notna().any():
+        con_scadenza = lotti_filtrati[lotti_filtrati['Scadenza'].notna()]
+        primo_giorno = min(con_scadenza['Giorno'].min(), start_sim_dt) - timedelta(days=config.get('giorni_anticipo_max', 60))
+        n_giorni = (con_scadenza['Scadenza'].max() - con_scadenza['Giorno'].min()).days + config.get('giorni_anticipo_max', 60) + 2
+        # Calendario base e, per le fasi in Turni_modificati, quello con l'estensione
+        calendari = {estesa: calendario_turni(config, primo_giorno, n_giorni, start_sim_dt, estesa) for estesa in (False, True)}
+        prodotti = con_scadenza['Prodotto'] if 'Prodotto' in con_scadenza.columns else pd.Series(None, index=con_scadenza.index)
+        righe_ultimi = []
+        id_cicli, cicli, scadenze_cicli, disponibili = [], [], [], []
+        for prodotto, gruppo in con_scadenza.groupby(prodotti.map(lambda p: p if p in instradamenti else None), dropna=False):
+            instr = instradamenti.get(prodotto, instradamento_base)
+            scadenza_sim = ((gruppo['Scadenza'] - start_sim_dt) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+            calendari_fasi = [None if f['Fase'] in aree else calendari[f['Fase'] in config.get('Turni_modificati', [])]
+                              for f in instr.fasi]
+            durate = durate_pianificate(gruppo, instr.fasi)
+            inizi_sim = ultimi_inizi(instr, durate, scadenza_sim, calendari_fasi)
+            # Macchine prenotate dal passo a capacità finita (non le soste e le fasi a batch)
+            macchine_fasi = [[] if f['Fase'] in aree or f['Fase'] in risorse_batch or f['Fase'] == 'RAFFREDDAMENTO'
+                             else [a['Macchina'] for a in f.get('Alternative', [f])] for f in instr.fasi]
+            id_cicli += list(gruppo['ID_Lotto'])
+            cicli += [(instr, riga, calendari_fasi, macchine_fasi) for riga in durate]
+            scadenze_cicli += list(scadenza_sim)
+            nomi_fasi = [f['Fase'] for f in instr.fasi]
+            disponibili += list(gruppo['Giorno'])
+            for id_l, scad, riga in zip(gruppo['ID_Lotto'], gruppo['Scadenza'], inizi_sim):
+                righe_ultimi += [{'ID_Lotto': id_l, 'Fase': nome, 'Scadenza': scad,
+                                  'InizioUltimo': get_datetime_from_sim_time(t)}
+                                 for nome, t in zip(nomi_fasi, riga)]
+        df_ultimi_inizi = pd.DataFrame(righe_ultimi).drop_duplicates(['ID_Lotto', 'Fase'])
+        if pianificazione == 'indietro':
+            # Rilascio del lotto: inizio della prima fase nel passo all'indietro a capacità finita
+            # sulle macchine, anticipato di `anticipo_rilascio` minuti lavorativi (code di
+            # operatori e carrelli, che il passo non vede)
+            # A pari scadenza prenota per primo (più vicino alla scadenza) il lotto disponibile più
+            # tardi ('Giorno', poi ID): l'ordine di rilascio segue quello della pianificazione in avanti
+            ordine = sorted(range(len(cicli)), key=lambda i: (disponibili[i], str(id_cicli[i])), reverse=True)
+            capacita = {m: machine_caps.get(m, 1) for m in macchine}
+            rilasci = np.empty(len(cicli))
+            rilasci[ordine] = rilasci_a_capacita([cicli[i] for i in ordine], [scadenze_cicli[i] for i in ordine], capacita)
+            rilasci = calendari[False].da_lavorativi(
+                calendari[False].lavorativi(rilasci) - config.get('anticipo_rilascio', work_std), inizio=True)
+            rilasci_lotti = {id_l: max(0.0, float(t)) for id_l, t in zip(id_cicli, rilasci)}
+
     # 13) Avvio dei processi per ciascun lotto
     # Ordina i lotti per 'Giorno' e poi per un criterio di priorità se esiste (es. ID_Lotto)
     # Questo può influenzare l'ordine di accesso alle risorse se più lotti iniziano lo stesso giorno.
     lotti_ordinati = lotti_filtrati.sort_values(by=['Giorno', 'ID_Lotto']) # Aggiunto ID_Lotto per stabilità
+    if lotti_in_volo: # Avvio a caldo: i lotti in volo chiedono per primi le risorse che tengono
+        in_volo = lotti_ordinati['ID_Lotto'].astype(str).isin(lotti_in_volo)
+        lotti_ordinati = pd.concat([lotti_ordinati[in_volo], lotti_ordinati[~in_volo]])
+    lotti_totali = len(lotti_ordinati)
+    lotti_completati = [0] # Lista per poterlo aggiornare dai processi SimPy
 
-    for _, lotto_data in lotti_ordinati.iterrows():
-        env.process(processo_lotto(env, lotto_data.to_dict())) # Passa il record del lotto come dizionario
+    for lotto_data in lotti_ordinati.to_dict('records'):
+        if pianificazione == 'indietro' and lotto_data['ID_Lotto'] in rilasci_lotti:
+            lotto_data['Rilascio'] = rilasci_lotti[lotto_data['ID_Lotto']]
+        env.process(processo_lotto(env, lotto_data)) # Passa il record del lotto come dizionario
 
     # Esegui la simulazione fino a un certo punto o finché non ci sono più eventi
     # È buona pratica definire un `until` per evitare simulazioni infinite se c'è un bug.
     # Potrebbe essere `get_sim_time_from_datetime(fine_sim_dt)`.
     # Se non specificato, SimPy esegue finché ci sono eventi schedulati.
     simulation_until_time = get_sim_time_from_datetime(fine_sim_dt)
-    env.run(until=simulation_until_time)
+    if progress_cb is None and should_stop is None:
+        env.run(until=simulation_until_time)
+    else:
+        # Avanzamento a passi per poter notificare lo stato e accettare l'annullamento
+        passo = config.get('passo_avanzamento', workday_minutes)
+        while env.peek() < simulation_until_time:
+            if should_stop is not None and should_stop():
+                raise SimulazioneAnnullata(f"Simulazione annullata a t={env.now}")
+            env.run(until=min(env.now + passo, simulation_until_time))
+            if progress_cb is not None:
+                df_parziale = pd.DataFrame(risultati_eventi)
+                progress_cb(lotti_completati[0] / lotti_totali,
+                            _sintesi_fasi(df_parziale) if not df_parziale.empty else df_parziale)
 
 
     # 14) Output: Conversione dei log in DataFrame
@@ -707,8 +2178,6 @@ def esegui_simulazione_ottimizzata(
     # Questi DataFrame avranno granularità dell'evento/chunk.
     # Per avere una timeline aggregata (come nell'originale), bisogna fare un groupby e resample.
 
-    df_log_persone = pd.DataFrame(log_utilizzo_persone)
-    df_log_carrelli = pd.DataFrame(log_utilizzo_carrelli)
     df_log_energia = pd.DataFrame(log_consumo_energia)
 
     # Per ricreare i DataFrame di output come nell'originale (timeline aggregata):
@@ -750,28 +2219,30 @@ def esegui_simulazione_ottimizzata(
 
 
         df_timeline = pd.DataFrame({'timestamp': timeline_stamps})
-
-        # Persone
-        if not df_log_persone.empty:
-            df_log_persone_sorted = df_log_persone.sort_values(by='Timestamp')
-            df_persone_agg = pd.merge_asof(df_timeline, df_log_persone_sorted[['Timestamp', 'PersoneInUso']], 
-                                           on='Timestamp', direction='backward')
-            df_persone_agg = df_persone_agg.rename(columns={'Timestamp':'timestamp', 'PersoneInUso':'Persone_occupate'})
-            df_persone_agg['Persone_occupate'] = df_persone_agg['Persone_occupate'].fillna(0) # O ffill() e poi 0 all'inizio
-        else:
-            df_persone_agg = df_timeline.copy()
-            df_persone_agg['Persone_occupate'] = 0
-        
-        # Carrelli
-        if not df_log_carrelli.empty:
-            df_log_carrelli_sorted = df_log_carrelli.sort_values(by='Timestamp')
-            df_carrelli_agg = pd.merge_asof(df_timeline, df_log_carrelli_sorted[['Timestamp', 'CarrelliInUso']],
-                                            on='Timestamp', direction='backward')
-            df_carrelli_agg = df_carrelli_agg.rename(columns={'Timestamp':'timestamp', 'CarrelliInUso':'Carrelli_occupati'})
-            df_carrelli_agg['Carrelli_occupati'] = df_carrelli_agg['Carrelli_occupati'].fillna(0)
-        else:
-            df_carrelli_agg = df_timeline.copy()
-            df_carrelli_agg['Carrelli_occupati'] = 0
+        # Istanti della timeline in minuti di simulazione, per `_livelli_su_timeline`
+        istanti_sim = ((timeline_stamps - start_sim_dt) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+
+        # Persone e carrelli: livello in uso a ogni istante dalle variazioni registrate
+        df_persone_agg = df_timeline.assign(Persone_occupate=_livelli_su_timeline(variazioni_persone, istanti_sim))
+        for g, nome_gruppo in enumerate(nomi_gruppi):
+            df_persone_agg[f"Occupati_{nome_gruppo}"] = _livelli_su_timeline(
+                pool_operatori.variazioni_gruppi[g], istanti_sim)
+        df_carrelli_agg = df_timeline.assign(Carrelli_occupati=_livelli_su_timeline(variazioni_carrelli, istanti_sim))
+        if ciclo_carrelli: # Pool dei carrelli fuori servizio: in rientro e al lavaggio
+            df_carrelli_agg['Carrelli_rientro'] = _livelli_su_timeline(variazioni_rientro, istanti_sim)
+            df_carrelli_agg['Carrelli_lavaggio'] = _livelli_su_timeline(variazioni_lavaggio, istanti_sim)
+        for colonna, df_agg in (('Operatori', df_persone_agg), ('Carrelli', df_carrelli_agg)):
+            if colonna in organico:
+                istanti_cambio, livelli = organico[colonna]
+                df_agg['Organico'] = _livelli_su_timeline(
+                    list(zip(istanti_cambio, np.diff(livelli, prepend=0.0))), istanti_sim)
+
+        # WIP (lotti rilasciati e non completati) e occupazione dei buffer
+        df_buffer_agg = df_timeline.assign(WIP=_livelli_su_timeline(variazioni_wip, istanti_sim))
+        for fase, variazioni in variazioni_buffer.items():
+            df_buffer_agg[f"Buffer_{fase}"] = _livelli_su_timeline(variazioni, istanti_sim)
+        for fase, variazioni in variazioni_aree.items():
+            df_buffer_agg[f"Area_{fase}"] = _livelli_su_timeline(variazioni, istanti_sim)
 
         # Energia
         if not df_log_energia.empty:
@@ -792,6 +2263,7 @@ def esegui_simulazione_ottimizzata(
         df_persone_agg = pd.DataFrame(columns=['timestamp', 'Persone_occupate'])
         df_energia_agg = pd.DataFrame(columns=['timestamp', 'Energia'])
         df_carrelli_agg = pd.DataFrame(columns=['timestamp', 'Carrelli_occupati'])
+        df_buffer_agg = pd.DataFrame(columns=['timestamp', 'WIP'])
 
 
     # L'output originale era `pd.DataFrame(risultati)` che conteneva solo start/end per fase.
@@ -801,17 +2273,15 @@ def esegui_simulazione_ottimizzata(
     # Potrebbe essere necessario un pivot o un groupby per ottenere Start e End per fase su una riga.
     # Per ora, restituisco il log eventi dettagliato e i DataFrame aggregati delle risorse.
     # Per un output più simile all'originale `risultati`:
-    df_output_sintetico = df_risultati_eventi[
-        df_risultati_eventi['Evento'].isin(['INIZIO_CHUNK', 'FINE_CHUNK'])
-    ].groupby(['ID_Lotto', 'Fase']).agg(
-        Start=('SimTime', 'min'),
-        End=('SimTime', 'max'),
-        TimestampStart=('Timestamp', 'min'),
-        TimestampEnd=('Timestamp', 'max')
-    ).reset_index()
+    df_output_sintetico = _sintesi_fasi(df_risultati_eventi)
+    if df_ultimi_inizi is not None and not df_output_sintetico.empty:
+        df_output_sintetico = df_output_sintetico.merge(df_ultimi_inizi, on=['ID_Lotto', 'Fase'], how='left')
     # Converti SimTime Start/End in Timestamp se necessario, o usa TimestampStart/End
 
 
-    return df_output_sintetico, df_persone_agg, df_energia_agg, df_carrelli_agg
-    # O, per un log più dettagliato:
-    # return df_risultati_eventi, df_persone_agg, df_energia_agg, df_carrelli_agg
+    risultato = (df_output_sintetico, df_persone_agg, df_energia_agg, df_carrelli_agg)
+    if con_eventi:
+        risultato += (df_risultati_eventi,)
+    if con_buffer:
+        risultato += (df_buffer_agg,)
+    return risultato
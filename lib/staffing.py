@@ -0,0 +1,250 @@
+"""
+lib/staffing.py
+Ottimizzazione dell'organico: cerca durate dei turni (work_std, work_ven), estensione
+(extension, Turni_modificati) e operatori per turno che minimizzano le ore-operatore
+rispettando makespan e scadenze della configurazione di riferimento.
+
+Ogni candidato diventa un roster del calendario turni (lib/simulator.py, `cambi_organico`):
+la giornata lavorativa (dalle 06:00, lunga come nel simulatore) è divisa in `n_turni` turni
+uguali, ciascuno con il proprio organico; l'estensione allunga l'ultimo turno. I candidati
+di un passo di ricerca sono valutati in parallelo (lib/parallel.py) come roster alternativi
+della stessa tabella, e ogni candidato è simulato una sola volta (cache dei KPI).
+
+Ricerca: bisezione (a k sezioni, una per processo) sull'organico uniforme minimo fattibile,
+poi ricerca locale sui vicini del candidato migliore (un operatore in meno in un turno,
+turni più corti, estensione diversa, una fase estesa in più o in meno) finché le ore non
+scendono più.
+"""
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+
+from lib.parallel import valuta_configurazioni, MAX_PROCESSI
+from lib.rccp import minuti_turno_giornalieri
+from lib.simulator import SimulazioneAnnullata
+
+INIZIO_TURNO_ORE = 6  # Il simulatore apre la giornata alle 06:00
+COLONNE_ROSTER = ['Giorno_Settimana', 'Ora_Inizio', 'Ora_Fine', 'Operatori']
+COLONNE_STORIA = ['Passo', 'Mossa', 'work_std', 'work_ven', 'extension', 'Turni_modificati',
+                  'Organico', 'ore_personale', 'makespan_min', 'ritardo_totale_min', 'Fattibile', 'Scelto']
+
+
+@dataclass(frozen=True)
+class CandidatoTurni:
+    """Durate dei turni e organico per turno (tupla, dal primo turno della giornata)."""
+    work_std: int
+    work_ven: int
+    extension: int
+    turni_modificati: tuple
+    organico: tuple
+
+    def config(self, config_base, codice):
+        """Config del simulatore che usa questo candidato come roster `codice`."""
+        return {**config_base, 'work_std': self.work_std, 'work_ven': self.work_ven,
+                'extension': self.extension, 'Turni_modificati': list(self.turni_modificati),
+                'max_personale': max(self.organico), 'roster': codice}
+
+
+def roster_candidato(candidato, config_base):
+    """
+    Righe del calendario turni (COLONNE_ROSTER, ricorrenti per giorno della settimana) di un
+    candidato. Le ore sono numeriche e modulo 24: un turno che passa la mezzanotte finisce
+    il giorno dopo (vedi `cambi_organico`).
+    """
+    giorni = pd.date_range('2024-01-01', periods=7, freq='D')  # Lunedì -> domenica
+    minuti_giorno = minuti_turno_giornalieri(giorni, {**config_base, 'work_std': candidato.work_std,
+                                                       'work_ven': candidato.work_ven})
+    n_turni = len(candidato.organico)
+    righe = []
+    for giorno_settimana, minuti in enumerate(minuti_giorno):
+        if minuti <= 0:
+            continue
+        durata = minuti / n_turni
+        for k, operatori in enumerate(candidato.organico):
+            inizio = INIZIO_TURNO_ORE * 60 + k * durata
+            fine = inizio + durata + (candidato.extension if k == n_turni - 1 and candidato.turni_modificati else 0)
+            righe.append({'Giorno_Settimana': giorno_settimana, 'Ora_Inizio': (inizio / 60) % 24,
+                          'Ora_Fine': (fine / 60) % 24, 'Operatori': int(operatori)})
+    return pd.DataFrame(righe, columns=COLONNE_ROSTER)
+
+
+def _vicini(c, fasi_estendibili, passo_minuti, limiti):
+    """Mosse della ricerca locale: (descrizione, candidato)."""
+    mosse = []
+    for k, n in enumerate(c.organico):
+        if n > 1:
+            ridotto = c.organico[:k] + (n - 1,) + c.organico[k + 1:]
+            mosse.append((f"Turno {k + 1}: -1 operatore", replace(c, organico=ridotto)))
+            # Un operatore in meno compensato da turni o estensione più lunghi
+            if c.work_std + passo_minuti <= limiti['work_std']:
+                mosse.append((f"Turno {k + 1}: -1 operatore, turno standard +{passo_minuti} min",
+                              replace(c, organico=ridotto, work_std=c.work_std + passo_minuti)))
+            if c.turni_modificati and c.extension + passo_minuti <= limiti['extension']:
+                mosse.append((f"Turno {k + 1}: -1 operatore, estensione +{passo_minuti} min",
+                              replace(c, organico=ridotto, extension=c.extension + passo_minuti)))
+    if c.work_std - passo_minuti > 0:
+        mosse.append((f"Turno standard -{passo_minuti} min", replace(c, work_std=c.work_std - passo_minuti)))
+    if c.work_ven - passo_minuti > 0:
+        mosse.append((f"Turno venerdì -{passo_minuti} min", replace(c, work_ven=c.work_ven - passo_minuti)))
+    if c.extension - passo_minuti >= 0:
+        mosse.append((f"Estensione -{passo_minuti} min", replace(c, extension=c.extension - passo_minuti)))
+    for fase in fasi_estendibili:
+        if fase in c.turni_modificati:
+            mosse.append((f"{fase}: senza estensione",
+                          replace(c, turni_modificati=tuple(f for f in c.turni_modificati if f != fase))))
+        elif c.extension > 0:
+            mosse.append((f"{fase}: con estensione",
+                          replace(c, turni_modificati=tuple(sorted(c.turni_modificati + (fase,))))))
+    return mosse
+
+
+def ottimizza_organico(inputs, config_base, n_turni=2, max_operatori=None, passo_minuti=60,
+                       fasi_estendibili=None, tolleranza_makespan=0.0, ritardo_max=None,
+                       max_iterazioni=30, max_workers=None, should_stop=None, progress_cb=None):
+    """
+    Organico di costo minimo per gli `inputs` (dict, vedi `lib.jobs.raccogli_input`).
+
+    Vincoli: makespan <= makespan di riferimento x (1 + tolleranza_makespan) e ritardo totale
+    sulle scadenze <= `ritardo_max` (default quello di riferimento; ignorato senza scadenze).
+    Il riferimento è l'organico uniforme `max_operatori` sui turni di `config_base`, simulato
+    come roster come ogni candidato (prima riga di df_storia). Obiettivo: ore
+    personale (lib/kpi.py, organico integrato fino al makespan). `max_operatori` (default
+    max_personale) limita l'organico di un turno; `fasi_estendibili` (default le
+    Turni_modificati della config) sono le fasi a cui la ricerca può dare l'estensione.
+
+    Restituisce (candidato migliore, KPI di riferimento, df_storia) con una riga per
+    candidato valutato (COLONNE_STORIA; 'Scelto' marca il migliore).
+    """
+    if inputs.get('df_competenze') is not None:
+        raise ValueError("Con la matrice competenze l'organico è per gruppo: "
+                         "l'ottimizzazione dei turni richiede operatori indistinti")
+    if n_turni < 1:
+        raise ValueError(f"Numero di turni non valido: {n_turni}")
+    max_operatori = int(max_operatori or config_base.get('max_personale', 1))
+    if fasi_estendibili is None:
+        fasi_estendibili = list(config_base.get('Turni_modificati', []))
+    workers = max_workers or MAX_PROCESSI
+
+    cache = {}  # CandidatoTurni -> kpi
+    storia = []
+    righe_storia = {}  # CandidatoTurni -> indice in storia
+    vincoli = {}  # 'makespan' e 'ritardo', fissati dal riferimento
+
+    def fattibile(kpi):
+        if not kpi['makespan_min'] <= vincoli['makespan']:  # NaN: nessuna fase simulata
+            return False
+        ritardo_max = vincoli['ritardo']
+        return pd.isna(ritardo_max) or pd.isna(kpi['ritardo_totale_min']) or kpi['ritardo_totale_min'] <= ritardo_max + 1e-6
+
+    def simula_candidati(nuovi, passo):
+        """Simula in parallelo i candidati [(candidato, mossa)], un roster ciascuno, e li registra."""
+        tabella = pd.concat([roster_candidato(c, config_base).assign(Roster=str(i))
+                             for i, (c, _) in enumerate(nuovi)], ignore_index=True)
+        configs = [c.config(config_base, str(i)) for i, (c, _) in enumerate(nuovi)]
+        for i, kpi in valuta_configurazioni({**inputs, 'df_turni_personale': tabella}, configs,
+                                            workers, should_stop):
+            c, mossa = nuovi[i]
+            cache[c] = kpi
+            righe_storia[c] = len(storia)
+            storia.append({
+                'Passo': passo, 'Mossa': mossa, 'work_std': c.work_std, 'work_ven': c.work_ven,
+                'extension': c.extension, 'Turni_modificati': ', '.join(c.turni_modificati),
+                'Organico': ' / '.join(map(str, c.organico)), 'ore_personale': kpi['ore_personale'],
+                'makespan_min': kpi['makespan_min'], 'ritardo_totale_min': kpi['ritardo_totale_min'],
+                'Fattibile': None, 'Scelto': False,
+            })
+        if should_stop is not None and should_stop():
+            raise SimulazioneAnnullata("Ottimizzazione annullata")
+
+    def valuta(mosse, passo):
+        """Valuta i candidati non ancora in cache; restituisce quelli fattibili."""
+        nuovi = list({c: m for m, c in mosse if c not in cache}.items())
+        if nuovi:
+            simula_candidati(nuovi, passo)
+            for c, _ in nuovi:
+                storia[righe_storia[c]]['Fattibile'] = fattibile(cache[c])
+        return [c for _, c in mosse if c in cache and fattibile(cache[c])]
+
+    def uniforme(n):
+        return CandidatoTurni(int(config_base.get('work_std', 480)), int(config_base.get('work_ven', 480)),
+                              int(config_base.get('extension', 0)),
+                              tuple(sorted(config_base.get('Turni_modificati', []))), (n,) * n_turni)
+
+    # Riferimento: organico uniforme max_operatori simulato come roster, come tutti i candidati,
+    # così il limite superiore della bisezione è fattibile per costruzione
+    riferimento = uniforme(max_operatori)
+    simula_candidati([(riferimento, f"Riferimento: organico uniforme {max_operatori}")], 0)
+    kpi_rif = cache[riferimento]
+    if pd.isna(kpi_rif['makespan_min']):
+        raise ValueError("La configurazione di riferimento non simula nessuna fase")
+    vincoli['makespan'] = kpi_rif['makespan_min'] * (1 + tolleranza_makespan)
+    vincoli['ritardo'] = kpi_rif['ritardo_totale_min'] if ritardo_max is None else ritardo_max
+    storia[righe_storia[riferimento]]['Fattibile'] = fattibile(kpi_rif)
+    limiti = {'work_std': int(config_base.get('workday_minutes', 1440)) - INIZIO_TURNO_ORE * 60,
+              'extension': max(int(config_base.get('extension', 0)), 4 * passo_minuti)}
+
+    # 1) Bisezione a k sezioni sull'organico uniforme: [basso, alto] con alto fattibile
+    basso, alto = 0, max_operatori
+    if not fattibile(kpi_rif):
+        raise ValueError(f"Il ritardo di riferimento ({kpi_rif['ritardo_totale_min']:.0f} min) "
+                         f"supera il ritardo massimo ammesso ({ritardo_max:.0f} min)")
+    passo = 1
+    while alto - basso > 1:
+        punti = sorted(set(np.linspace(basso, alto, min(workers, alto - basso - 1) + 2).round().astype(int)[1:-1]))
+        ok = {c.organico[0] for c in valuta([(f"Organico uniforme {n}", uniforme(n)) for n in punti], passo)}
+        alto = min([n for n in punti if n in ok], default=alto)
+        basso = max([n for n in punti if n not in ok and n < alto], default=basso)
+        passo += 1
+        if progress_cb is not None:
+            progress_cb(0.2, f"Bisezione: organico uniforme tra {basso + 1} e {alto}")
+    migliore = uniforme(alto)
+
+    # 2) Ricerca locale: si accetta il vicino fattibile con meno ore finché ce n'è uno
+    def costo(c):
+        return cache[c]['ore_personale'], cache[c]['makespan_min']
+
+    for iterazione in range(max_iterazioni):
+        vicini = valuta(_vicini(migliore, fasi_estendibili, passo_minuti, limiti), passo + iterazione)
+        candidato = min(vicini, key=costo, default=None)
+        if candidato is None or costo(candidato) >= costo(migliore):
+            break
+        migliore = candidato
+        if progress_cb is not None:
+            progress_cb(0.2 + 0.8 * (iterazione + 1) / max_iterazioni,
+                        f"Ricerca locale, passo {iterazione + 1}: {cache[migliore]['ore_personale']:.1f} ore-operatore")
+    storia[righe_storia[migliore]]['Scelto'] = True
+    return migliore, kpi_rif, pd.DataFrame(storia, columns=COLONNE_STORIA)
+
+
+def esegui_ottimizzazione_personale(payload, ctx):
+    """
+    Funzione di job (vedi lib/jobs.py). Payload:
+    {'input': dict input simulatore, 'config_base': dict, 'parametri': dict di argomenti di
+     `ottimizza_organico` (n_turni, max_operatori, passo_minuti, ...), 'max_workers': int|None}
+    Restituisce {'df_roster': roster consigliato, 'df_sintesi': parametri e KPI del roster
+    consigliato e di riferimento, 'df_storia': candidati valutati}.
+    """
+    config_base = payload['config_base']
+    migliore, kpi_rif, df_storia = ottimizza_organico(
+        payload['input'], config_base, **payload.get('parametri', {}),
+        max_workers=payload.get('max_workers'), should_stop=ctx.annullato,
+        progress_cb=lambda frazione, messaggio: ctx.aggiorna(frazione, messaggio, forza=True)
+    )
+    kpi = df_storia[df_storia['Scelto']].iloc[0]
+    voci = [
+        ('Turno standard (min)', config_base.get('work_std', 480), migliore.work_std),
+        ('Turno venerdì (min)', config_base.get('work_ven', 480), migliore.work_ven),
+        ('Estensione (min)', config_base.get('extension', 0), migliore.extension),
+        ('Fasi estese', ', '.join(config_base.get('Turni_modificati', [])), ', '.join(migliore.turni_modificati)),
+        ('Operatori per turno', df_storia['Organico'].iloc[0], ' / '.join(map(str, migliore.organico))),
+        ('Ore-operatore', f"{kpi_rif['ore_personale']:.1f}", f"{kpi['ore_personale']:.1f}"),
+        ('Makespan (min)', f"{kpi_rif['makespan_min']:.0f}", f"{kpi['makespan_min']:.0f}"),
+        ('Ritardo totale (min)', f"{kpi_rif['ritardo_totale_min']:.0f}", f"{kpi['ritardo_totale_min']:.0f}"),
+    ]
+    return {
+        'df_roster': roster_candidato(migliore, config_base),
+        'df_sintesi': pd.DataFrame([(v, str(r), str(c)) for v, r, c in voci],
+                                   columns=['Voce', 'Riferimento', 'Consigliato']),
+        'df_storia': df_storia,
+    }
@@ -0,0 +1,225 @@
+"""
+lib/surrogate.py
+Modello surrogato per stime what-if istantanee.
+
+Ogni simulazione valutata da uno sweep (o da un what-if eseguito per intero) diventa un
+campione (caratteristiche della config -> KPI), archiviato per insieme di dati di input e
+contesto della config (filtri, regole di pianificazione, roster per nome: `chiave_campioni`).
+Per ogni KPI si addestrano tre GradientBoostingRegressor di scikit-learn (quantili 10%, 50%,
+90%): il quantile centrale è la stima, l'intervallo 10-90% misura l'incertezza. Il modello è
+addestrato dal job che registra i campioni e salvato accanto all'archivio: le pagine lo
+caricano soltanto. Se la config esce dal dominio dei campioni o l'intervallo è troppo
+largo, la stima non è affidabile e la pagina ricorre alla simulazione reale, il cui
+risultato torna ad arricchire i campioni.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+
+from lib.datastore import hash_tabella
+from lib.kpi import calcola_kpi
+from lib.jobs import simula
+from lib.sweep import esegui_sweep, applica_punto
+
+SURROGATE_DIR = os.environ.get(
+    'SCHEDULATORE_SURROGATE_DIR', os.path.join(tempfile.gettempdir(), 'schedulatore_surrogato')
+)
+TARGET = ['makespan_min', 'lead_time_medio_min', 'picco_persone', 'picco_carrelli', 'ritardo_totale_min']
+# KPI NaN quando i dati non li consentono (senza 'Scadenza' nei lotti non c'è ritardo):
+# il modello li stima solo se i campioni li hanno
+TARGET_OPZIONALI = ('ritardo_totale_min',)
+QUANTILI = (0.1, 0.5, 0.9)
+CARATTERISTICHE_BASE = ['max_personale', 'max_carrelli', 'work_std', 'work_ven', 'extension',
+                        'variability_factor', 'margin_pct', 'wip_max', 'ritorno_carrelli',
+                        'lavaggio_carrelli', 'stazioni_lavaggio', 'campagne_formato',
+                        'trattieni_macchina_posticipi', 'trattieni_macchina_fisiologici']
+# Impostazioni non numeriche che cambiano i lotti simulati o le regole: separano gli archivi
+CHIAVI_CONTESTO = ('filter_format', 'filter_line', 'Turni_modificati', 'includi_posticipi',
+                   'includi_fisiologici', 'data_inizio', 'fri38')
+MIN_CAMPIONI = 15
+# Larghezza massima dell'intervallo 10-90% rispetto alla stima per considerarla affidabile
+SOGLIA_INCERTEZZA = 0.15
+
+_lock = threading.Lock()
+_modelli = {}  # percorso del modello -> (istante di modifica, ModelloSurrogato)
+
+
+def chiave_dati(inputs):
+    """Identifica l'insieme di input del simulatore: i campioni valgono solo per quei dati."""
+    h = hashlib.blake2b(digest_size=12)
+    for df in inputs.values():
+        h.update(b'-' if df is None else hash_tabella(df).encode())
+    return h.hexdigest()
+
+
+def chiave_campioni(chiave_input, config):
+    """
+    Chiave dell'archivio campioni: dati di input (`chiave_dati`) e contesto della config
+    (CHIAVI_CONTESTO e roster per nome), così i campioni di lotti o regole diverse non si
+    mescolano sotto caratteristiche identiche.
+    """
+    contesto = {}
+    for k in CHIAVI_CONTESTO:
+        valore = config.get(k)
+        contesto[k] = sorted(map(str, valore)) if isinstance(valore, (list, tuple, set)) else valore
+    roster = config.get('roster')
+    if roster is not None and not isinstance(roster, (int, float)):  # I roster numerati sono caratteristiche
+        contesto['roster'] = roster
+    testo = json.dumps(contesto, sort_keys=True, default=str)
+    return f"{chiave_input}_{hashlib.blake2b(testo.encode(), digest_size=6).hexdigest()}"
+
+
+def caratteristiche(config):
+    """Vettore di caratteristiche numeriche (dict) di una config."""
+    riga = {k: float(config.get(k, 0) or 0) for k in CARATTERISTICHE_BASE}
+    for mac, cap in config.get('machine_caps', {}).items():
+        riga[f"cap_{mac}"] = float(cap)
+    for fase, cap in config.get('buffer_fasi', {}).items():
+        riga[f"buffer_{fase}"] = float(cap)
+    for fase, par in config.get('fasi_batch', {}).items():
+        riga[f"batch_{fase}"] = float(par.get('capacita', 0))
+        riga[f"attesa_batch_{fase}"] = float(par.get('attesa_max', 0))
+    for fase, dim in config.get('lotti_trasferimento', {}).items():
+        riga[f"trasferimento_{fase}"] = float(dim)
+    for fase, par in config.get('aree', {}).items():
+        riga[f"area_{fase}"] = float(par.get('capacita', 0))
+    riga['pianificazione_indietro'] = float(config.get('pianificazione', 'avanti') == 'indietro')
+    if config.get('pianificazione') == 'indietro':
+        riga['anticipo_rilascio'] = float(config.get('anticipo_rilascio', config.get('work_std', 480)))
+    if isinstance(config.get('roster'), (int, float)): # Roster numerati (vedi pagina 8)
+        riga['roster'] = float(config['roster'])
+    return riga
+
+
+# -- Archivio campioni ----------------------------------------------------
+def _percorso(chiave, estensione='parquet'):
+    return os.path.join(SURROGATE_DIR, f"{chiave}.{estensione}")
+
+
+def carica_campioni(chiave):
+    percorso = _percorso(chiave)
+    return pd.read_parquet(percorso) if os.path.exists(percorso) else pd.DataFrame()
+
+
+def registra_campioni(chiave_input, config_kpi):
+    """
+    Aggiunge le coppie (config, kpi) valutate all'archivio del loro contesto (vedi
+    `chiave_campioni`) e riaddestra il modello di ogni archivio modificato.
+    """
+    righe = {}
+    for cfg, kpi in config_kpi:
+        righe.setdefault(chiave_campioni(chiave_input, cfg), []).append(
+            {**caratteristiche(cfg), **{t: kpi.get(t, np.nan) for t in TARGET}})
+    if not righe:
+        return
+    os.makedirs(SURROGATE_DIR, exist_ok=True)
+    for chiave, nuove in righe.items():
+        with _lock:
+            df = pd.concat([carica_campioni(chiave), pd.DataFrame(nuove)], ignore_index=True)
+            df.to_parquet(_percorso(chiave), index=False)
+        addestra_modello(chiave, df)
+
+
+# -- Modello --------------------------------------------------------------
+def target_stimabili(campioni):
+    """KPI di TARGET da stimare sui `campioni`: gli opzionali solo se qualche campione li ha."""
+    return [t for t in TARGET
+            if t not in TARGET_OPZIONALI or (t in campioni.columns and campioni[t].notna().any())]
+
+
+class ModelloSurrogato:
+    """Regressori quantilici per ciascun KPI, addestrati sui campioni di un insieme di dati."""
+
+    def __init__(self, campioni):
+        target = target_stimabili(campioni)
+        campioni = campioni.dropna(subset=target)
+        self.colonne = [c for c in campioni.columns if c not in TARGET]
+        X = campioni[self.colonne].fillna(0).to_numpy(dtype=float)
+        self.n_campioni = len(X)
+        self.limiti = (X.min(axis=0), X.max(axis=0))
+        self.regressori = {}
+        for kpi in target:
+            y = campioni[kpi].to_numpy(dtype=float)
+            self.regressori[kpi] = [
+                GradientBoostingRegressor(loss='quantile', alpha=q, n_estimators=150,
+                                          max_depth=3, learning_rate=0.05, random_state=0).fit(X, y)
+                for q in QUANTILI
+            ]
+
+    def predici(self, config):
+        """
+        Restituisce (stime, affidabile): stime = {kpi: (basso, stima, alto)} per i KPI del
+        modello (vedi `target_stimabili`). La stima è
+        affidabile se la config è nel dominio dei campioni e ogni intervallo 10-90% è
+        entro SOGLIA_INCERTEZZA della stima.
+        """
+        riga = caratteristiche(config)
+        x = np.array([[riga.get(c, 0.0) for c in self.colonne]])
+        stime = {}
+        affidabile = bool(((x[0] >= self.limiti[0]) & (x[0] <= self.limiti[1])).all())
+        for target, (r_basso, r_mediano, r_alto) in self.regressori.items():
+            basso, stima, alto = (float(r.predict(x)[0]) for r in (r_basso, r_mediano, r_alto))
+            basso, alto = min(basso, stima), max(alto, stima)
+            stime[target] = (basso, stima, alto)
+            if (alto - basso) > SOGLIA_INCERTEZZA * max(abs(stima), 1.0):
+                affidabile = False
+        return stime, affidabile
+
+
+def addestra_modello(chiave, campioni):
+    """Addestra il modello sui `campioni` di un archivio e lo salva (se ce ne sono abbastanza)."""
+    if len(campioni.dropna(subset=target_stimabili(campioni))) < MIN_CAMPIONI:
+        return
+    modello = ModelloSurrogato(campioni)
+    temporaneo = _percorso(chiave, f"{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temporaneo, 'wb') as f:
+        pickle.dump(modello, f)
+    os.replace(temporaneo, _percorso(chiave, 'pkl'))
+
+
+def modello_per(chiave):
+    """Ultimo modello salvato per l'archivio `chiave` (riletto solo se cambiato), o None."""
+    percorso = _percorso(chiave, 'pkl')
+    try:
+        modificato = os.stat(percorso).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        memorizzato = _modelli.get(percorso)
+        if memorizzato is None or memorizzato[0] != modificato:
+            with open(percorso, 'rb') as f:
+                memorizzato = _modelli[percorso] = (modificato, pickle.load(f))
+    return memorizzato[1]
+
+
+# -- Funzioni di job (vedi lib/jobs.py) -------------------------------------
+def esegui_sweep_e_registra(payload, ctx):
+    """Sweep (lib/sweep.py) i cui punti simulati diventano campioni del surrogato."""
+    df = esegui_sweep(payload, ctx)
+    nomi = [p.nome for p in payload['parametri']]
+    simulati = df[~df['Potato']]
+    registra_campioni(
+        chiave_dati(payload['input']),
+        [(applica_punto(payload['config_base'], r[nomi]), r) for _, r in simulati.iterrows()]
+    )
+    return df
+
+
+def valuta_e_registra(payload, ctx):
+    """Simulazione reale di una config ({'input': dict, 'config': dict}) -> KPI, registrati come campione."""
+    cfg = payload['config']
+    risultati = simula(
+        payload['input'], cfg,
+        progress_cb=lambda frazione, _df: ctx.aggiorna(frazione, f"{frazione:.0%} lotti completati"),
+        should_stop=ctx.annullato
+    )
+    kpi = calcola_kpi(*risultati, cfg)
+    registra_campioni(chiave_dati(payload['input']), [(cfg, kpi)])
+    return kpi
@@ -0,0 +1,284 @@
+"""
+lib/sweep.py
+Generatore di sweep di scenari (design of experiments) e fronte di Pareto.
+
+Un sweep espande intervalli su parametri di configurazione (max_personale, max_carrelli,
+capacità delle singole macchine e dei buffer, work_std, extension) secondo un disegno a griglia,
+Latin hypercube o adattivo, valuta i punti con il runner parallelo (lib/parallel.py)
+e restituisce una tabella punto -> KPI con il flag di appartenenza al fronte di Pareto.
+parametri_scenario elenca i parametri esplorabili su uno scenario (comune alle Pagine 8 e 11)
+con il motivo di quelli esclusi.
+
+Potatura anticipata: tutti i parametri sono "di capacità" (più alto = più risorse, costo
+maggiore, makespan non peggiore). Quando un punto valutato raggiunge già il makespan minimo
+(quello del punto con tutte le risorse al massimo), ogni punto con risorse >= a esso non può
+migliorare il makespan e costa di più: è dominato e non viene simulato. I parametri che
+non sono di capacità (PARAMETRI_NON_MONOTONI, es. il roster del calendario turni) la
+disattivano.
+"""
+import itertools
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from lib.kpi import COLONNE_KPI
+from lib.parallel import valuta_configurazioni, MAX_PROCESSI
+from lib.simulator import SimulazioneAnnullata
+
+DISEGNI = ('griglia', 'lhs', 'adattivo')
+PREFISSO_MACCHINA = 'machine_caps.'
+PREFISSO_BUFFER = 'buffer_fasi.'
+# Chiavi di config che sono dizionari: il parametro 'chiave.sottochiave' ne modifica una voce
+CHIAVI_DIZIONARIO = ('machine_caps', 'buffer_fasi')
+# Parametri senza un ordine di capacità (un valore più alto non è "più risorse")
+PARAMETRI_NON_MONOTONI = ('roster',)
+# Obiettivi del fronte di Pareto (tutti da minimizzare)
+OBIETTIVI_PARETO = ('makespan_min', 'ore_personale', 'energia_tot')
+# Tolleranza relativa sul makespan minimo per la potatura
+TOLLERANZA_MAKESPAN = 0.001
+# Parametri scalari di config esplorabili da sweep (Pagina 8) e sensitività (Pagina 11)
+ETICHETTE_PARAMETRI = {
+    'variability_factor': "Variabilità (frazione)",
+    'margin_pct': "Margine tempi (frazione)",
+    'max_personale': "Operatori",
+    'max_carrelli': "Carrelli",
+    'work_std': "Minuti turno standard",
+    'work_ven': "Minuti turno venerdì",
+    'extension': "Estensione turno (min)",
+}
+
+
+@dataclass
+class ParametroSweep:
+    """Intervallo [minimo, massimo] con passo `passo` su una chiave di config."""
+    nome: str
+    minimo: float
+    massimo: float
+    passo: float = 1
+
+    def valori(self):
+        n = int(round((self.massimo - self.minimo) / self.passo)) + 1 if self.passo > 0 else 1
+        return [self.minimo + i * self.passo for i in range(max(n, 1))]
+
+    def arrotonda(self, x):
+        """Porta un valore continuo sul passo del parametro, entro i limiti."""
+        if self.passo <= 0:
+            return self.minimo
+        k = round((x - self.minimo) / self.passo)
+        return min(max(self.minimo + k * self.passo, self.minimo), self.massimo)
+
+
+def _dividi_nome(nome):
+    """'machine_caps.FORNO1' -> ('machine_caps', 'FORNO1'); 'max_personale' -> ('max_personale', None)."""
+    chiave, _, sottochiave = nome.partition('.')
+    return (chiave, sottochiave) if chiave in CHIAVI_DIZIONARIO and sottochiave else (nome, None)
+
+
+def valore_config(config, nome, default=None):
+    """Valore corrente del parametro `nome` (anche 'chiave.sottochiave') in una config."""
+    chiave, sottochiave = _dividi_nome(nome)
+    if sottochiave is None:
+        return config.get(chiave, default)
+    return config.get(chiave, {}).get(sottochiave, default)
+
+
+def parametri_scenario(config_base, df_fasi, df_turni_personale=None):
+    """
+    Parametri esplorabili sullo scenario `config_base`: restituisce (parametri, esclusi).
+    parametri {nome: etichetta} comprende ETICHETTE_PARAMETRI, le capacità delle macchine e
+    dei buffer di `df_fasi` e, con un calendario turni a roster numerati, il roster; esclusi
+    {nome: motivo} elenca quelli che nello scenario non avrebbero effetto, da mostrare
+    all'utente invece di toglierli in silenzio.
+    """
+    parametri = dict(ETICHETTE_PARAMETRI)
+    esclusi = {}
+    if not config_base.get('Turni_modificati'):
+        # L'estensione si applica solo alle fasi in Turni_modificati
+        del parametri['extension']
+        esclusi['extension'] = (
+            f"{ETICHETTE_PARAMETRI['extension']} non disponibile: lo scenario non ha fasi con "
+            "turno esteso (Turni_modificati), quindi il parametro non cambierebbe i KPI. "
+            "Le fasi a cui applicare l'estensione si scelgono salvando uno scenario dalla Pagina 10."
+        )
+    for mac in df_fasi['Macchina'].unique().tolist():
+        parametri[f"{PREFISSO_MACCHINA}{mac}"] = f"Capacità {mac}"
+    for fase in df_fasi['Fase'].unique().tolist():
+        parametri[f"{PREFISSO_BUFFER}{fase}"] = f"Buffer dopo {fase}"
+    if df_turni_personale is not None and 'Roster' in df_turni_personale.columns:
+        if pd.api.types.is_integer_dtype(df_turni_personale['Roster']):
+            parametri['roster'] = "Roster turni"
+        else:
+            esclusi['roster'] = ("Roster turni non disponibile: i roster del calendario turni "
+                                 "non sono identificati da numeri interi.")
+    return parametri, esclusi
+
+
+def applica_punto(config_base, punto):
+    """Config derivata da `config_base` con i valori del punto ({nome_parametro: valore})."""
+    cfg = dict(config_base)
+    for chiave in CHIAVI_DIZIONARIO:
+        cfg[chiave] = dict(config_base.get(chiave, {}))
+    for nome, valore in punto.items():
+        valore = int(valore) if float(valore).is_integer() else float(valore)
+        chiave, sottochiave = _dividi_nome(nome)
+        if sottochiave is None:
+            cfg[chiave] = valore
+        else:
+            cfg[chiave][sottochiave] = valore
+    return cfg
+
+
+# -- Disegni -------------------------------------------------------------
+def disegno_griglia(parametri):
+    nomi = [p.nome for p in parametri]
+    return [dict(zip(nomi, combo)) for combo in itertools.product(*(p.valori() for p in parametri))]
+
+
+def disegno_lhs(parametri, n_punti, seed=0):
+    """Latin hypercube: ogni parametro è diviso in n strati, un campione per strato."""
+    rng = np.random.default_rng(seed)
+    unita = (rng.permuted(np.tile(np.arange(n_punti), (len(parametri), 1)), axis=1).T
+             + rng.random((n_punti, len(parametri)))) / n_punti
+    punti = []
+    for riga in unita:
+        punti.append({p.nome: p.arrotonda(p.minimo + u * (p.massimo - p.minimo))
+                      for p, u in zip(parametri, riga)})
+    return _unici(punti)
+
+
+def proponi_vicini(fronte, parametri, n_punti, rng):
+    """Disegno adattivo: perturba di ±1 passo i punti del fronte di Pareto corrente."""
+    proposte = []
+    if not fronte:
+        return proposte
+    for _ in range(n_punti):
+        base = fronte[rng.integers(len(fronte))]
+        punto = {p.nome: p.arrotonda(base[p.nome] + rng.integers(-1, 2) * p.passo) for p in parametri}
+        proposte.append(punto)
+    return _unici(proposte)
+
+
+def _unici(punti):
+    visti, out = set(), []
+    for p in punti:
+        chiave = tuple(sorted(p.items()))
+        if chiave not in visti:
+            visti.add(chiave)
+            out.append(p)
+    return out
+
+
+# -- Pareto e potatura ---------------------------------------------------
+def fronte_pareto(df, obiettivi=OBIETTIVI_PARETO):
+    """Maschera booleana dei punti non dominati (minimizzazione di tutti gli obiettivi)."""
+    valori = df[list(obiettivi)].to_numpy(dtype=float)
+    validi = ~np.isnan(valori).any(axis=1)
+    non_dominato = validi.copy()
+    for i in np.flatnonzero(validi):
+        altri = valori[validi]
+        dominato_da = (altri <= valori[i]).all(axis=1) & (altri < valori[i]).any(axis=1)
+        non_dominato[i] = not dominato_da.any()
+    return pd.Series(non_dominato, index=df.index)
+
+
+def _domina_risorse(a, b, nomi):
+    return all(a[n] <= b[n] for n in nomi)
+
+
+def _potabile(punto, saturi, nomi):
+    """True se esiste un punto già valutato a makespan minimo con risorse <= `punto`."""
+    return any(_domina_risorse(s, punto, nomi) for s in saturi)
+
+
+# -- Esecuzione ----------------------------------------------------------
+def esegui_sweep(payload, ctx):
+    """
+    Funzione di job (vedi lib/jobs.py). Payload:
+    {'input': dict input simulatore (lib.jobs.raccogli_input), 'config_base': dict, 'parametri': [ParametroSweep],
+     'disegno': 'griglia'|'lhs'|'adattivo', 'n_punti': int, 'seed': int, 'max_workers': int|None}
+    Restituisce un DataFrame con una riga per punto: parametri, KPI, 'Potato', 'Pareto'.
+    """
+    parametri = payload['parametri']
+    nomi = [p.nome for p in parametri]
+    config_base = payload['config_base']
+    disegno = payload.get('disegno', 'griglia')
+    n_punti = payload.get('n_punti', 20)
+    rng = np.random.default_rng(payload.get('seed', 0))
+
+    if disegno == 'griglia':
+        candidati = disegno_griglia(parametri)
+    elif disegno == 'lhs':
+        candidati = disegno_lhs(parametri, n_punti, payload.get('seed', 0))
+    elif disegno == 'adattivo':
+        # Primo lotto esplorativo (metà del budget), poi raffinamento attorno al fronte
+        candidati = disegno_lhs(parametri, max(2, n_punti // 2), payload.get('seed', 0))
+    else:
+        raise ValueError(f"Disegno non valido: {disegno}")
+
+    # Il punto con tutte le risorse al massimo fissa il makespan minimo raggiungibile
+    angolo_max = {p.nome: p.massimo for p in parametri}
+    righe = []
+    valutati = set()
+    saturi = []
+    makespan_min = None
+    potatura = not any(p.nome in PARAMETRI_NON_MONOTONI for p in parametri)
+
+    workers = payload.get('max_workers') or MAX_PROCESSI
+    dimensione_blocco = 2 * workers
+
+    def valuta(punti):
+        nuovi = []
+        for punto in punti:
+            chiave = tuple(sorted(punto.items()))
+            if chiave not in valutati:
+                valutati.add(chiave)
+                nuovi.append(punto)
+        # Ordine crescente di risorse, a blocchi: i punti "piccoli" già saturi potano
+        # quelli più grandi prima che vengano simulati
+        nuovi.sort(key=lambda p: sum((p[q.nome] - q.minimo) / max(q.massimo - q.minimo, 1e-9)
+                                     for q in parametri))
+        for inizio in range(0, len(nuovi), dimensione_blocco):
+            if ctx.annullato():
+                return
+            da_simulare = []
+            for punto in nuovi[inizio:inizio + dimensione_blocco]:
+                if potatura and makespan_min is not None and _potabile(punto, saturi, nomi):
+                    righe.append({**punto, 'Potato': True})
+                else:
+                    da_simulare.append(punto)
+            configs = [applica_punto(config_base, p) for p in da_simulare]
+            for indice, kpi in valuta_configurazioni(payload['input'], configs, workers, ctx.annullato):
+                punto = da_simulare[indice]
+                righe.append({**punto, **kpi, 'Potato': False})
+                if makespan_min is not None and kpi['makespan_min'] <= makespan_min * (1 + TOLLERANZA_MAKESPAN):
+                    saturi.append(punto)
+                ctx.aggiorna(len(righe) / max(totale_stimato, len(righe)),
+                             f"{len(righe)} punti valutati", parziale=pd.DataFrame(righe))
+
+    totale_stimato = len(candidati) + 1 + (n_punti - len(candidati) if disegno == 'adattivo' else 0)
+    valuta([angolo_max])
+    makespan_min = righe[0]['makespan_min'] if righe else None
+    if makespan_min is not None:
+        saturi.append(angolo_max)
+    valuta(candidati)
+
+    if disegno == 'adattivo':
+        while len(righe) < n_punti and not ctx.annullato():
+            df_tmp = pd.DataFrame([r for r in righe if not r['Potato']])
+            fronte = df_tmp[fronte_pareto(df_tmp)][nomi].to_dict('records')
+            proposte = proponi_vicini(fronte, parametri, n_punti - len(righe), rng)
+            nuove = [p for p in proposte if tuple(sorted(p.items())) not in valutati]
+            if not nuove:
+                break
+            valuta(nuove)
+
+    if ctx.annullato():
+        raise SimulazioneAnnullata(f"Sweep annullato dopo {len(righe)} punti")
+
+    df = pd.DataFrame(righe)
+    for col in COLONNE_KPI:
+        if col not in df.columns:
+            df[col] = np.nan
+    df['Pareto'] = fronte_pareto(df) & ~df['Potato']
+    return df
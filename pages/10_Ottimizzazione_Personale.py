@@ -0,0 +1,132 @@
+# pages/10_Ottimizzazione_Personale.py
+
+import streamlit as st
+import plotly.express as px
+from lib.style import apply_custom_style
+from lib.jobs import get_job_manager, raccogli_input
+from lib.job_panel import owner_corrente, selettore_job, mostra_job, risultato_job
+from lib.staffing import esegui_ottimizzazione_personale
+
+st.set_page_config(page_title="10. Ottimizzazione Personale", layout="wide")
+apply_custom_style()
+
+if not st.session_state.get("logged_in"):
+    st.error("❌ Login richiesto"); st.stop()
+
+req = ["df_lotti","df_fasi","df_posticipi","df_posticipi_fisiologici","df_equivalenze","scenari"]
+if any(k not in st.session_state for k in req) or not st.session_state["scenari"]:
+    st.warning("⚠️ Carica i dati (Pagina 1) e salva almeno uno scenario di base (Pagina 2).")
+    st.stop()
+
+st.title("10. Ottimizzazione dei Turni e dell'Organico")
+st.markdown(
+    "Cerca durata dei turni, estensione e operatori per turno che **minimizzano le ore-operatore** "
+    "mantenendo il makespan e i ritardi sulle scadenze del riferimento: i turni dello scenario di base "
+    "con il massimo di operatori in ogni turno."
+)
+
+if st.session_state.get("df_competenze") is not None:
+    st.warning("⚠️ Con la matrice competenze l'organico è per gruppo: l'ottimizzazione non è disponibile.")
+    st.stop()
+
+# --- Scenario di base ---
+idx_base = st.selectbox(
+    "Scenario di base", range(len(st.session_state["scenari"])),
+    format_func=lambda i: f"Scenario {i + 1}"
+)
+config_base = st.session_state["scenari"][idx_base]
+
+# --- Parametri della ricerca ---
+st.subheader("Parametri della ricerca")
+col1, col2, col3 = st.columns(3)
+with col1:
+    n_turni = st.number_input("Turni al giorno", min_value=1, max_value=4, value=2, step=1)
+    max_operatori = st.number_input("Massimo operatori per turno", min_value=1,
+                                    value=int(config_base.get("max_personale", 1)), step=1)
+with col2:
+    passo_minuti = st.number_input("Passo sulle durate (min)", min_value=15, value=60, step=15)
+    tolleranza = st.number_input("Tolleranza sul makespan (%)", min_value=0.0, value=0.0, step=1.0)
+with col3:
+    max_iterazioni = st.number_input("Iterazioni massime della ricerca locale", min_value=1, value=30, step=1)
+fasi_estendibili = st.multiselect(
+    "Fasi a cui la ricerca può applicare l'estensione del turno",
+    st.session_state["df_fasi"]["Fase"].unique().tolist(),
+    default=config_base.get("Turni_modificati", [])
+)
+if st.session_state.get("df_turni_personale") is not None:
+    st.info("ℹ️ Il calendario turni caricato non viene usato: ogni candidato ne genera uno proprio.")
+
+job_id = selettore_job("ottimizzazione", "job_ottimizzazione")
+if st.button("🚀 Avvia ottimizzazione"):
+    payload = {
+        "input": raccogli_input(st.session_state),
+        "config_base": config_base,
+        "parametri": {
+            "n_turni": int(n_turni),
+            "max_operatori": int(max_operatori),
+            "passo_minuti": int(passo_minuti),
+            "fasi_estendibili": fasi_estendibili,
+            "tolleranza_makespan": tolleranza / 100,
+            "max_iterazioni": int(max_iterazioni),
+        },
+    }
+    try:
+        job_id = get_job_manager().invia(
+            "ottimizzazione", owner_corrente(), payload,
+            descrizione=f"Organico su {n_turni} turni (Scenario {idx_base + 1})",
+            funzione=esegui_ottimizzazione_personale
+        )
+        st.session_state["job_ottimizzazione"] = job_id
+    except RuntimeError as e:
+        st.error(f"❌ {e}")
+
+if not job_id:
+    st.stop()
+
+info = mostra_job(job_id)
+if not info or info["stato"] != "completato":
+    st.stop()
+
+risultato = risultato_job(job_id)
+df_roster = risultato["df_roster"]
+df_storia = risultato["df_storia"]
+scelto = df_storia[df_storia["Scelto"]].iloc[0]
+
+# --- Roster consigliato ---
+st.subheader("Roster consigliato")
+c1, c2, c3 = st.columns(3)
+c1.metric("Ore-operatore", f"{scelto['ore_personale']:.1f}")
+c2.metric("Makespan (min)", f"{scelto['makespan_min']:.0f}")
+c3.metric("Candidati simulati", len(df_storia))
+st.dataframe(risultato["df_sintesi"], use_container_width=True, hide_index=True)
+
+nomi_giorni = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
+df_vista = df_roster.assign(Giorno=df_roster["Giorno_Settimana"].map(dict(enumerate(nomi_giorni))))
+st.dataframe(df_vista[["Giorno", "Ora_Inizio", "Ora_Fine", "Operatori"]], use_container_width=True, hide_index=True)
+st.download_button(
+    "📥 Scarica roster (CSV)", df_roster.to_csv(index=False).encode("utf-8"),
+    file_name="roster_consigliato.csv", mime="text/csv"
+)
+
+# --- Andamento della ricerca ---
+with st.expander("Candidati valutati"):
+    fig = px.scatter(
+        df_storia, x="ore_personale", y="makespan_min", color="Fattibile", symbol="Scelto",
+        hover_data=["Mossa", "Organico", "work_std", "work_ven", "extension"],
+        title="Ore-operatore vs makespan dei candidati"
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(df_storia, use_container_width=True)
+
+if st.button("💾 Adotta il roster come calendario turni e salva lo scenario"):
+    st.session_state["df_turni_personale"] = df_roster
+    st.session_state["scenari"].append({
+        **config_base,
+        "work_std": int(scelto["work_std"]),
+        "work_ven": int(scelto["work_ven"]),
+        "extension": int(scelto["extension"]),
+        "Turni_modificati": [f for f in scelto["Turni_modificati"].split(", ") if f],
+        "max_personale": int(df_roster["Operatori"].max()),
+        "roster": None,
+    })
+    st.success(f"✅ Calendario turni aggiornato e Scenario {len(st.session_state['scenari'])} aggiunto (vedi Pagina 2)")
@@ -0,0 +1,163 @@
+# pages/11_Sensitivita.py
+
+import streamlit as st
+import plotly.graph_objects as go
+from lib.style import apply_custom_style
+from lib.jobs import get_job_manager, raccogli_input
+from lib.job_panel import owner_corrente, selettore_job, mostra_job, risultato_job
+from lib.kpi import COLONNE_KPI
+from lib.sweep import ParametroSweep, valore_config, parametri_scenario, PREFISSO_MACCHINA
+from lib.sensitivita import esegui_sensitivita
+
+st.set_page_config(page_title="11. Sensitività", layout="wide")
+apply_custom_style()
+
+if not st.session_state.get("logged_in"):
+    st.error("❌ Login richiesto"); st.stop()
+
+req = ["df_lotti","df_fasi","df_posticipi","df_posticipi_fisiologici","df_equivalenze","scenari"]
+if any(k not in st.session_state for k in req) or not st.session_state["scenari"]:
+    st.warning("⚠️ Carica i dati (Pagina 1) e salva almeno uno scenario di base (Pagina 2).")
+    st.stop()
+
+st.title("11. Analisi di Sensitività Globale")
+st.markdown(
+    "Quali parametri muovono davvero i KPI? **Morris** ordina i parametri per influenza con poche "
+    "simulazioni, **Sobol** scompone la varianza del KPI tra i parametri (S1 da soli, ST con le interazioni)."
+)
+
+idx_base = st.selectbox(
+    "Scenario di base", range(len(st.session_state["scenari"])),
+    format_func=lambda i: f"Scenario {i + 1}"
+)
+config_base = st.session_state["scenari"][idx_base]
+
+# --- Parametri: (etichetta, minimo, massimo, passo) predefiniti attorno allo scenario ---
+st.subheader("Parametri da analizzare")
+INTERVALLI = {
+    "variability_factor": (0.0, 0.3, 0.01),
+    "margin_pct": (0.0, 0.2, 0.01),
+    "max_personale": (1, 2 * int(config_base.get("max_personale", 1)), 1),
+    "max_carrelli": (1, 2 * int(config_base.get("max_carrelli", 1)), 1),
+    "work_std": (360, 960, 60),
+    "work_ven": (360, 960, 60),
+    "extension": (0, 120, 30),
+}
+parametri_sc, esclusi = parametri_scenario(config_base, st.session_state["df_fasi"])
+candidati = {}
+for nome, etichetta in parametri_sc.items():
+    if nome.startswith(PREFISSO_MACCHINA):
+        cap = int(valore_config(config_base, nome, 1))
+        candidati[nome] = (etichetta, 1, cap + 1, 1)
+    elif nome in INTERVALLI:
+        candidati[nome] = (etichetta, *INTERVALLI[nome])
+for motivo in esclusi.values():
+    st.caption(f"ℹ️ {motivo}")
+
+parametri = []
+for nome, (etichetta, minimo, massimo, passo) in candidati.items():
+    col0, col1, col2, col3 = st.columns([2, 1, 1, 1])
+    with col0:
+        attivo = st.checkbox(etichetta, value=nome in ("variability_factor", "margin_pct", "max_personale",
+                                                       "max_carrelli", "work_std"), key=f"sa_on_{nome}")
+    if not attivo:
+        continue
+    with col1:
+        vmin = st.number_input("Min", value=minimo, step=passo, key=f"sa_min_{nome}")
+    with col2:
+        vmax = st.number_input("Max", value=massimo, step=passo, key=f"sa_max_{nome}")
+    with col3:
+        vpasso = st.number_input("Passo", min_value=passo, value=passo, step=passo, key=f"sa_step_{nome}")
+    parametri.append(ParametroSweep(nome, vmin, max(vmin, vmax), vpasso))
+
+# --- Disegno ---
+st.subheader("Campionamento")
+col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+with col_m1:
+    metodi = st.multiselect("Metodi", ["morris", "sobol"], default=["morris"],
+                            format_func={"morris": "Morris", "sobol": "Sobol"}.get)
+with col_m2:
+    traiettorie = st.number_input("Traiettorie Morris", min_value=2, value=10, step=1)
+with col_m3:
+    n_sobol = st.number_input("Campioni base Sobol (potenza di 2)", min_value=8, value=32, step=8)
+with col_m4:
+    seed = st.number_input("Seed", min_value=0, value=0, step=1)
+
+k = len(parametri)
+n_stimato = 2 * k + 1 + ("morris" in metodi) * traiettorie * (k + 1) + ("sobol" in metodi) * n_sobol * (k + 2)
+st.caption(f"Fino a {n_stimato} simulazioni (i punti ripetuti vengono simulati una volta sola). "
+           "Con un seed nello scenario la variabilità è la stessa per tutti i punti.")
+
+job_id = selettore_job("sensitivita", "job_sensitivita")
+if st.button("🚀 Avvia analisi", disabled=not parametri):
+    payload = {
+        "input": raccogli_input(st.session_state),
+        "config_base": config_base,
+        "parametri": parametri,
+        "metodi": metodi,
+        "traiettorie": int(traiettorie),
+        "n_sobol": int(n_sobol),
+        "seed": int(seed),
+    }
+    try:
+        job_id = get_job_manager().invia(
+            "sensitivita", owner_corrente(), payload,
+            descrizione=f"Sensitività ({', '.join(metodi) or 'oscillazione'}) su {k} parametri",
+            funzione=esegui_sensitivita
+        )
+        st.session_state["job_sensitivita"] = job_id
+    except RuntimeError as e:
+        st.error(f"❌ {e}")
+
+if not job_id:
+    st.stop()
+
+info = mostra_job(job_id)
+if not info or info["stato"] != "completato":
+    st.stop()
+
+risultato = risultato_job(job_id)
+df_indici = risultato["df_indici"]
+
+# --- Tornado ---
+st.subheader("Tornado")
+kpi_disponibili = [c for c in COLONNE_KPI if c in set(df_indici["KPI"])]
+col_t1, col_t2 = st.columns(2)
+with col_t1:
+    kpi = st.selectbox("KPI", kpi_disponibili)
+with col_t2:
+    ordinamenti = {"Oscillazione min-max": "Oscillazione"}
+    if df_indici["mu_star"].notna().any():
+        ordinamenti["Morris mu*"] = "mu_star"
+    if df_indici["ST"].notna().any():
+        ordinamenti["Sobol ST"] = "ST"
+    ordina_per = ordinamenti[st.selectbox("Ordina per", list(ordinamenti), index=len(ordinamenti) - 1)]
+
+df_kpi = df_indici[df_indici["KPI"] == kpi].copy()
+df_kpi["Oscillazione"] = (df_kpi["Alto"] - df_kpi["Basso"]).abs()
+df_kpi = df_kpi.sort_values(ordina_per, ascending=True)  # Il più influente in alto
+valore_base = float(df_kpi["KPI_base"].iloc[0])
+fig = go.Figure()
+fig.add_bar(y=df_kpi["Parametro"], x=df_kpi["Basso"] - valore_base, base=valore_base, orientation="h",
+            name="Parametro al minimo", marker_color="#4C78A8")
+fig.add_bar(y=df_kpi["Parametro"], x=df_kpi["Alto"] - valore_base, base=valore_base, orientation="h",
+            name="Parametro al massimo", marker_color="#F58518")
+fig.add_vline(x=valore_base, line_dash="dash", annotation_text="Scenario di base")
+fig.update_layout(barmode="overlay", title=f"{kpi}: variazione con ogni parametro al minimo e al massimo",
+                  xaxis_title=kpi, height=120 + 40 * len(df_kpi))
+st.plotly_chart(fig, use_container_width=True)
+
+# --- Indici ---
+st.subheader("Indici di sensitività")
+st.caption("mu*: effetto medio assoluto sull'intero intervallo del parametro; sigma alto indica "
+           "non linearità o interazioni. S1/ST con pochi campioni possono uscire da [0, 1].")
+st.dataframe(df_kpi.sort_values(ordina_per, ascending=False).drop(columns="KPI"),
+             use_container_width=True, hide_index=True)
+if df_kpi["mu_star"].notna().any():
+    fig_m = go.Figure(go.Scatter(x=df_kpi["mu_star"], y=df_kpi["sigma"], mode="markers+text",
+                                 text=df_kpi["Parametro"], textposition="top center"))
+    fig_m.update_layout(title="Morris: mu* vs sigma", xaxis_title="mu*", yaxis_title="sigma")
+    st.plotly_chart(fig_m, use_container_width=True)
+
+with st.expander("Punti simulati"):
+    st.dataframe(risultato["df_campioni"], use_container_width=True)
@@ -0,0 +1,113 @@
+# pages/12_Archivio_Run.py
+
+import streamlit as st
+import plotly.express as px
+from lib.style import apply_custom_style
+from lib.jobs import TIPI_JOB
+from lib.job_panel import owner_corrente
+from lib.kpi import COLONNE_KPI
+from lib.archivio import get_archivio
+
+st.set_page_config(page_title="12. Archivio Run", layout="wide")
+apply_custom_style()
+
+if not st.session_state.get("logged_in"):
+    st.error("❌ Login richiesto"); st.stop()
+
+st.title("12. Archivio delle Run")
+st.markdown(
+    "Ogni scenario completato (simulazione, ripianificazione, what-if) viene archiviato con KPI, "
+    "fasi pianificate e log eventi: qui si interroga la storia tra run diverse."
+)
+
+archivio = get_archivio()
+
+# --- Selezione delle run ---
+col_f1, col_f2, col_f3 = st.columns(3)
+with col_f1:
+    tipi = st.multiselect("Tipi di run", ["simulazione", "ripianificazione", "whatif"],
+                          default=["simulazione", "ripianificazione", "whatif"])
+with col_f2:
+    ultime = st.number_input("Ultime run", min_value=2, value=30, step=5)
+with col_f3:
+    tutti_utenti = st.checkbox("Run di tutti gli utenti", value=False)
+
+df_runs = archivio.elenca(owner=None if tutti_utenti else owner_corrente(),
+                          tipi=[t for t in tipi if t in TIPI_JOB], limite=int(ultime))
+if df_runs.empty:
+    st.info("ℹ️ Nessuna run archiviata: esegui una simulazione (Pagina 3) o una ripianificazione (Pagina 6).")
+    st.stop()
+run_ids = df_runs["run_id"].tolist()
+df_runs["Run"] = df_runs["Creato"].dt.strftime("%d/%m %H:%M:%S") + " — " + df_runs["scenario"].fillna("")
+etichette = dict(zip(df_runs["run_id"], df_runs["Run"]))
+
+statistiche = archivio.statistiche()
+c1, c2, c3, c4 = st.columns(4)
+c1.metric("Run selezionate", len(df_runs))
+c2.metric("Run archiviate", statistiche["runs"])
+c3.metric("Eventi archiviati", f"{statistiche['eventi']:,}")
+c4.metric("Dimensione (MB)", f"{statistiche['mb']:.1f}")
+
+tab_trend, tab_lotto, tab_deriva, tab_eventi = st.tabs(
+    ["📈 Andamento KPI", "📦 Storia di un lotto", "🧭 Deriva", "📜 Log eventi"]
+)
+
+# --- Andamento dei KPI ---
+with tab_trend:
+    kpi = st.selectbox("KPI", COLONNE_KPI)
+    fig = px.line(df_runs.sort_values("Creato"), x="Creato", y=kpi, color="tipo", markers=True,
+                  hover_data=["scenario", "run_id"], title=f"{kpi} nelle ultime run")
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(df_runs[["Creato", "tipo", "scenario", "owner", "n_lotti"] + COLONNE_KPI + ["run_id"]],
+                 use_container_width=True, hide_index=True)
+
+# --- Storia di un lotto ---
+with tab_lotto:
+    id_lotto = st.text_input("ID lotto", placeholder="es. L123")
+    if id_lotto:
+        df_storia = archivio.storia_lotto(id_lotto, run_ids)
+        if df_storia.empty:
+            st.info(f"Il lotto {id_lotto} non compare nelle run selezionate.")
+        else:
+            df_storia["Run"] = df_storia["run_id"].map(etichette)
+            fig = px.timeline(df_storia, x_start="TimestampStart", x_end="TimestampEnd", y="Run", color="Fase",
+                              hover_data=["Macchina"], title=f"Lotto {id_lotto}: fasi pianificate per run")
+            fig.update_yaxes(categoryorder="array", categoryarray=[etichette[r] for r in reversed(run_ids)])
+            st.plotly_chart(fig, use_container_width=True)
+            fine = df_storia.groupby("Run", sort=False)[["TimestampEnd", "Scadenza"]].max().reset_index()
+            st.dataframe(fine.rename(columns={"TimestampEnd": "Fine lotto"}), use_container_width=True, hide_index=True)
+
+    st.markdown("**Spostamento della fine dei lotti tra la prima e l'ultima run selezionata**")
+    df_spost = archivio.spostamenti_lotti(run_ids)
+    if not df_spost.empty:
+        st.dataframe(df_spost.rename(columns=etichette), use_container_width=True)
+
+# --- Deriva delle durate ---
+with tab_deriva:
+    per = st.radio("Raggruppa per", ["Fase", "Macchina"], horizontal=True)
+    df_deriva = archivio.deriva(run_ids, per)
+    if not df_deriva.empty:
+        fig = px.line(df_deriva, x="Creato", y="Durata_media_min", color=per, markers=True,
+                      title=f"Durata media pianificata per {per.lower()} nelle run")
+        st.plotly_chart(fig, use_container_width=True)
+        st.dataframe(df_deriva.pivot_table(index=per, columns="Creato", values="Durata_media_min"),
+                     use_container_width=True)
+
+# --- Log eventi ---
+with tab_eventi:
+    run_sel = st.selectbox("Run", run_ids, format_func=etichette.get)
+    col_e1, col_e2, col_e3 = st.columns(3)
+    with col_e1:
+        filtro_lotto = st.text_input("Lotto", key="ev_lotto") or None
+    with col_e2:
+        filtro_fase = st.text_input("Fase", key="ev_fase") or None
+    with col_e3:
+        filtro_macchina = st.text_input("Macchina", key="ev_macchina") or None
+    st.dataframe(archivio.eventi(run_sel, filtro_lotto, filtro_fase, filtro_macchina),
+                 use_container_width=True, hide_index=True)
+    with st.expander("Configurazione della run"):
+        st.json(archivio.config(run_sel))
+    proprietario = df_runs.set_index("run_id").at[run_sel, "owner"]
+    if proprietario == owner_corrente() and st.button("🗑️ Elimina questa run dall'archivio"):
+        archivio.elimina([run_sel])
+        st.rerun()
@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 from lib.style import apply_custom_style
+from lib.datastore import get_data_store
 
 st.set_page_config(page_title="1. Caricamento Dati", layout="wide")
 apply_custom_style()
@@ -19,6 +20,10 @@ tabs = st.tabs([
     "Posticipi Autorizzati",
     "Posticipi Fisiologici",
     "Equivalenze",
+    "Cambi Formato (opzionale)",
+    "Competenze Operatori (opzionale)",
+    "Turni Personale (opzionale)",
+    "Distribuzioni Durate (opzionale)",
     "Caricamento Completo"
 ])
 
@@ -32,14 +37,17 @@ schema = {
         ("Addetti", "Numero operatori"),
         ("Pezzi", "Numero pezzi per ciclo"),
         ("EnergiaFase", "Consumo energia fase"),
-        ("Variabilità", "Fattore di variabilità")
+        ("Variabilità", "Fattore di variabilità"),
+        ("Predecessori", "(Facoltativo) fasi da completare prima, separate da virgola; "
+                         "se assente le fasi del prodotto sono in sequenza")
     ],
     "lotti": [
         ("Giorno", "Data produzione (yyyy-mm-dd)"),
         ("Lotto", "ID lotto"),
         ("Prodotto", "Codice prodotto"),
         ("Formato", "Formato confezione"),
-        ("Quantità", "Quantità da produrre")
+        ("Quantità", "Quantità da produrre"),
+        ("Scadenza", "(Facoltativo) data/ora di consegna; una data senza ora vale fino a fine giornata")
     ],
     "posticipi": [
         ("Lotto", "ID lotto"),
@@ -55,14 +63,45 @@ schema = {
     "equivalenze": [
         ("Formato", "Formato del prodotto"),
         ("Fase", "Nome fase"),
-        ("Equivalenza_Unita", "Fattore di equivalenza")
+        ("Equivalenza_Unita", "Fattore di equivalenza (nelle fasi a batch: carico del lotto)")
+    ],
+    "cambi_formato": [
+        ("Macchina", "Nome macchina"),
+        ("Da_Formato", "Formato lavorato prima del cambio"),
+        ("A_Formato", "Formato lavorato dopo il cambio"),
+        ("Tempo_Cambio", "Tempo di cambio formato in minuti")
+    ],
+    "competenze": [
+        ("Operatore", "Nome operatore o squadra"),
+        ("Macchina", "Macchina su cui è qualificato (vuoto = tutte)"),
+        ("Fase", "Fase su cui è qualificato (vuoto = tutte)"),
+        ("Numero", "(Facoltativo) persone della squadra, default 1"),
+        ("Gruppo", "(Facoltativo) gruppo di competenze per i report di utilizzo")
+    ],
+    "turni_personale": [
+        ("Giorno_Settimana", "Giorno ricorrente (0 = lunedì … 6 = domenica), oppure"),
+        ("Data", "Giorno specifico (es. festivo): sostituisce le righe ricorrenti di quel giorno"),
+        ("Ora_Inizio", "Inizio intervallo (hh:mm)"),
+        ("Ora_Fine", "Fine intervallo (hh:mm; se <= inizio termina il giorno dopo)"),
+        ("Operatori", "Operatori presenti nell'intervallo"),
+        ("Carrelli", "(Facoltativo) carrelli disponibili nell'intervallo"),
+        ("Roster", "(Facoltativo) nome del calendario, per confrontare turnazioni alternative")
+    ],
+    "distribuzioni_durate": [
+        ("Fase", "Nome fase"),
+        ("Formato", "Formato del prodotto ('*' = tutti)"),
+        ("Macchina", "Nome macchina ('*' = tutte)"),
+        ("Q000 … Q100", "Quantili (ogni 5%) del rapporto durata reale / teorica; "
+                        "la tabella si genera dal consultivo (Pagina 6)")
     ]
 }
 
 data_keys = ["fasi", "lotti", "posticipi", "posticipi_fisiologici", "equivalenze"]
+# Tabelle facoltative: se non caricate il simulatore usa il comportamento di base
+optional_keys = ["cambi_formato", "competenze", "turni_personale", "distribuzioni_durate"]
 
 # 1. Tab individuali
-for tab, key in zip(tabs[:-1], data_keys):
+for tab, key in zip(tabs[:-1], data_keys + optional_keys):
     with tab:
         st.subheader(f"Carica file “{key.replace('_', ' ').title()}”")
         st.markdown("**Struttura attesa:**")
@@ -74,14 +113,16 @@ for tab, key in zip(tabs[:-1], data_keys):
         if uploaded:
             df = pd.read_excel(uploaded)
             edited = st.data_editor(df, use_container_width=True, key=f"editor_{key}")
-            st.session_state[f"df_{key}"] = edited
+            # Tabelle identiche caricate da più sessioni condividono un'unica copia in memoria
+            st.session_state[f"df_{key}"] = get_data_store().condividi(edited, st.session_state, key)
 
 # 2. Tab Caricamento Completo
 with tabs[-1]:
     st.subheader("Caricamento Completo di tutti i file")
     st.markdown(
         "Carica tutti i file Excel insieme. I nomi devono contenere: "
-        "`fasi`, `lotti`, `posticipi_fisiologici`, `posticipi`, `equivalenze`."
+        "`fasi`, `lotti`, `posticipi_fisiologici`, `posticipi`, `equivalenze` "
+        "(facoltativi: `cambi_formato`, `competenze`, `turni_personale`, `distribuzioni_durate`)."
     )
     files = st.file_uploader(
         "Carica file multipli",
@@ -92,12 +133,12 @@ with tabs[-1]:
     if files:
         # ordiniamo le chiavi per lunghezza decrescente in modo 
         # che 'posticipi_fisiologici' venga riconosciuto prima di 'posticipi'
-        ordered_keys = sorted(data_keys, key=lambda k: -len(k))
+        ordered_keys = sorted(data_keys + optional_keys, key=lambda k: -len(k))
         for f in files:
             name = f.name.lower()
             for key in ordered_keys:
                 if key in name:
-                    df = pd.read_excel(f)
+                    df = get_data_store().condividi(pd.read_excel(f), st.session_state, key)
                     st.session_state[f"df_{key}"] = df
                     st.write(f"📄 **{key.replace('_', ' ').title()}**")
                     st.write(df.head())
@@ -4,6 +4,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, date, time
 from lib.style import apply_custom_style
+from lib.rccp import carico_capacita
 
 st.set_page_config(page_title="2. Configurazione Simulazione", layout="wide")
 apply_custom_style()
@@ -32,11 +33,31 @@ with col1:
         min_value=1, value=10, step=1,
         key="config_max_carrelli"
     )
+    with st.expander("Ciclo dei carrelli (rientro e lavaggio)"):
+        st.caption("A fine fase ogni carrello rientra e passa dal lavaggio prima di tornare "
+                   "disponibile; con tempi a 0 è subito libero.")
+        ritorno_carrelli = st.number_input("Tempo di rientro carrello (min)", min_value=0, value=0,
+                                           step=5, key="config_ritorno_carrelli")
+        lavaggio_carrelli = st.number_input("Tempo di lavaggio per carrello (min)", min_value=0, value=0,
+                                            step=5, key="config_lavaggio_carrelli")
+        stazioni_lavaggio = st.number_input("Stazioni di lavaggio (0 = senza coda)", min_value=0, value=1,
+                                            step=1, key="config_stazioni_lavaggio")
     max_personale = st.number_input(
         "Numero massimo operatori disponibili",
         min_value=1, value=5, step=1,
         key="config_max_personale"
     )
+    df_turni_personale = st.session_state.get("df_turni_personale")
+    roster = None
+    if df_turni_personale is not None:
+        st.caption("ℹ️ Calendario turni caricato: operatori (e carrelli, se indicati) seguono "
+                   "l'organico del calendario invece dei massimi qui sopra.")
+        if "Roster" in df_turni_personale.columns:
+            roster = st.selectbox("Roster", options=df_turni_personale["Roster"].unique().tolist(),
+                                  key="config_roster")
+    if st.session_state.get("df_competenze") is not None:
+        st.caption("ℹ️ Matrice competenze caricata: gli operatori sono assegnati per qualifica "
+                   "e il loro numero è quello della matrice.")
 with col2:
     st.markdown("**Capacità per macchine**")
     machines = df_fasi['Macchina'].unique().tolist()
@@ -91,16 +112,53 @@ with col5:
         "Includi ritardi fisiologici",
         value=False, key="config_includi_fisiologici"
     )
+    trattieni_macchina_posticipi = st.checkbox(
+        "Posticipi sulla macchina (altrimenti attesa senza risorse)",
+        value=False, key="config_trattieni_posticipi"
+    )
+    trattieni_macchina_fisiologici = st.checkbox(
+        "Ritardi fisiologici di inizio fase sulla macchina (altrimenti attesa senza risorse)",
+        value=False, key="config_trattieni_fisiologici"
+    )
     variability_factor = st.slider(
         "Fattore variabilità fasi (%)",
         min_value=0.0, max_value=100.0, value=0.0, step=1.0,
         key="config_variability"
     )
+    if st.session_state.get("df_distribuzioni_durate") is not None:
+        st.caption("ℹ️ Distribuzioni delle durate calibrate caricate: le fasi calibrate seguono la "
+                   "dispersione del consultivo, le altre il fattore di variabilità qui sopra.")
+    seed = st.number_input(
+        "Seme casuale (stesso seme = stesse estrazioni per lotto e fase tra scenari)",
+        min_value=0, value=0, step=1, key="config_seed"
+    )
     margin_pct = st.slider(
         "Margine tempo extra (%)",
         min_value=0.0, max_value=100.0, value=0.0, step=1.0,
         key="config_margin"
     )
+    campagne_formato = st.checkbox(
+        "Raggruppa i lotti per formato sulle macchine (campagne)",
+        value=False, key="config_campagne_formato",
+        help="Riduce i cambi formato: una macchina libera serve prima i lotti del formato appena lavorato."
+    )
+    pianificazione = st.selectbox(
+        "Pianificazione",
+        options=["avanti", "indietro"], index=0,
+        format_func=lambda v: {"avanti": "In avanti (dal giorno del lotto)",
+                               "indietro": "All'indietro (dalle scadenze)"}[v],
+        key="config_pianificazione",
+        help="All'indietro ogni lotto entra in produzione il più tardi possibile per rispettare "
+             "la colonna 'Scadenza' (con le code sulle macchine), poi le fasi procedono appena "
+             "possibile (lotti senza scadenza: in avanti)."
+    )
+    anticipo_rilascio = work_std
+    if pianificazione == "indietro":
+        anticipo_rilascio = st.number_input(
+            "Anticipo sul rilascio (minuti lavorativi)",
+            min_value=0, value=int(work_std), step=60, key="config_anticipo_rilascio",
+            help="Margine per le attese di operatori e carrelli, che il calcolo del rilascio non vede."
+        )
 with col6:
     granularity = st.selectbox(
         "Granularità risorse (minuti)",
@@ -118,6 +176,84 @@ with col6:
         key="config_filter_line"
     )
 
+# --- Buffer tra le fasi e limite WIP ---
+st.subheader("Buffer e WIP")
+st.caption("Capacità del buffer a valle di ogni fase (0 = illimitato). A buffer pieno il lotto "
+           "resta sulla macchina a monte, bloccandola.")
+col7, col8 = st.columns(2)
+with col7:
+    wip_max = st.number_input(
+        "Limite WIP (lotti in produzione, 0 = nessun limite)",
+        min_value=0, value=0, step=1, key="config_wip_max"
+    )
+    buffer_in_carrelli = st.checkbox(
+        "Capacità buffer in carrelli (invece che in lotti)",
+        value=False, key="config_buffer_in_carrelli"
+    )
+with col8:
+    buffer_fasi = {}
+    for fase in df_fasi['Fase'].unique().tolist():
+        cap_buffer = st.number_input(
+            f"Buffer dopo {fase}", min_value=0, value=0, step=1,
+            key=f"config_buffer_{fase}"
+        )
+        if cap_buffer > 0:
+            buffer_fasi[fase] = cap_buffer
+
+# --- Lotti di trasferimento ---
+st.subheader("Lotti di Trasferimento")
+st.caption("Pezzi per lotto di trasferimento in uscita da ogni fase (0 = lotto intero): ogni "
+           "porzione completata passa subito alle fasi successive, che iniziano alla prima porzione e "
+           "lavorano il lotto sulla stessa macchina al ritmo dei pezzi in arrivo. Fasi a batch, aree e "
+           "fasi a tempo fisso attendono il lotto intero.")
+lotti_trasferimento = {}
+colonne_trasf = st.columns(3)
+for i, fase in enumerate(df_fasi['Fase'].unique().tolist()):
+    dim = colonne_trasf[i % 3].number_input(
+        f"Trasferimento da {fase} (pezzi)", min_value=0, value=0, step=50,
+        key=f"config_trasferimento_{fase}"
+    )
+    if dim > 0:
+        lotti_trasferimento[fase] = dim
+
+# --- Fasi a batch (es. autoclavi) ---
+st.subheader("Fasi a Batch")
+st.caption("Più lotti compatibili (stessa macchina e tempo di ciclo) lavorati in un unico ciclo. "
+           "Il carico di un lotto è la sua Equivalenza_Unita per la fase (default 1).")
+fasi_batch = {}
+for fase in st.multiselect(
+    "Fasi lavorate a batch",
+    options=df_fasi['Fase'].unique().tolist(),
+    default=[f for f in ["AUTOCLAVI"] if f in df_fasi['Fase'].values],
+    key="config_fasi_batch"
+):
+    c1, c2, c3 = st.columns(3)
+    capacita = c1.number_input(f"{fase}: capacità (unità di carico)", min_value=0.0, value=1.0,
+                               step=0.5, key=f"config_batch_cap_{fase}")
+    attesa_max = c2.number_input(f"{fase}: attesa massima riempimento (min)", min_value=0, value=60,
+                                 step=15, key=f"config_batch_attesa_{fase}")
+    per_formato = c3.checkbox(f"{fase}: solo lotti dello stesso formato", value=False,
+                              key=f"config_batch_formato_{fase}")
+    fasi_batch[fase] = {"capacita": capacita, "attesa_max": attesa_max, "per_formato": per_formato}
+
+# --- Aree passive (es. celle di raffreddamento) ---
+st.subheader("Aree di Raffreddamento e Riposo")
+st.caption("Il lotto sosta nell'area per il Tempo della fase (per prodotto), senza macchina né "
+           "operatori. Ad area piena il lotto resta sulla macchina a monte, bloccandola.")
+aree = {}
+for fase in st.multiselect(
+    "Fasi svolte in un'area",
+    options=df_fasi['Fase'].unique().tolist(),
+    default=[f for f in ["RAFFREDDAMENTO"] if f in df_fasi['Fase'].values],
+    key="config_aree"
+):
+    c1, c2 = st.columns(2)
+    capacita_area = c1.number_input(f"{fase}: capacità area", min_value=1, value=4, step=1,
+                                    key=f"config_area_cap_{fase}")
+    in_carrelli = c2.checkbox(f"{fase}: capacità in carrelli (invece che in lotti)", value=False,
+                              key=f"config_area_carrelli_{fase}")
+    aree[fase] = {"capacita": capacita_area, "in_carrelli": in_carrelli}
+
 # --- Data e ora di inizio ---
 st.subheader("Data e Ora di Inizio")
 override = st.checkbox(
@@ -147,6 +283,9 @@ else:
 config = {
     "max_carrelli": max_carrelli,
     "max_personale": max_personale,
+    "ritorno_carrelli": ritorno_carrelli,
+    "lavaggio_carrelli": lavaggio_carrelli,
+    "stazioni_lavaggio": stazioni_lavaggio,
     "machine_caps": machine_caps,
     "work_std": work_std,
     "work_ven": work_ven,
@@ -155,14 +294,49 @@ config = {
     "fri38": fri38,
     "includi_posticipi": includi_posticipi,
     "includi_fisiologici": includi_fisiologici,
+    "trattieni_macchina_posticipi": trattieni_macchina_posticipi,
+    "trattieni_macchina_fisiologici": trattieni_macchina_fisiologici,
     "variability_factor": variability_factor / 100.0,
+    "seed": seed,
     "margin_pct": margin_pct / 100.0,
+    "campagne_formato": campagne_formato,
+    "pianificazione": pianificazione,
+    "anticipo_rilascio": anticipo_rilascio,
+    "buffer_fasi": buffer_fasi,
+    "buffer_in_carrelli": buffer_in_carrelli,
+    "wip_max": wip_max,
+    "roster": roster,
+    "fasi_batch": fasi_batch,
+    "lotti_trasferimento": lotti_trasferimento,
+    "aree": aree,
     "granularity": granularity,
     "filter_format": filter_format,
     "filter_line": filter_line,
     "data_inizio": data_inizio
 }
 
+# --- Verifica di capacità di massima (ricalcolata a ogni modifica) ---
+st.subheader("Verifica Capacità (RCCP)")
+frequenza_rccp = st.radio("Periodo", options=["D", "W"], horizontal=True, key="config_rccp_periodo",
+                          format_func=lambda f: {"D": "Giorno", "W": "Settimana"}[f])
+# Con un calendario turni la capacità di operatori e carrelli è l'organico del roster scelto
+df_rccp = carico_capacita(df_lotti, df_fasi, config, st.session_state.get("df_equivalenze"), frequenza_rccp,
+                          st.session_state.get("df_turni_personale"))
+sovraccarichi = df_rccp[df_rccp["Sovraccarico"]]
+if sovraccarichi.empty:
+    st.success("✅ Nessun periodo sovraccarico rispetto alla capacità dei turni.")
+else:
+    st.warning(f"⚠️ {len(sovraccarichi)} periodi/risorse sovraccarichi: la simulazione accumulerà ritardi.")
+    st.dataframe(sovraccarichi.style.format({"Utilizzo": "{:.0%}", "Carico_min": "{:.0f}",
+                                              "Capacita_min": "{:.0f}"}),
+                 use_container_width=True)
+with st.expander("Utilizzo per periodo e risorsa"):
+    st.dataframe(
+        df_rccp.pivot_table(index="Risorsa", columns="Periodo", values="Utilizzo")
+        .style.format("{:.0%}").background_gradient(cmap="RdYlGn_r", vmin=0, vmax=1.2),
+        use_container_width=True
+    )
+
 # Inizializza lista scenari
 if "scenari" not in st.session_state:
     st.session_state["scenari"] = []
@@ -1,7 +1,9 @@
 import streamlit as st
 import pandas as pd
 from lib.style import apply_custom_style
-from lib.simulator import esegui_simulazione
+from lib.jobs import get_job_manager, raccogli_input
+from lib.parallel import esegui_per_linea
+from lib.job_panel import owner_corrente, selettore_job, mostra_job, risultati_parziali, risultato_job
 
 st.set_page_config(page_title="3. Esecuzione Simulazione", layout="wide")
 apply_custom_style()
@@ -17,28 +19,58 @@ if any(k not in st.session_state for k in req):
 
 st.title("3. Esecuzione di Tutti gli Scenari")
 
+# La simulazione gira come job in background: cambiare pagina o interagire
+# con i widget non la interrompe né la ripete.
+job_id = selettore_job("simulazione", "job_simulazione")
+
+# Piani d'impianto: una linea per processo, con operatori e carrelli ripartiti tra le linee
+per_linea = False
+if "Linea" in st.session_state["df_lotti"].columns:
+    per_linea = st.checkbox(
+        "Simulazione parallela per linea",
+        value=False, key="esecuzione_per_linea",
+        help="Le linee condividono solo operatori e carrelli: ogni linea è simulata in un processo "
+             "con una quota dei due pool, aggiustata per iterazioni verso la linea più lenta. "
+             "Non compatibile con matrice competenze e calendario turni."
+    )
+
 if st.button("🚀 Avvia tutti gli scenari"):
-    results = {}
-    for idx, cfg in enumerate(st.session_state["scenari"], start=1):
-        df_ris, df_pers, df_eng, df_car = esegui_simulazione(
-            st.session_state["df_lotti"],
-            st.session_state["df_fasi"],
-            st.session_state["df_posticipi"],
-            st.session_state["df_equivalenze"],
-            st.session_state["df_posticipi_fisiologici"],
-            cfg
+    payload = {
+        "input": raccogli_input(st.session_state),
+        "scenari": {f"Scenario {idx}": cfg
+                    for idx, cfg in enumerate(st.session_state["scenari"], start=1)},
+    }
+    try:
+        job_id = get_job_manager().invia(
+            "simulazione", owner_corrente(), payload,
+            descrizione=f"{len(payload['scenari'])} scenari" + (" per linea" if per_linea else ""),
+            **({"funzione": esegui_per_linea} if per_linea else {})
         )
-        results[f"Scenario {idx}"] = {
-            "df_risultati": df_ris,
-            "df_persone": df_pers,
-            "df_energia": df_eng,
-            "df_carrelli": df_car
-        }
-    st.session_state["risultati_scenari"] = results
-    st.success("✅ Tutti gli scenari sono stati simulati!")
+        st.session_state["job_simulazione"] = job_id
+    except RuntimeError as e:
+        st.error(f"❌ {e}")
+
+if job_id:
+    info = mostra_job(job_id)
+    if info and info["stato"] == "completato":
+        if st.session_state.get("job_risultati_caricati") != job_id:
+            st.session_state["risultati_scenari"] = risultato_job(job_id)
+            st.session_state["job_risultati_caricati"] = job_id
+        st.success("✅ Tutti gli scenari sono stati simulati! Vai alla Pagina 4.")
+        for nome, res in st.session_state["risultati_scenari"].items():
+            if "df_allocazione" in res:
+                st.markdown(f"**Ripartizione di operatori e carrelli per linea — {nome}**")
+                st.dataframe(res["df_allocazione"], use_container_width=True)
+    elif info and info["stato"] == "in_esecuzione":
+        parziale = risultati_parziali(job_id)
+        if parziale:
+            if parziale["completati"]:
+                st.markdown(f"**Scenari completati:** {', '.join(parziale['completati'])}")
+            if parziale["in_corso"] is not None:
+                nome, df_parz = parziale["in_corso"]
+                st.markdown(f"**Fasi già pianificate — {nome}**")
+                st.dataframe(df_parz.tail(20), use_container_width=True)
 
 # Se già simulato, avvisa
 elif "risultati_scenari" in st.session_state:
     st.info("ℹ️ Risultati scenari già disponibili. Vai alla Pagina 4.")
-
-
@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from lib.style import apply_custom_style
+from lib.kpi import utilizzo_gruppi, puntualita_lotti, utilizzo_carrelli, POOL_CARRELLI
 
 st.set_page_config(page_title="4. Analisi Risultati", layout="wide")
 apply_custom_style()
@@ -54,7 +55,9 @@ st.subheader("Serie Temporali: Risorse")
 col1, col2, col3 = st.columns(3)
 with col1:
     st.markdown("**Operatori occupati**")
-    fig_p = px.line(df_pers, x="timestamp", y="Persone_occupate")
+    # Con un calendario turni si confronta l'occupazione con l'organico presente
+    fig_p = px.line(df_pers, x="timestamp",
+                    y=["Persone_occupate", "Organico"] if "Organico" in df_pers.columns else "Persone_occupate")
     st.plotly_chart(fig_p, use_container_width=True)
 with col2:
     st.markdown("**Energia consumata**")
@@ -62,9 +65,45 @@ with col2:
     st.plotly_chart(fig_e, use_container_width=True)
 with col3:
     st.markdown("**Carrelli occupati**")
-    fig_c = px.line(df_car, x="timestamp", y="Carrelli_occupati")
+    # Con il ciclo di rientro e lavaggio: un'area per pool della flotta
+    pool_car = [c for c in POOL_CARRELLI if c in df_car.columns]
+    fig_c = px.area(df_car, x="timestamp", y=pool_car) if len(pool_car) > 1 else \
+        px.line(df_car, x="timestamp", y="Carrelli_occupati")
     st.plotly_chart(fig_c, use_container_width=True)
 
+if "Carrelli_lavaggio" in df_car.columns:
+    st.subheader("Utilizzo della Flotta Carrelli")
+    # Flotta dello scenario (pagina 3: "Scenario <n>" è l'n-esimo scenario della pagina 2)
+    cfg_sel = {f"Scenario {i}": c for i, c in enumerate(st.session_state.get("scenari", []), start=1)}.get(sel, {})
+    flotta = cfg_sel.get("max_carrelli", df_car[pool_car].sum(axis=1).max())
+    st.dataframe(utilizzo_carrelli(df_car, flotta).style.format({"Media": "{:.1f}", "Utilizzo": "{:.0%}"}),
+                 use_container_width=True)
+
+# WIP, buffer tra le fasi e aree di sosta (solo per simulazioni con buffer/WIP/aree, vedi Pagina 2)
+if "df_buffer" in res and not res["df_buffer"].empty:
+    df_buf = res["df_buffer"]
+    st.markdown("**WIP e occupazione di buffer e aree**")
+    fig_b = px.line(df_buf, x="timestamp", y=[c for c in df_buf.columns if c != "timestamp"])
+    st.plotly_chart(fig_b, use_container_width=True)
+
+# Utilizzo per gruppo di competenze (solo con matrice competenze, vedi Pagina 1)
+if st.session_state.get("df_competenze") is not None:
+    st.subheader("Utilizzo per Gruppo di Competenze")
+    df_util = utilizzo_gruppi(df_pers, st.session_state["df_competenze"])
+    st.dataframe(df_util.style.format({"Utilizzo": "{:.0%}"}), use_container_width=True)
+    fig_u = px.bar(df_util, x="Gruppo", y="Utilizzo", text_auto=".0%",
+                   title="Utilizzo medio durante i turni attivi")
+    st.plotly_chart(fig_u, use_container_width=True)
+
+# Puntualità rispetto alle scadenze (solo se i lotti hanno la colonna 'Scadenza')
+if "Scadenza" in df_ris.columns:
+    st.subheader("Puntualità sulle Scadenze")
+    df_punt = puntualita_lotti(df_ris)
+    c1, c2 = st.columns(2)
+    c1.metric("⏰ Lotti in ritardo", f"{int((df_punt['Ritardo_min'] > 0).sum())} / {len(df_punt)}")
+    c2.metric("⌛ Ritardo totale (ore)", f"{df_punt['Ritardo_min'].sum() / 60:.1f}")
+    st.dataframe(df_punt, use_container_width=True)
+
 # 3) Durata totale per lotto (Bar Chart)
 st.subheader("Durata Totale di Produzione per Lotto")
 df_dur = df_ris.copy()
@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from lib.style import apply_custom_style
+from lib.kpi import calcola_kpi, COLONNE_KPI
 
 st.set_page_config(page_title="5. Confronto Scenari", layout="wide")
 apply_custom_style()
@@ -34,6 +35,23 @@ for name, data in results.items():
 df_summary = pd.DataFrame(summary)
 st.dataframe(df_summary.set_index("Scenario"))
 
+# Confronto appaiato: differenze dei KPI rispetto a uno scenario di riferimento. Con lo stesso
+# seme ogni (lotto, fase) ha le stesse estrazioni casuali in tutti gli scenari, quindi le
+# differenze dipendono solo dalla configurazione (numeri casuali comuni)
+st.subheader("Confronto Appaiato dei KPI")
+config_scenari = {f"Scenario {i}": c for i, c in enumerate(st.session_state.get("scenari", []), start=1)}
+base = st.selectbox("Scenario di riferimento", scenario_names)
+kpi_scenari = pd.DataFrame({
+    name: calcola_kpi(data["df_risultati"], data["df_persone"], data["df_energia"], data["df_carrelli"],
+                      config_scenari.get(name, {}))
+    for name, data in results.items()
+}).T[COLONNE_KPI]
+df_delta = kpi_scenari - kpi_scenari.loc[base]
+semi = {name: config_scenari.get(name, {}).get("seed", 0) for name in scenario_names}
+if len(set(semi.values())) > 1:
+    st.warning("⚠️ Gli scenari usano semi diversi: le differenze includono anche il rumore delle estrazioni.")
+st.dataframe(df_delta.style.format("{:+.1f}"), use_container_width=True)
+
 # Selezione metriche da confrontare
 st.subheader("Grafici di Confronto")
 col1, col2 = st.columns(2)
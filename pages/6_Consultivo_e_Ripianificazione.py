@@ -5,7 +5,10 @@ import pandas as pd
 import plotly.express as px
 from datetime import datetime, timedelta
 from lib.style import apply_custom_style
-from lib.simulator import esegui_simulazione
+from lib.jobs import get_job_manager, raccogli_input
+from lib.simulator import stato_da_consultivo
+from lib.calibrazione import rapporti_durata, scarta_anomali, calibra_durate
+from lib.job_panel import owner_corrente, selettore_job, mostra_job, risultato_job
 
 st.set_page_config(page_title="6. Consultivo & Ripianificazione", layout="wide")
 apply_custom_style()
@@ -45,6 +48,7 @@ check_theory()
 sce_list = list(st.session_state["risultati_scenari"].keys())
 sel = st.selectbox("Scenario teorico da confrontare", sce_list)
 res = st.session_state["risultati_scenari"][sel]
+cfg = st.session_state['scenari'][sce_list.index(sel)]
 
 df_theory = res["df_risultati"].copy()
 df_pers = res["df_persone"]
@@ -108,25 +112,103 @@ fig_gant = px.timeline(
 fig_gant.update_yaxes(autorange='reversed')
 st.plotly_chart(fig_gant, use_container_width=True)
 
+# 5.1) Calibrazione delle durate: distribuzioni reale/teorico per (Fase, Formato, Macchina)
+st.subheader("Calibrazione delle Durate dal Consultivo")
+st.markdown(
+    "Dal rapporto durata reale / teorica delle fasi concluse si ricavano le distribuzioni empiriche "
+    "per (Fase, Formato, Macchina), con ripiego su (Fase, Formato) e Fase per i gruppi con pochi "
+    "campioni. Le simulazioni estraggono le durate da queste distribuzioni invece che dalla "
+    "variabilità uniforme."
+)
+col_c1, col_c2 = st.columns(2)
+with col_c1:
+    min_campioni = st.number_input("Campioni minimi per gruppo", min_value=2, value=20, step=5)
+with col_c2:
+    soglia_outlier = st.number_input("Soglia anomali (z robusto)", min_value=1.0, value=3.5, step=0.5)
+try:
+    # Durate reali in minuti lavorativi sul calendario turni dello scenario confrontato
+    df_rapporti = rapporti_durata(df_cons, st.session_state['df_lotti'], st.session_state['df_fasi'], cfg)
+except (KeyError, ValueError) as e:
+    st.error(f"❌ Calibrazione non possibile: {e}")
+    df_rapporti = None
+if df_rapporti is not None:
+    tenuti = scarta_anomali(df_rapporti, soglia_outlier)
+    df_distr = calibra_durate(df_rapporti, int(min_campioni), soglia_outlier)
+    st.caption(f"{len(df_rapporti):,} fasi concluse, {int((~tenuti).sum()):,} rapporti anomali scartati, "
+               f"{len(df_distr)} distribuzioni calibrate.")
+    if df_distr.empty:
+        st.info(f"ℹ️ Nessun gruppo con almeno {int(min_campioni)} fasi concluse.")
+    else:
+        fig_cal = px.box(
+            df_rapporti[tenuti], x='Fase', y='Rapporto', color='Formato',
+            title='Rapporto durata reale / teorica per fase (anomali esclusi)'
+        )
+        fig_cal.add_hline(y=1.0, line_dash='dash')
+        st.plotly_chart(fig_cal, use_container_width=True)
+        st.dataframe(df_distr, use_container_width=True, hide_index=True)
+        col_d1, col_d2 = st.columns(2)
+        col_d1.download_button(
+            "📥 Scarica distribuzioni (CSV)", df_distr.to_csv(index=False).encode('utf-8'),
+            file_name="distribuzioni_durate.csv", mime="text/csv"
+        )
+        if col_d2.button("✅ Usa nelle simulazioni"):
+            st.session_state['df_distribuzioni_durate'] = df_distr
+            st.success("Distribuzioni calibrate attive per le prossime simulazioni e ripianificazioni.")
+
 # 6) Ripianificazione con soglia delta
 st.subheader("Ri-pianificazione in base al Delta")
+# Avvio a caldo: si simula solo il percorso residuo dei lotti, dallo stato del consultivo
+avvio_caldo = st.checkbox(
+    "Avvio a caldo dallo stato attuale (lotti in corso alla fase raggiunta, con il lavoro residuo)",
+    value=False
+)
+df_stato = None
+if avvio_caldo:
+    ultimo_rilievo = pd.concat([df_cons['Start_Actual'], df_cons['End_Actual']]).max()
+    c1, c2 = st.columns(2)
+    data_stato = c1.date_input("Data dello stato", value=ultimo_rilievo.date())
+    ora_stato = c2.time_input("Ora dello stato", value=ultimo_rilievo.time())
+    # Minuti svolti delle fasi in corso sul calendario turni dello scenario
+    df_stato = stato_da_consultivo(df_cons, datetime.combine(data_stato, ora_stato), cfg)
+    st.caption(f"{int(df_stato['Completata'].sum())} fasi completate e "
+               f"{int((~df_stato['Completata']).sum())} in corso all'istante dello stato.")
+    with st.expander("Stato iniziale"):
+        st.dataframe(df_stato, use_container_width=True)
+
 # seleziona solo le fasi con Delta > soglia
 to_replan = df_cmp[df_cmp['Delta'].abs() > threshold]
-if to_replan.empty:
+if to_replan.empty and not avvio_caldo:
     st.success("✅ Nessuna fase supera la soglia: nessuna ripianificazione necessaria.")
 else:
-    st.write(f"⚠️ {len(to_replan)} fasi superano la soglia: procedo a ri-pianificare")
-    # crea df_lotti filtrato solo per lotti con scostamenti
-    lots_to = to_replan['ID_Lotto'].unique().tolist()
     df_lotti0 = st.session_state['df_lotti'].copy()
-    df_lotti0 = df_lotti0[df_lotti0['Lotto'].isin(lots_to)]
+    if avvio_caldo:
+        # Tutti i lotti: quelli completati non hanno fasi residue
+        lots_to = df_lotti0['Lotto'].unique().tolist()
+        st.write(f"🔄 Ripianificazione a caldo di {len(lots_to)} lotti")
+    else:
+        st.write(f"⚠️ {len(to_replan)} fasi superano la soglia: procedo a ri-pianificare")
+        # crea df_lotti filtrato solo per lotti con scostamenti
+        lots_to = to_replan['ID_Lotto'].unique().tolist()
+        df_lotti0 = df_lotti0[df_lotti0['Lotto'].isin(lots_to)]
     df_lotti0['DifferenzaTempo'] = 0
-    cfg = st.session_state['scenari'][sce_list.index(sel)]
-    df_r2, df_p2, df_e2, df_c2 = esegui_simulazione(
-        df_lotti0, st.session_state['df_fasi'],
-        st.session_state['df_posticipi'], st.session_state['df_equivalenze'],
-        st.session_state['df_posticipi_fisiologici'], cfg
-    )
-    st.success("🔄 Simulazione ri-pianificata completata per i lotti interessati.")
-    st.dataframe(df_r2)
-
+    # La ripianificazione gira come job in background (vedi lib/jobs.py)
+    job_id = selettore_job("ripianificazione", "job_ripianificazione")
+    if st.button("🔄 Avvia ripianificazione"):
+        payload = {
+            "input": {**raccogli_input(st.session_state), "df_lotti": df_lotti0, "df_stato_iniziale": df_stato},
+            "scenari": {f"Ripianificazione {sel}": cfg},
+        }
+        try:
+            job_id = get_job_manager().invia(
+                "ripianificazione", owner_corrente(), payload,
+                descrizione=f"{sel} — {len(lots_to)} lotti"
+            )
+            st.session_state["job_ripianificazione"] = job_id
+        except RuntimeError as e:
+            st.error(f"❌ {e}")
+    if job_id:
+        info = mostra_job(job_id)
+        if info and info["stato"] == "completato":
+            df_r2 = next(iter(risultato_job(job_id).values()))["df_risultati"]
+            st.success("🔄 Simulazione ri-pianificata completata per i lotti interessati.")
+            st.dataframe(df_r2)
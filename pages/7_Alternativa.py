@@ -5,7 +5,9 @@ import numpy as np
 import io
 from datetime import datetime, timedelta, date, time
 from lib.style import apply_custom_style
-from lib.simulator import esegui_simulazione
+from lib.jobs import get_job_manager, raccogli_input, STATI_ATTIVI
+from lib.job_panel import owner_corrente, selettore_job, mostra_job, risultato_job
+from lib.surrogate import chiave_dati, chiave_campioni, modello_per, valuta_e_registra, MIN_CAMPIONI
 
 st.set_page_config(page_title="7. Analisi Avanzata & What-If", layout="wide")
 apply_custom_style()
@@ -128,20 +130,105 @@ st.plotly_chart(fig_heat, use_container_width=True)
 st.subheader("What-If Scheduling per Lotti Critici")
 if n_crit.sum() > 0:
     st.markdown("### Parametri What-If")
-    w_max_pers = st.slider("Nuovo max operatori", 1, 20, value=st.session_state['config_simulazione']['max_personale'])
-    w_max_car = st.slider("Nuovo max carrelli", 1, 20, value=st.session_state['config_simulazione']['max_carrelli'])
+    # Config di partenza: quella dello scenario teorico selezionato
+    cfg_base = st.session_state['scenari'][sce_keys.index(sel_scenario)]
+    w_max_pers = st.slider("Nuovo max operatori", 1, 20, value=min(int(cfg_base['max_personale']), 20))
+    w_max_car = st.slider("Nuovo max carrelli", 1, 20, value=min(int(cfg_base['max_carrelli']), 20))
     # aggiorna config copia
-    cfg_new = st.session_state['config_simulazione'].copy()
+    cfg_new = cfg_base.copy()
     cfg_new['max_personale'] = w_max_pers
     cfg_new['max_carrelli'] = w_max_car
+
+    # Stima istantanea dei KPI del piano completo con il modello surrogato (lib/surrogate.py).
+    # Fuori confidenza si lancia la simulazione reale, che diventa un nuovo campione.
+    st.markdown("#### Stima istantanea (piano completo)")
+    inputs_sim = raccogli_input(st.session_state)
+    firma_input = tuple(id(df) for df in inputs_sim.values())
+    if st.session_state.get("surrogato_firma") != firma_input:
+        st.session_state["surrogato_firma"] = firma_input
+        st.session_state["surrogato_chiave"] = chiave_dati(inputs_sim)
+    # Il modello è addestrato dai job che registrano i campioni: qui si carica soltanto
+    modello = modello_per(chiave_campioni(st.session_state["surrogato_chiave"], cfg_new))
+    affidabile = False
+    if modello is None:
+        st.info(f"ℹ️ Surrogato non ancora disponibile: servono almeno {MIN_CAMPIONI} simulazioni "
+                "su questi dati con le stesse impostazioni dello scenario (esegui uno sweep nella Pagina 8).")
+    else:
+        stime, affidabile = modello.predici(cfg_new)
+        etichette = {'makespan_min': "⏱️ Makespan (min)", 'lead_time_medio_min': "📦 Lead time medio (min)",
+                     'ritardo_totale_min': "⏰ Ritardo totale (min)",
+                     'picco_persone': "👷 Picco operatori", 'picco_carrelli': "🛒 Picco carrelli"}
+        # Il ritardo è stimato solo con le scadenze dei lotti (colonna 'Scadenza')
+        etichette = {kpi: etichetta for kpi, etichetta in etichette.items() if kpi in stime}
+        cols_s = st.columns(len(etichette))
+        for col_s, (kpi, etichetta) in zip(cols_s, etichette.items()):
+            basso, stima, alto = stime[kpi]
+            col_s.metric(etichetta, f"{stima:.0f}", help=f"Intervallo 10-90%: {basso:.0f} – {alto:.0f}")
+        st.caption(f"Modello addestrato su {modello.n_campioni} simulazioni.")
+    if not affidabile:
+        # Simulazione reale del piano completo: automatica solo con un modello fuori confidenza,
+        # su richiesta se il modello non c'è. Una verifica alla volta: quella lanciata per una
+        # posizione precedente degli slider si annulla prima di avviarne un'altra.
+        chiave_cfg = (st.session_state["surrogato_chiave"], w_max_pers, w_max_car, sel_scenario)
+        verifiche = st.session_state.setdefault("surrogato_verifiche", {}) # config -> job
+        rifiutate = st.session_state.setdefault("surrogato_rifiutate", set()) # config senza slot per il job
+        attiva = st.session_state.get("surrogato_verifica_attiva")
+        info_attiva = get_job_manager().stato(attiva, owner_corrente()) if attiva else None
+        if chiave_cfg not in verifiche and info_attiva is not None and info_attiva["stato"] in STATI_ATTIVI:
+            get_job_manager().annulla(attiva, owner_corrente())
+            for chiave in [k for k, v in verifiche.items() if v == attiva]:
+                del verifiche[chiave]
+            st.info("⏳ Annullo la simulazione reale della configurazione precedente...")
+            mostra_job(attiva) # si ricarica quando il job si ferma
+        elif chiave_cfg not in verifiche:
+            if modello is not None and chiave_cfg not in rifiutate:
+                st.warning("⚠️ Stima fuori confidenza: avvio la simulazione reale del piano completo.")
+                avvia = True
+            else:
+                avvia = st.button("▶️ Simula il piano completo", key="surrogato_simula")
+            if avvia:
+                try:
+                    verifiche[chiave_cfg] = get_job_manager().invia(
+                        "verifica_surrogato", owner_corrente(), {"input": inputs_sim, "config": cfg_new},
+                        descrizione=f"Piano completo: {w_max_pers} operatori, {w_max_car} carrelli",
+                        funzione=valuta_e_registra
+                    )
+                    st.session_state["surrogato_verifica_attiva"] = verifiche[chiave_cfg]
+                    rifiutate.discard(chiave_cfg)
+                except RuntimeError as e:
+                    rifiutate.add(chiave_cfg)
+                    st.warning(f"⚠️ Simulazione reale non avviata: {e} Riprova quando un job termina.")
+        if chiave_cfg in verifiche:
+            info_v = mostra_job(verifiche[chiave_cfg])
+            if info_v and info_v["stato"] == "completato":
+                kpi_reali = risultato_job(verifiche[chiave_cfg])
+                ritardo = kpi_reali.get('ritardo_totale_min', np.nan)
+                st.success(f"✅ Simulazione reale: makespan {kpi_reali['makespan_min']:.0f} min, "
+                           + (f"ritardo totale {ritardo:.0f} min, " if pd.notna(ritardo) else "")
+                           + f"picco operatori {kpi_reali['picco_persone']:.0f}, "
+                           f"picco carrelli {kpi_reali['picco_carrelli']:.0f}")
+
+    # Il what-if gira come job in background (vedi lib/jobs.py)
+    job_id = selettore_job("whatif", "job_whatif")
     if st.button("🔄 Esegui What-If per lotti critici"):
         lots_to = df_cmp.loc[n_crit, 'ID_Lotto'].unique().tolist()
         df_lotti0 = st.session_state['df_lotti'].loc[ st.session_state['df_lotti']['Lotto'].isin(lots_to) ].copy()
         df_lotti0['DifferenzaTempo'] = 0
-        df_rw, df_pw, df_ew, df_cw = esegui_simulazione(
-            df_lotti0, st.session_state['df_fasi'], st.session_state['df_posticipi'],
-            st.session_state['df_equivalenze'], st.session_state['df_posticipi_fisiologici'], cfg_new
-        )
+        payload = {
+            "input": {**raccogli_input(st.session_state), "df_lotti": df_lotti0},
+            "scenari": {"What-If": cfg_new},
+        }
+        try:
+            job_id = get_job_manager().invia(
+                "whatif", owner_corrente(), payload,
+                descrizione=f"{w_max_pers} operatori, {w_max_car} carrelli — {len(lots_to)} lotti"
+            )
+            st.session_state["job_whatif"] = job_id
+        except RuntimeError as e:
+            st.error(f"❌ {e}")
+    info = mostra_job(job_id) if job_id else None
+    if info and info["stato"] == "completato":
+        df_rw = next(iter(risultato_job(job_id).values()))["df_risultati"].copy()
         st.success("✅ What-If completato")
         # mostra Gantt semplificato
         df_rw['Start_dt'] = start_time + pd.to_timedelta(df_rw['Start'], unit='m')
@@ -0,0 +1,162 @@
+# pages/8_Sweep_Scenari.py
+
+import streamlit as st
+import plotly.express as px
+from lib.style import apply_custom_style
+from lib.jobs import get_job_manager, raccogli_input
+from lib.job_panel import owner_corrente, selettore_job, mostra_job, risultato_job, risultati_parziali
+from lib.kpi import COLONNE_KPI
+from lib.sweep import (ParametroSweep, applica_punto, valore_config, parametri_scenario, DISEGNI,
+                       PREFISSO_MACCHINA, PREFISSO_BUFFER)
+from lib.surrogate import esegui_sweep_e_registra
+
+st.set_page_config(page_title="8. Sweep Scenari", layout="wide")
+apply_custom_style()
+
+if not st.session_state.get("logged_in"):
+    st.error("❌ Login richiesto"); st.stop()
+
+req = ["df_lotti","df_fasi","df_posticipi","df_posticipi_fisiologici","df_equivalenze","scenari"]
+if any(k not in st.session_state for k in req) or not st.session_state["scenari"]:
+    st.warning("⚠️ Carica i dati (Pagina 1) e salva almeno uno scenario di base (Pagina 2).")
+    st.stop()
+
+st.title("8. Sweep di Scenari e Fronte di Pareto")
+
+# --- Scenario di base ---
+idx_base = st.selectbox(
+    "Scenario di base", range(len(st.session_state["scenari"])),
+    format_func=lambda i: f"Scenario {i + 1}"
+)
+config_base = st.session_state["scenari"][idx_base]
+
+# --- Intervalli dei parametri ---
+st.subheader("Parametri da esplorare")
+# Intervalli predefiniti (minimo, valore di default) dei parametri scalari
+INTERVALLI = {
+    "max_personale": (1, 5),
+    "max_carrelli": (1, 10),
+    "work_std": (60, 960),
+    "extension": (0, 0),
+}
+df_turni_personale = st.session_state.get("df_turni_personale")
+parametri_sc, esclusi = parametri_scenario(config_base, st.session_state["df_fasi"], df_turni_personale)
+candidati = {}
+for nome, etichetta in parametri_sc.items():
+    if nome.startswith((PREFISSO_MACCHINA, PREFISSO_BUFFER)):
+        candidati[nome] = (etichetta, 1, 1)
+    elif nome == "roster":
+        roster_min = int(df_turni_personale["Roster"].min())
+        candidati[nome] = (etichetta, roster_min, roster_min)
+    elif nome in INTERVALLI:
+        candidati[nome] = (etichetta, *INTERVALLI[nome])
+for motivo in esclusi.values():
+    st.caption(f"ℹ️ {motivo}")
+
+parametri = []
+for nome, (etichetta, minimo_ui, default) in candidati.items():
+    valore_base = valore_config(config_base, nome, default)
+    if valore_base is None:
+        valore_base = default
+    col0, col1, col2, col3 = st.columns([2, 1, 1, 1])
+    with col0:
+        attivo = st.checkbox(etichetta, value=nome in ("max_personale", "max_carrelli"), key=f"sw_on_{nome}")
+    if not attivo:
+        continue
+    passo_default = 60 if nome in ("work_std", "extension") else 1
+    with col1:
+        vmin = st.number_input("Min", min_value=minimo_ui, value=max(minimo_ui, int(valore_base)),
+                               step=passo_default, key=f"sw_min_{nome}")
+    with col2:
+        vmax = st.number_input("Max", min_value=minimo_ui, value=int(valore_base) + 2 * passo_default,
+                               step=passo_default, key=f"sw_max_{nome}")
+    with col3:
+        passo = st.number_input("Passo", min_value=1, value=passo_default, step=1, key=f"sw_step_{nome}")
+    parametri.append(ParametroSweep(nome, vmin, max(vmin, vmax), passo))
+
+# --- Disegno ---
+st.subheader("Disegno dell'esperimento")
+col_d1, col_d2, col_d3 = st.columns(3)
+with col_d1:
+    disegno = st.selectbox("Disegno", DISEGNI, format_func={
+        'griglia': "Griglia completa", 'lhs': "Latin hypercube", 'adattivo': "Adattivo (raffina il fronte)"
+    }.get)
+with col_d2:
+    n_punti = st.number_input("Numero punti (LHS/adattivo)", min_value=2, value=30, step=1,
+                              disabled=disegno == 'griglia')
+with col_d3:
+    seed = st.number_input("Seed", min_value=0, value=0, step=1)
+
+n_griglia = 1
+for p in parametri:
+    n_griglia *= len(p.valori())
+if disegno == 'griglia':
+    st.caption(f"La griglia contiene {n_griglia} configurazioni (i punti dominati vengono potati).")
+
+job_id = selettore_job("sweep", "job_sweep")
+if st.button("🚀 Avvia sweep", disabled=not parametri):
+    payload = {
+        "input": raccogli_input(st.session_state),
+        "config_base": config_base,
+        "parametri": parametri,
+        "disegno": disegno,
+        "n_punti": int(n_punti),
+        "seed": int(seed),
+    }
+    try:
+        job_id = get_job_manager().invia(
+            "sweep", owner_corrente(), payload,
+            descrizione=f"Sweep {disegno} su {', '.join(p.nome for p in parametri)}",
+            # I punti simulati alimentano anche il surrogato della Pagina 7
+            funzione=esegui_sweep_e_registra
+        )
+        st.session_state["job_sweep"] = job_id
+    except RuntimeError as e:
+        st.error(f"❌ {e}")
+
+if not job_id:
+    st.stop()
+
+info = mostra_job(job_id)
+if info and info["stato"] == "in_esecuzione":
+    df_parz = risultati_parziali(job_id)
+    if df_parz is not None:
+        st.dataframe(df_parz, use_container_width=True)
+if not info or info["stato"] != "completato":
+    st.stop()
+
+df_sweep = risultato_job(job_id)
+nomi_par = [c for c in df_sweep.columns if c not in COLONNE_KPI + ['Potato', 'Pareto']]
+st.session_state["ultimo_sweep"] = {"config_base": config_base, "risultati": df_sweep}
+
+# --- Risultati ---
+st.subheader("Risultati dello sweep")
+c1, c2, c3 = st.columns(3)
+c1.metric("Configurazioni", len(df_sweep))
+c2.metric("Simulate", int((~df_sweep['Potato']).sum()))
+c3.metric("Sul fronte di Pareto", int(df_sweep['Pareto'].sum()))
+
+df_val = df_sweep[~df_sweep['Potato']].copy()
+df_val['Fronte'] = df_val['Pareto'].map({True: 'Pareto', False: 'Dominato'})
+fig = px.scatter(
+    df_val, x='ore_personale', y='makespan_min', color='energia_tot', symbol='Fronte',
+    hover_data=nomi_par, title='Makespan vs ore operatore (colore: energia)'
+)
+st.plotly_chart(fig, use_container_width=True)
+fig3d = px.scatter_3d(
+    df_val, x='ore_personale', y='makespan_min', z='energia_tot', color='Fronte', hover_data=nomi_par,
+    title='Fronte di Pareto: makespan, ore operatore, energia'
+)
+st.plotly_chart(fig3d, use_container_width=True)
+
+st.markdown("**Configurazioni sul fronte di Pareto**")
+df_pareto = df_sweep[df_sweep['Pareto']].sort_values('makespan_min')
+st.dataframe(df_pareto[nomi_par + COLONNE_KPI], use_container_width=True)
+
+with st.expander("Tutte le configurazioni"):
+    st.dataframe(df_sweep, use_container_width=True)
+
+if st.button("💾 Aggiungi configurazioni Pareto agli scenari"):
+    for punto in df_pareto[nomi_par].to_dict('records'):
+        st.session_state["scenari"].append(applica_punto(config_base, punto))
+    st.success(f"✅ {len(df_pareto)} scenari aggiunti (vedi Pagina 2)")
@@ -0,0 +1,61 @@
+# pages/9_Esportazione.py
+
+import os
+import uuid
+import streamlit as st
+from lib.style import apply_custom_style
+from lib.jobs import get_job_manager, JOBS_DIR
+from lib.job_panel import owner_corrente, selettore_job, mostra_job, risultato_job
+from lib.export import esegui_esportazione
+
+st.set_page_config(page_title="9. Esportazione", layout="wide")
+apply_custom_style()
+
+if not st.session_state.get("logged_in"):
+    st.error("❌ Login richiesto"); st.stop()
+
+if "risultati_scenari" not in st.session_state:
+    st.warning("⚠️ Esegui prima la simulazione nella pagina 3.")
+    st.stop()
+
+st.title("9. Esportazione Risultati")
+st.markdown(
+    "Esporta in un solo passaggio tutti gli scenari: un file Excel con log eventi, "
+    "liste di dispacciamento per macchina e piano operatori per giorno, più gli stessi "
+    "dati in formato Parquet."
+)
+
+risultati = st.session_state["risultati_scenari"]
+scelti = st.multiselect("Scenari da esportare", list(risultati), default=list(risultati))
+
+job_id = selettore_job("export", "job_export")
+if st.button("📦 Avvia esportazione", disabled=not scelti):
+    payload = {
+        "risultati": {nome: risultati[nome] for nome in scelti},
+        "cartella": os.path.join(JOBS_DIR, "export", uuid.uuid4().hex[:12]),
+    }
+    try:
+        job_id = get_job_manager().invia(
+            "export", owner_corrente(), payload,
+            descrizione=f"Esportazione di {len(scelti)} scenari",
+            funzione=esegui_esportazione
+        )
+        st.session_state["job_export"] = job_id
+    except RuntimeError as e:
+        st.error(f"❌ {e}")
+
+if not job_id:
+    st.stop()
+
+info = mostra_job(job_id)
+if not info or info["stato"] != "completato":
+    st.stop()
+
+file = risultato_job(job_id)
+col1, col2 = st.columns(2)
+with col1, open(file["schedulazione.xlsx"], "rb") as f:
+    st.download_button("📥 Scarica Excel", f, file_name="schedulazione.xlsx",
+                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+with col2, open(file["schedulazione.zip"], "rb") as f:
+    st.download_button("📥 Scarica tutto (Excel + Parquet, zip)", f, file_name="schedulazione.zip",
+                       mime="application/zip")
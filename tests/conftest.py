@@ -0,0 +1,51 @@
+"""
+tests/conftest.py
+Dati di prova comuni: ciclo a quattro fasi (IMPASTO, FORNO, CONFEZIONAMENTO, AUTOCLAVI) e
+lotti distribuiti su due giorni con scadenza, nel formato di `lib.jobs.raccogli_input`.
+"""
+import pandas as pd
+import pytest
+
+from lib.jobs import CHIAVI_INPUT
+
+CONFIG = {"max_carrelli": 10, "max_personale": 4, "machine_caps": {}, "work_std": 960, "work_ven": 840,
+          "workday_minutes": 1440, "extension": 0, "fri38": 4, "includi_posticipi": True,
+          "includi_fisiologici": True, "variability_factor": 0.0, "margin_pct": 0.0, "granularity": 15,
+          "filter_format": [], "filter_line": [], "data_inizio": None}
+
+
+def _crea_inputs(n_lotti):
+    df_fasi = pd.DataFrame({
+        'Fase': ['IMPASTO', 'FORNO', 'CONFEZIONAMENTO', 'AUTOCLAVI'],
+        'Macchina': ['IMP1', 'FORNO1', 'CONF1', 'AUTO1'], 'Prodotto': ['P1'] * 4,
+        'Tempo': [30, 60, 45, 120], 'Addetti': [2, 1, 2, 1], 'Pezzi': [100, 200, 150, 0],
+        'EnergiaFase': [1.0, 5.0, 0.5, 3.0], 'Variabilità': [0] * 4,
+    })
+    df_lotti = pd.DataFrame({
+        'Giorno': pd.to_datetime(['2025-03-03'] * (n_lotti // 2) + ['2025-03-04'] * (n_lotti - n_lotti // 2)),
+        'Lotto': [f'L{i}' for i in range(n_lotti)], 'Prodotto': ['P1'] * n_lotti,
+        'Formato': (['A', 'B'] * n_lotti)[:n_lotti],
+        'Quantità': ([500, 300, 400, 800, 200, 600] * n_lotti)[:n_lotti],
+        'Scadenza': pd.to_datetime(['2025-03-05'] * n_lotti),
+    })
+    df_posticipi = pd.DataFrame(columns=['Lotto', 'Fase', 'Ritardo_Minuti'])
+    df_equivalenze = pd.DataFrame(columns=['Formato', 'Fase', 'Equivalenza_Unita'])
+    df_fisiologici = pd.DataFrame(columns=['FORMATO', 'FASE', 'QUANDO', 'TEMPO'])
+    return dict(zip(CHIAVI_INPUT, (df_lotti, df_fasi, df_posticipi, df_equivalenze, df_fisiologici)))
+
+
+@pytest.fixture
+def config():
+    return dict(CONFIG)
+
+
+@pytest.fixture
+def crea_inputs():
+    """Fabbrica degli input con `n_lotti` lotti."""
+    return _crea_inputs
+
+
+@pytest.fixture
+def inputs():
+    """I 12 lotti di riferimento."""
+    return _crea_inputs(12)
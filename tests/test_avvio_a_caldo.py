@@ -0,0 +1,34 @@
+"""
+tests/test_avvio_a_caldo.py
+Avvio a caldo dal consultivo: le fasi completate non vengono risimulate e quelle in corso
+riprendono dall'istante con il solo lavoro residuo.
+"""
+import pandas as pd
+
+from lib.jobs import simula
+from lib.simulator import stato_da_consultivo
+
+ISTANTE = pd.Timestamp('2025-03-03 09:30')
+
+
+def test_avvio_a_caldo_salta_le_fasi_completate(inputs, config):
+    df_freddo = simula(inputs, config)[0]
+    # Consultivo "perfetto": il piano a freddo eseguito fino all'istante
+    consultivo = df_freddo.rename(columns={'TimestampStart': 'Start_Actual', 'TimestampEnd': 'End_Actual'})
+    df_stato = stato_da_consultivo(consultivo, ISTANTE, config)
+    assert df_stato['Completata'].any() and (~df_stato['Completata']).any()
+
+    df_caldo = simula(dict(inputs, df_stato_iniziale=df_stato), config)[0]
+
+    chiavi = ['ID_Lotto', 'Fase']
+    completate = set(map(tuple, df_stato.loc[df_stato['Completata'], chiavi].to_numpy()))
+    simulate = set(map(tuple, df_caldo[chiavi].to_numpy()))
+    assert not completate & simulate
+    assert simulate == set(map(tuple, df_freddo[chiavi].to_numpy())) - completate
+
+    # Le fasi in corso ripartono all'istante e finiscono come nel piano a freddo
+    in_corso = df_stato.loc[~df_stato['Completata'], chiavi].merge(df_caldo, on=chiavi)
+    attese = in_corso[chiavi].merge(df_freddo, on=chiavi)
+    assert (in_corso['TimestampStart'] == ISTANTE).all()
+    assert (in_corso['TimestampEnd'].to_numpy() == attese['TimestampEnd'].to_numpy()).all()
+    assert df_caldo['TimestampStart'].min() >= ISTANTE
@@ -0,0 +1,78 @@
+"""
+tests/test_calibrazione.py
+Calibrazione delle durate: quantili del rapporto reale / teorico e scarto degli anomali su
+dati sintetici, e rapporti unitari sul consultivo che ripete il piano simulato.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from lib.calibrazione import calibra_durate, rapporti_durata, scarta_anomali
+from lib.jobs import simula
+from lib.simulator import QUANTILI_DURATE, COLONNE_QUANTILI, TUTTI, calendario_turni
+
+MEDIANA = 1.2
+SIGMA_LOG = 0.2
+N = 4000
+N_ANOMALI = 25
+
+
+@pytest.fixture
+def rapporti():
+    rng = np.random.default_rng(0)
+    rapporto = np.concatenate([MEDIANA * np.exp(rng.normal(0.0, SIGMA_LOG, N)), np.full(N_ANOMALI, 20.0)])
+    forno = pd.DataFrame({'Fase': 'FORNO', 'Formato': 'A', 'Macchina': 'FORNO1', 'Rapporto': rapporto})
+    # Gruppo raro: sotto min_campioni, entra solo nei livelli generalizzati
+    raro = pd.DataFrame({'Fase': 'FORNO', 'Formato': 'B', 'Macchina': 'FORNO1', 'Rapporto': [MEDIANA] * 5})
+    return pd.concat([forno, raro], ignore_index=True)
+
+
+def test_scarta_solo_gli_anomali(rapporti):
+    tenuti = scarta_anomali(rapporti)
+    assert (~tenuti).sum() >= N_ANOMALI
+    assert not tenuti[rapporti['Rapporto'] == 20.0].any()
+    # Con sigma 0.2 e soglia 3.5 i campioni normali scartati sono una frazione trascurabile
+    assert (~tenuti).sum() - N_ANOMALI < 0.005 * N
+
+
+def test_quantili_della_lognormale(rapporti):
+    df = calibra_durate(rapporti, min_campioni=20)
+    riga = df[(df['Formato'] == 'A') & (df['Macchina'] == 'FORNO1')].iloc[0]
+
+    assert riga['N'] + riga['N_scartati'] == N + N_ANOMALI
+    assert riga['Mediana'] == pytest.approx(MEDIANA, rel=0.02)
+    assert riga['Sigma_log'] == pytest.approx(SIGMA_LOG, rel=0.05)
+    interni = (QUANTILI_DURATE >= 0.05) & (QUANTILI_DURATE <= 0.95)
+    attesi = MEDIANA * np.exp(SIGMA_LOG * stats.norm.ppf(QUANTILI_DURATE[interni]))
+    stimati = riga[np.array(COLONNE_QUANTILI)[interni]].to_numpy(dtype=float)
+    assert stimati == pytest.approx(attesi, rel=0.03)
+    assert (np.diff(riga[COLONNE_QUANTILI].to_numpy(dtype=float)) >= 0).all()
+    # Il massimo non risente degli anomali scartati
+    assert riga['Q100'] < 20.0
+
+    # Il gruppo raro non ha una riga propria ma entra nei livelli (Fase, Formato) e Fase
+    assert not ((df['Formato'] == 'B') & (df['Macchina'] == 'FORNO1')).any()
+    livello_fase = df[(df['Formato'] == TUTTI) & (df['Macchina'] == TUTTI)].iloc[0]
+    assert livello_fase['N'] == riga['N'] + 5
+
+
+def test_rapporti_unitari_sul_piano_simulato(inputs, config):
+    df_risultati, _, _, _, df_eventi = simula(inputs, config, con_eventi=True)
+    consultivo = df_risultati.rename(columns={'TimestampStart': 'Start_Actual', 'TimestampEnd': 'End_Actual'})
+    df_rapporti = rapporti_durata(consultivo, inputs['df_lotti'], inputs['df_fasi'], config)
+    assert len(df_rapporti) == len(df_risultati)
+
+    # Le fasi lavorate senza pause (a parte la notte) durano quanto previsto in minuti lavorativi;
+    # quelle riprese dopo un'attesa in coda hanno un rapporto maggiore
+    chunk = {evento: df_eventi[df_eventi['Evento'] == evento].groupby(['ID_Lotto', 'Fase'])['SimTime'].apply(list)
+             for evento in ('INIZIO_CHUNK', 'FINE_CHUNK')}
+    zero = df_risultati['TimestampStart'].min() # Tempo 0 della simulazione
+    calendario = calendario_turni(config, zero, 10, zero)
+    df_rapporti = df_rapporti.set_index(['ID_Lotto', 'Fase'])
+    continue_ = [chiave for chiave in df_rapporti.index
+                 if (calendario.lavorativi(chunk['INIZIO_CHUNK'][chiave][1:])
+                     == calendario.lavorativi(chunk['FINE_CHUNK'][chiave][:-1])).all()]
+    assert len(continue_) > len(df_rapporti) / 2
+    assert df_rapporti.loc[continue_, 'Rapporto'].to_numpy() == pytest.approx(1.0)
+    assert (df_rapporti['Rapporto'] >= 1 - 1e-9).all()
@@ -0,0 +1,35 @@
+"""
+tests/test_export.py
+Esportazione di più scenari con log eventi di colonne diverse (fasi a batch e aree).
+"""
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from lib.export import esporta_scenari
+from lib.jobs import simula
+
+
+def _risultato(inputs, config):
+    df_risultati, _, _, _, df_eventi = simula(inputs, config, con_eventi=True)
+    return {'df_risultati': df_risultati, 'df_eventi': df_eventi}
+
+
+@pytest.mark.parametrize("ordine", [1, -1])
+def test_esporta_scenari_con_colonne_diverse(inputs, config, tmp_path, ordine):
+    config_speciale = dict(config, fasi_batch={'AUTOCLAVI': {'capacita': 3, 'attesa_max': 60}},
+                           aree={'CONFEZIONAMENTO': {'capacita': 2}})
+    risultati = {'Base': _risultato(inputs, config), 'Batch e aree': _risultato(inputs, config_speciale)}
+    risultati = dict(list(risultati.items())[::ordine])
+    assert set(risultati['Batch e aree']['df_eventi'].columns) != set(risultati['Base']['df_eventi'].columns)
+
+    file = esporta_scenari(risultati, str(tmp_path))
+
+    eventi = pq.read_table(file['eventi.parquet']).to_pandas()
+    for nome, risultato in risultati.items():
+        assert (eventi['Scenario'] == nome).sum() == len(risultato['df_eventi'])
+    colonne_extra = set(risultati['Batch e aree']['df_eventi'].columns) - set(risultati['Base']['df_eventi'].columns)
+    assert eventi.loc[eventi['Scenario'] == 'Base', sorted(colonne_extra)].isna().all().all()
+    dispacciamento = pq.read_table(file['dispacciamento.parquet']).to_pandas()
+    assert len(dispacciamento) == sum(len(r['df_risultati']) for r in risultati.values())
+    assert len(pd.ExcelFile(file['schedulazione.xlsx']).sheet_names) > 2
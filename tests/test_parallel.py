@@ -0,0 +1,51 @@
+"""
+tests/test_parallel.py
+Simulazione partizionata per linea: le quote di operatori e carrelli rispettano i totali e
+coprono la fase più esigente di ogni linea.
+"""
+import pytest
+
+from lib.kpi import calcola_kpi
+from lib.parallel import ripartisci, simula_per_linea
+
+
+@pytest.mark.parametrize("totale, pesi, minimo", [
+    (7, [3, 1, 0], [1, 1, 0]),
+    (10, [1, 1, 1], 2),
+    (4, [0, 0], 1),
+])
+def test_ripartisci_somma_e_minimi(totale, pesi, minimo):
+    quote = ripartisci(totale, pesi, minimo)
+    assert sum(quote) == totale
+    assert all(q >= m for q, m in zip(quote, [minimo] * len(pesi) if isinstance(minimo, int) else minimo))
+
+
+def test_ripartisci_minimi_oltre_il_totale():
+    with pytest.raises(ValueError):
+        ripartisci(3, [1, 1], [2, 2])
+
+
+@pytest.fixture
+def inputs_linee(inputs):
+    df_lotti = inputs['df_lotti'].copy()
+    df_lotti['Linea'] = ['A', 'B'] * (len(df_lotti) // 2)
+    return dict(inputs, df_lotti=df_lotti)
+
+
+@pytest.mark.parametrize("max_personale", [4, 5])
+def test_quote_per_linea_entro_i_totali(inputs_linee, config, max_personale):
+    config = dict(config, max_personale=max_personale)
+    *risultati, df_allocazione = simula_per_linea(inputs_linee, config, max_workers=2)
+
+    assert set(df_allocazione['Linea']) == {'A', 'B'}
+    assert df_allocazione['max_personale'].sum() <= config['max_personale']
+    assert df_allocazione['max_carrelli'].sum() <= config['max_carrelli']
+    # IMPASTO e CONFEZIONAMENTO prelevano 2 addetti insieme
+    assert (df_allocazione['max_personale'] >= 2).all()
+    assert risultati[0]['ID_Lotto'].nunique() == len(inputs_linee['df_lotti'])
+    assert calcola_kpi(*risultati[:4], config=config)['picco_persone'] <= config['max_personale']
+
+
+def test_totale_sotto_i_minimi_delle_linee(inputs_linee, config):
+    with pytest.raises(ValueError):
+        simula_per_linea(inputs_linee, dict(config, max_personale=3), max_workers=2)
@@ -0,0 +1,58 @@
+"""
+tests/test_pianificazione.py
+Passo all'indietro dalle scadenze: ultimi inizi sul calendario di ogni fase e rilascio dei lotti.
+"""
+import pandas as pd
+import pytest
+
+from lib.kpi import calcola_kpi
+from lib.jobs import simula
+from lib.simulator import calendario_turni
+
+ORIGINE = pd.Timestamp('2025-02-01')
+# Turni corti: le fasi attraversano la fine del turno e l'estensione conta
+TURNI_CORTI = {'work_std': 480, 'work_ven': 480, 'Turni_modificati': ['FORNO']}
+
+
+def _ultimi_inizi(inputs, config):
+    df = simula(inputs, config)[0]
+    return df.pivot_table(index='ID_Lotto', columns='Fase', values='InizioUltimo', aggfunc='first')
+
+
+@pytest.mark.parametrize("estensione", [0, 120])
+def test_ultimi_inizi_sul_calendario_della_fase(inputs, config, estensione):
+    config = dict(config, **TURNI_CORTI, extension=estensione)
+    inizi = _ultimi_inizi(inputs, config)
+    calendario = calendario_turni(config, ORIGINE, 60, ORIGINE, estesa=True)
+    quantita = inputs['df_lotti'].set_index('Lotto')['Quantità']
+
+    def lavorativi(istanti):
+        return calendario.lavorativi(((istanti - ORIGINE) / pd.Timedelta(minutes=1)).to_numpy(dtype=float))
+
+    # FORNO (200 pezzi ogni 60 minuti) finisce al più tardi all'ultimo inizio di CONFEZIONAMENTO
+    svolti = lavorativi(inizi['CONFEZIONAMENTO']) - lavorativi(inizi['FORNO'])
+    assert svolti == pytest.approx((quantita[inizi.index] / 200 * 60).to_numpy(), abs=1)
+
+
+def test_estensione_sposta_gli_ultimi_inizi(inputs, config):
+    base = _ultimi_inizi(inputs, dict(config, **TURNI_CORTI))
+    estesi = _ultimi_inizi(inputs, dict(config, **TURNI_CORTI, extension=120))
+    assert (estesi['CONFEZIONAMENTO'] == base['CONFEZIONAMENTO']).all()
+    assert (estesi['FORNO'] >= base['FORNO']).all() and (estesi['FORNO'] > base['FORNO']).any()
+
+
+def test_pianificazione_indietro_non_peggiora_i_ritardi(inputs, config):
+    avanti = calcola_kpi(*simula(inputs, config), config)
+    config_indietro = dict(config, pianificazione='indietro')
+    indietro = calcola_kpi(*simula(inputs, config_indietro), config_indietro)
+    assert indietro['ritardo_totale_min'] <= avanti['ritardo_totale_min']
+
+
+def test_pianificazione_indietro_riduce_il_lead_time(inputs, config):
+    inputs['df_lotti']['Scadenza'] = pd.to_datetime('2025-03-05') + pd.to_timedelta(
+        [0, 0, 1, 1, 2, 2, 3, 3, 6, 7, 8, 9], 'D')
+    avanti = calcola_kpi(*simula(inputs, config), config)
+    config_indietro = dict(config, pianificazione='indietro')
+    indietro = calcola_kpi(*simula(inputs, config_indietro), config_indietro)
+    assert indietro['ritardo_totale_min'] <= avanti['ritardo_totale_min']
+    assert indietro['lead_time_medio_min'] < avanti['lead_time_medio_min']
@@ -0,0 +1,21 @@
+"""
+tests/test_staffing.py
+Il riferimento dell'ottimizzazione organico (organico uniforme massimo) deve essere fattibile.
+"""
+import pytest
+
+from lib.staffing import ottimizza_organico
+
+
+@pytest.mark.parametrize("n_lotti,n_turni,max_operatori", [(4, 1, 2), (12, 2, 4), (12, 3, 3)])
+def test_organico_uniforme_massimo_fattibile(crea_inputs, config, n_lotti, n_turni, max_operatori):
+    migliore, kpi_rif, df_storia = ottimizza_organico(
+        crea_inputs(n_lotti), config, n_turni=n_turni, max_operatori=max_operatori, max_iterazioni=2, max_workers=2
+    )
+    riferimento = df_storia.iloc[0]
+    assert riferimento['Organico'] == ' / '.join([str(max_operatori)] * n_turni)
+    assert bool(riferimento['Fattibile'])
+    assert riferimento['makespan_min'] == kpi_rif['makespan_min']
+    scelto = df_storia[df_storia['Scelto']].iloc[0]
+    assert scelto['makespan_min'] <= kpi_rif['makespan_min']
+    assert max(migliore.organico) <= max_operatori
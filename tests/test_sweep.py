@@ -0,0 +1,29 @@
+"""
+tests/test_sweep.py
+Parametri esplorabili da sweep e sensitività: l'estensione del turno è esclusa, con il
+motivo, quando lo scenario non ha fasi in Turni_modificati e quindi non cambierebbe i KPI.
+"""
+import pytest
+
+from lib.jobs import simula
+from lib.kpi import calcola_kpi
+from lib.sweep import parametri_scenario, PREFISSO_MACCHINA
+
+TURNI_CORTI = {'work_std': 480, 'work_ven': 480}
+
+
+def _makespan(inputs, config):
+    return calcola_kpi(*simula(inputs, config), config=config)['makespan_min']
+
+
+@pytest.mark.parametrize("turni_modificati", [[], ['FORNO']])
+def test_estensione_esclusa_solo_se_senza_effetto(inputs, config, turni_modificati):
+    config = dict(config, **TURNI_CORTI, Turni_modificati=turni_modificati)
+    parametri, esclusi = parametri_scenario(config, inputs['df_fasi'])
+
+    effetto = _makespan(inputs, dict(config, extension=240)) != _makespan(inputs, dict(config, extension=0))
+    assert ('extension' in parametri) == effetto
+    assert ('extension' in esclusi) != effetto
+    if not effetto:
+        assert 'Turni_modificati' in esclusi['extension']
+    assert f"{PREFISSO_MACCHINA}FORNO1" in parametri
@@ -0,0 +1,32 @@
+"""
+tests/test_trasferimenti.py
+Lotti di trasferimento: le fasi successive iniziano alla prima porzione completata e il
+lead time dei lotti si accorcia.
+"""
+from lib.jobs import simula
+from lib.kpi import calcola_kpi
+
+TRASFERIMENTI = {'IMPASTO': 100, 'FORNO': 100}
+
+
+def test_fase_successiva_inizia_alla_prima_porzione(crea_inputs, config):
+    # Operatori a volontà: le fasi in sovrapposizione non si contendono il personale
+    config = dict(config, max_personale=10, lotti_trasferimento=TRASFERIMENTI)
+    df = simula(crea_inputs(1), config)[0].set_index('Fase')
+
+    # IMPASTO: 30 min ogni 100 pezzi, la prima porzione esce dopo 30 minuti
+    assert df.loc['FORNO', 'Start'] == df.loc['IMPASTO', 'Start'] + 30
+    assert df.loc['FORNO', 'Start'] < df.loc['IMPASTO', 'End']
+    # FORNO: 60 min ogni 200 pezzi, la prima porzione da 100 esce dopo 30 minuti
+    assert df.loc['CONFEZIONAMENTO', 'Start'] == df.loc['FORNO', 'Start'] + 30
+    # AUTOCLAVI è senza lotto di trasferimento: attende la fine del confezionamento
+    assert df.loc['AUTOCLAVI', 'Start'] >= df.loc['CONFEZIONAMENTO', 'End']
+
+
+def test_trasferimenti_accorciano_il_lead_time(inputs, config):
+    config_trasf = dict(config, lotti_trasferimento=TRASFERIMENTI)
+    base = calcola_kpi(*simula(inputs, config), config=config)
+    trasf = calcola_kpi(*simula(inputs, config_trasf), config=config_trasf)
+
+    assert trasf['lead_time_medio_min'] < base['lead_time_medio_min']
+    assert trasf['makespan_min'] <= base['makespan_min']